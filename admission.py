@@ -0,0 +1,156 @@
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class Overloaded(Exception):
+    """Request rejected by admission control; maps to HTTP 429 + Retry-After."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Consume one token; return 0 on success or the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+def per_worker(limits, workers):
+    """
+    Split server-wide limits evenly across `workers` processes. Counts round
+    up (at least 1 per worker, so their sum may slightly exceed the total);
+    the client rate is divided exactly. A client whose requests all land on
+    one worker (keep-alive) only gets that worker's share of its rate.
+    """
+    workers = max(1, workers)
+    shares = {key: max(1, math.ceil(value / workers)) for key, value in limits.items()}
+    if "client_rate" in limits:
+        shares["client_rate"] = limits["client_rate"] / workers
+    return shares
+
+
+class AdmissionController:
+    """
+    Global in-flight cap + per-client token buckets + a bounded FIFO wait
+    queue with a deadline. Rejections are fast (no upstream work is done),
+    so under overload the service keeps serving `max_in_flight` requests
+    at full speed instead of letting every request time out.
+
+    All state is per process. With several workers, build it with
+    `per_worker` limits so the configured values stay the totals of the
+    whole server (see app.py).
+    """
+
+    def __init__(self, max_in_flight=16, max_queue=64, queue_timeout=5.0,
+                 client_rate=1.0, client_burst=5, max_clients=10000):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_clients = max_clients
+        self.in_flight = 0
+        self._waiters = deque()
+        self._buckets = OrderedDict()
+        self._service_time = 1.0
+        self.metrics = {"admitted": 0, "queued": 0, "shed_rate_limited": 0,
+                        "shed_queue_full": 0, "shed_queue_timeout": 0}
+
+    def _bucket(self, client_id):
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            bucket = TokenBucket(self.client_rate, self.client_burst)
+            self._buckets[client_id] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client_id)
+        return bucket
+
+    def _queue_wait_estimate(self):
+        return self._service_time * (len(self._waiters) + 1) / self.max_in_flight
+
+    async def acquire(self, client_id):
+        """Take an execution slot for `client_id` or raise Overloaded."""
+        if self.client_rate > 0:
+            wait = self._bucket(client_id).take()
+            if wait:
+                self.metrics["shed_rate_limited"] += 1
+                raise Overloaded("rate_limited", wait)
+
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self.metrics["admitted"] += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.metrics["shed_queue_full"] += 1
+            raise Overloaded("queue_full", self._queue_wait_estimate())
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.metrics["queued"] += 1
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.metrics["shed_queue_timeout"] += 1
+            raise Overloaded("queue_timeout", self._queue_wait_estimate())
+        except asyncio.CancelledError:
+            # Client went away; if the slot was already handed over, pass it on.
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            if future in self._waiters:
+                self._waiters.remove(future)
+        self.metrics["admitted"] += 1
+
+    def release(self, service_time=None):
+        """Free a slot, handing it directly to the oldest live waiter."""
+        if service_time is not None:
+            self._service_time += 0.2 * (service_time - self._service_time)
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, client_id):
+        await self.acquire(client_id)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self):
+        return dict(
+            self.metrics,
+            in_flight=self.in_flight,
+            queue_depth=len(self._waiters),
+            max_in_flight=self.max_in_flight,
+            max_queue=self.max_queue,
+            tracked_clients=len(self._buckets),
+            avg_service_time_s=self._service_time,
+        )
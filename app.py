@@ -1,12 +1,36 @@
-from fastapi import FastAPI, HTTPException, Form, UploadFile, File
+from contextlib import asynccontextmanager
+import asyncio
+from fastapi import FastAPI, HTTPException, Form, UploadFile, File, Request, WebSocket
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
-from chatbot import get_chatbot_response, remove_think_tags
+from chatbot import get_chatbot_response, answer_batch, remove_think_tags, warm_up, readiness, get_embedding_batcher, get_model_router, retrieval_cache, shard_stats, breaker_stats, get_index_reloader, get_mongodb_client
+from search_filters import parse_filters
+from code_chunker import build_upload_context
+from admission import AdmissionController, Overloaded, per_worker
+from conversations import ConversationStore
+from profiling import RequestProfiler, PROFILE_TOKEN, PROFILE_SAMPLE_RATE
+from ws_chat import ChatSocketServer
 import re
 import os
+import orjson
 from fastapi.middleware.cors import CORSMiddleware
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up Mongo, prompt and embedding client in the background so /health answers immediately."""
+    warm_up_task = asyncio.create_task(warm_up())
+    # Local index hot-swap: new snapshot generations are mapped in the background
+    reloader = get_index_reloader()
+    reload_task = asyncio.create_task(reloader.run()) if reloader else None
+    yield
+    if not warm_up_task.done():
+        warm_up_task.cancel()
+    if reload_task:
+        reload_task.cancel()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -17,16 +41,65 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Debug: print environment variables for keys
-print("[DEBUG] GEMINI_API_KEY:", os.getenv("GEMINI_API_KEY"))
-print("[DEBUG] MONGODB_URI:", os.getenv("MONGODB_URI"))
-print("[DEBUG] CEREBRAS_API_KEY:", os.getenv("CEREBRAS_API_KEY"))
+# Compress large bodies (long answers / full context)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Per-request profiling (PROFILE_TOKEN / PROFILE_SAMPLE_RATE); not installed at all when off
+request_profiler = RequestProfiler()
+if request_profiler.enabled:
+    app.middleware("http")(request_profiler.middleware)
+elif PROFILE_TOKEN or PROFILE_SAMPLE_RATE > 0:
+    print("⚠️ Profiling is configured but pyinstrument is not installed")
+
+# Debug: report which keys are configured (never print the values)
+for _key in ("GEMINI_API_KEY", "MONGODB_URI", "CEREBRAS_API_KEY"):
+    print(f"[DEBUG] {_key} set:", bool(os.getenv(_key)))
+
+# Uploads: size limit and prompt budget for the selected chunks
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(512 * 1024)))
+UPLOAD_CONTEXT_CHARS = int(os.getenv("UPLOAD_CONTEXT_CHARS", "6000"))
+
+# Admission control for /api/chat. The limits are server-wide totals; every
+# gunicorn worker (WEB_CONCURRENCY, exported by gunicorn.conf.py) enforces its
+# share in its own memory, so a client cannot multiply its rate by the workers.
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+admission = AdmissionController(
+    queue_timeout=float(os.getenv("QUEUE_TIMEOUT_S", "5")),
+    **per_worker({
+        "max_in_flight": int(os.getenv("MAX_IN_FLIGHT", "16")),
+        "max_queue": int(os.getenv("MAX_QUEUE", "64")),
+        "client_rate": float(os.getenv("CLIENT_RATE_PER_S", "1")),
+        "client_burst": int(os.getenv("CLIENT_BURST", "5")),
+    }, WORKERS),
+)
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "1") == "1"
+
+# Server-side chat histories (Mongo `conversations`, shared by all workers).
+# Ids come from POST /api/conversations and belong to the client that created them.
+async def conversation_collection():
+    client = await get_mongodb_client()
+    return client["chatcodeai"]["conversations"]
+
+conversations = ConversationStore(
+    conversation_collection,
+    ttl=float(os.getenv("CONVERSATION_TTL_S", "3600")),
+    max_messages=int(os.getenv("CONVERSATION_MAX_MESSAGES", "40")),
+)
+
+# Batch endpoint limits
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "5000"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
 
 # Define response model
 class ChatResponse(BaseModel):
     answer: str
     context: str
     chat_history: list[dict]
+    degraded: bool = False  # answer built without the LLM (upstream down or out of time)
+
+def fast_json(payload) -> Response:
+    """Serialize with orjson, bypassing response-model validation."""
+    return Response(content=orjson.dumps(payload), media_type="application/json")
 
 def minify_code(code: str) -> str:
     """Remove blank lines and comments from code."""
@@ -38,12 +111,42 @@ def minify_code(code: str) -> str:
     code = '\n'.join([line for line in code.splitlines() if line.strip()])
     return code
 
+def get_client_id(request: Request) -> str:
+    """Admission key: API key if given, else the client IP (first X-Forwarded-For hop behind a proxy)."""
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        return f"key:{api_key}"
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return f"ip:{forwarded.split(',')[0].strip()}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": f"Server busy ({exc.reason}), retry later."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(
+    request: Request,
     question: str = Form(...),
     model: str = Form(...),  # Nhận model từ FE
-    file: UploadFile = File(None)
+    file: UploadFile = File(None),
+    filters: str = Form(None),  # vd: "type=react_example;tags=hooks" hoặc JSON
+    conversation_id: str = Form(None),  # from POST /api/conversations: server-side history
+    lean: bool = Form(False),  # only return the new turn + history_version
+    include_context: str = Form(None)  # "full" | "ids" | "none" (default: full, or none when lean)
 ):
+    # Admission control: fail fast with 429 instead of piling work on Gemini/Cerebras
+    client_id = get_client_id(request)
+    async with admission.slot(client_id):
+        return await _chat(question, model, file, filters, conversation_id, lean, include_context, client_id)
+
+async def _chat(question, model, file, filters, conversation_id=None, lean=False, include_context=None, client_id=None):
     try:
         # Debug: print incoming question, model, and file info
         print(f"[DEBUG] Received question: {question}")
@@ -51,17 +154,21 @@ async def chat(
         if file:
             print(f"[DEBUG] Received file: {file.filename}, size: {file.size if hasattr(file, 'size') else 'unknown'}")
 
+        try:
+            parsed_filters = parse_filters(filters)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid filters: {e}")
+
         # Process file if provided
         file_content = None
         if file:
-            if file.size > 5 * 1024:  # Limit file size to 5KB
+            if file.size and file.size > MAX_UPLOAD_BYTES:
                 print("[DEBUG] File too large!")
-                raise HTTPException(status_code=400, detail="File exceeds 5KB.")
+                raise HTTPException(status_code=400, detail=f"File exceeds {MAX_UPLOAD_BYTES // 1024}KB.")
             try:
                 file_content = await file.read()
                 file_content = file_content.decode("utf-8")
-                file_content = minify_code(file_content)
-                print(f"[DEBUG] Minified file content: {file_content[:100]}...")
+                print(f"[DEBUG] File content: {file_content[:100]}...")
             except UnicodeDecodeError:
                 print("[DEBUG] File encoding not supported.")
                 raise HTTPException(status_code=400, detail="File encoding not supported. Please upload a UTF-8 encoded file.")
@@ -69,23 +176,66 @@ async def chat(
                 print(f"[DEBUG] Could not read file: {e}")
                 raise HTTPException(status_code=400, detail=f"Could not read file: {e}")
 
-        # Combine question and file content if file is provided
-        combined_input = question
+        # Only the chunks of the file relevant to the question go into the prompt
+        attachment = None
         if file_content:
-            combined_input += f"\n\n[Minified file content from {file.filename}:]\n{file_content}"
-        print(f"[DEBUG] Combined input: {combined_input[:200]}...")
+            # Chunked before minifying, so the line ranges match the uploaded file
+            attachment = build_upload_context(file.filename, file_content, question, UPLOAD_CONTEXT_CHARS,
+                                              minify=minify_code)
+            print(f"[DEBUG] Upload context: {len(attachment)} of {len(file_content)} chars")
+
+        include_context = include_context or ("none" if lean else "full")
+        if include_context not in ("full", "ids", "none"):
+            raise HTTPException(status_code=400, detail="include_context must be 'full', 'ids' or 'none'.")
 
         # Get chatbot response
-        answer, context, updated_chat_history = await get_chatbot_response(
-            question=combined_input,
-            model=model  # Truyền model vào hàm get_chatbot_response
+        history = []
+        if conversation_id:
+            history = await conversations.history(conversation_id, client_id)
+            if history is None:
+                raise HTTPException(status_code=404, detail="Unknown conversation.")
+        trace = {}
+        answer, context, _ = await get_chatbot_response(
+            question=question,
+            chat_history=list(history),
+            model=model,  # Truyền model vào hàm get_chatbot_response
+            filters=parsed_filters,
+            attachment=attachment,
+            trace=trace
         )
         # Remove <think> tags from the answer
         answer = remove_think_tags(answer)
         print(f"[DEBUG] Chatbot answer: {answer[:200]}...")
-        return ChatResponse(
-            answer=answer, context=context, chat_history=updated_chat_history
-        )
+        turn = [
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": answer}
+        ]
+        degraded = "degraded" in trace
+        version = None  # without a conversation there is no history to version
+        if conversation_id:
+            # A degraded answer is shown but not stored as conversation context
+            if degraded:
+                version = await conversations.version(conversation_id, client_id)
+            else:
+                version = await conversations.append(conversation_id, client_id, turn)
+
+        if not lean:
+            return ChatResponse(
+                answer=answer, context=context, chat_history=history + turn, degraded=degraded
+            )
+
+        # Lean mode: constant-size payload, serialized with orjson
+        payload = {"answer": answer, "turn": turn}
+        if degraded:
+            payload["degraded"] = trace["degraded"]
+        if conversation_id:
+            payload["conversation_id"] = conversation_id
+            payload["history_version"] = version
+        if include_context == "full":
+            payload["context"] = context
+        elif include_context == "ids":
+            payload["docs"] = trace.get("docs", [])
+        return fast_json(payload)
     except HTTPException as e:
         print(f"[DEBUG] HTTPException: {e.detail}")
         raise e
@@ -93,10 +243,103 @@ async def chat(
         print(f"[DEBUG] Internal Server Error: {e}")
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {e}")
 
+class BatchRequest(BaseModel):
+    questions: list[str]
+    model: str = "gpt-oss-120b"
+    topk: int = 5
+    filters: str | dict | None = None
+    concurrency: int = 4
+
+@app.post("/api/chat/batch")
+async def chat_batch(request: Request, body: BatchRequest):
+    """Answer many questions; results stream back as NDJSON in completion order."""
+    if not body.questions:
+        raise HTTPException(status_code=400, detail="No questions given.")
+    if len(body.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch.")
+    try:
+        parsed_filters = parse_filters(body.filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filters: {e}")
+    concurrency = max(1, min(body.concurrency, BATCH_MAX_CONCURRENCY))
+
+    client_id = get_client_id(request)
+
+    async def stream():
+        # The whole batch holds one admission slot until the stream ends. It is
+        # taken inside the generator so the same `finally` always gives it back,
+        # however the response ends (including before the body ever started).
+        await admission.acquire(client_id)
+        try:
+            yield b""
+            async for result in answer_batch(body.questions, body.topk, body.model, parsed_filters, concurrency):
+                yield orjson.dumps(result) + b"\n"
+        finally:
+            admission.release()
+
+    body_stream = stream()
+    # Run up to the slot: Overloaded still becomes a 429 before any response is sent
+    await body_stream.__anext__()
+    return StreamingResponse(body_stream, media_type="application/x-ndjson")
+
+# WebSocket chat: per-connection model, filters, history and upload; streamed, pipelined, cancellable turns
+chat_sockets = ChatSocketServer(admission, conversations, minify_code, MAX_UPLOAD_BYTES, UPLOAD_CONTEXT_CHARS)
+
+@app.websocket("/ws/chat")
+async def ws_chat(websocket: WebSocket):
+    await chat_sockets.serve(websocket, get_client_id(websocket))
+
+@app.post("/api/conversations")
+async def create_conversation(request: Request):
+    """Start a server-side conversation; only the same client (API key / IP) can use the id."""
+    conversation_id = await conversations.create(get_client_id(request))
+    return fast_json({"conversation_id": conversation_id, "history_version": 0})
+
+@app.get("/api/conversations/{conversation_id}")
+async def conversation_history(request: Request, conversation_id: str, since: int = 0):
+    """Messages added after history version `since`, so clients can resync cheaply."""
+    result = await conversations.since(conversation_id, get_client_id(request), since)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Unknown conversation.")
+    messages, version = result
+    return fast_json({"conversation_id": conversation_id, "messages": messages, "history_version": version})
+
+@app.get("/api/profiles/{profile_id}")
+async def get_profile(request: Request, profile_id: str):
+    """Speedscope JSON of a profiled request (needs the profiling token)."""
+    if not request_profiler.authorized(request):
+        raise HTTPException(status_code=403, detail="Profiling token required.")
+    profile = request_profiler.load(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return Response(content=profile, media_type="application/json")
+
 @app.get("/health")
 async def health_check():
+    """Liveness: the process is up and serving."""
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics():
+    """Runtime metrics of the serving pipeline."""
+    return {
+        "embedding_batcher": get_embedding_batcher().stats(),
+        "models": get_model_router().snapshot(),
+        "admission": admission.stats(),
+        "retrieval_cache": retrieval_cache.stats(),
+        "shards": shard_stats(),
+        "websocket": chat_sockets.stats(),
+        "circuit_breakers": breaker_stats(),
+        "index_reloader": get_index_reloader().stats() if get_index_reloader() else None,
+        "profiling": request_profiler.stats(),
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once warm-up has finished, 503 before that (or if it failed)."""
+    status_code = 200 if readiness["ready"] else 503
+    return JSONResponse(status_code=status_code, content=readiness)
+
 if __name__ == "__main__":
     import uvicorn
     import os
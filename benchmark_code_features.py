@@ -0,0 +1,133 @@
+import sys
+import json
+import time
+import argparse
+
+from code_features import KEYWORD_RE, classify, classify_many
+
+# Throughput of code-block classification on crawl dumps: code_features.classify
+# (serial and over a process pool) against the per-crawler implementation it
+# replaced, plus a one-regex keyword scan for reference.
+#   python benchmark_code_features.py react_code_examples.json reactjs_stackoverflow_questions.jsonl
+
+
+def load_blocks(paths):
+    """(title, code) pairs from crawl dumps (react.dev JSON, StackOverflow JSON/JSONL)."""
+    blocks = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                records = [json.loads(line) for line in f if line.strip()]
+            else:
+                records = json.load(f)
+        for rec in records:
+            title = rec.get("source_title") or rec.get("title") or ""
+            if rec.get("code"):
+                blocks.append((title, rec["code"]))
+            for block in rec.get("code_blocks") or []:
+                blocks.append((title, block.get("code", "")))
+            for block in (rec.get("answer") or {}).get("code_blocks") or []:
+                blocks.append((title, block.get("code", "")))
+    return blocks
+
+
+# The per-crawler implementation code_features.classify replaced, as the baseline.
+def _legacy_language(code_text):
+    if code_text.strip().startswith('import') or 'function' in code_text or 'export default' in code_text:
+        return 'javascript/jsx'
+    if code_text.strip().startswith('<') and code_text.strip().endswith('>'):
+        return 'html/jsx'
+    if code_text.strip().startswith('npm') or code_text.strip().startswith('yarn'):
+        return 'shell'
+    return 'unknown'
+
+
+def _legacy_type(code_text):
+    if 'function' in code_text:
+        return 'function'
+    if 'class' in code_text:
+        return 'class'
+    if 'export default' in code_text:
+        return 'component'
+    if code_text.strip().startswith('import'):
+        return 'import'
+    if code_text.strip().startswith('npm') or code_text.strip().startswith('yarn'):
+        return 'command'
+    return 'snippet'
+
+
+def _legacy_tags(title, code_text):
+    tags = set()
+    for word in title.lower().replace('–', '').replace('-', '').split():
+        if word not in ['react', 'a', 'the', 'to', 'of', 'in', 'and', 'for', 'on', 'with', 'is', 'by', 'as', 'an', 'at', 'from']:
+            tags.add(word)
+    if 'useState' in code_text:
+        tags.add('state')
+    if 'useEffect' in code_text:
+        tags.add('effect')
+    if 'useReducer' in code_text:
+        tags.add('reducer')
+    if 'props' in code_text:
+        tags.add('props')
+    if 'export default' in code_text:
+        tags.add('component')
+    return list(tags)
+
+
+def _legacy_classify(code_text, title):
+    return {"code_language": _legacy_language(code_text), "code_type": _legacy_type(code_text),
+            "tags": _legacy_tags(title, code_text)}
+
+
+def _regex_found(code_text):
+    return set(KEYWORD_RE.findall(code_text))
+
+
+def benchmark(paths, workers=4, repeat=3, chunksize=2048):
+    """
+    Blocks/sec over crawl dumps: the legacy per-feature scans, classify()
+    serially and over a process pool, and (for reference) the keyword hits
+    from one combined-regex scan.
+    """
+    blocks = load_blocks(paths)
+    if not blocks:
+        print("No code blocks found")
+        return {}
+    mismatches = sum(
+        1 for title, code in blocks
+        if (a := classify(code, title))["code_language"] != (b := _legacy_classify(code, title))["code_language"]
+        or a["code_type"] != b["code_type"] or set(a["tags"]) != set(b["tags"])
+    )
+    runs = {
+        "legacy": lambda: [_legacy_classify(code, title) for title, code in blocks],
+        "regex_scan_only": lambda: [_regex_found(code) for _, code in blocks],
+        "classify": lambda: classify_many(blocks),
+        f"process_pool_{workers}": lambda: classify_many(blocks, workers=workers, chunksize=chunksize),
+    }
+    results = {"blocks": len(blocks), "mismatches": mismatches}
+    for name, run in runs.items():
+        best = min(_timed(run) for _ in range(repeat))
+        results[name] = len(blocks) / best
+        print(f"{name:<16} {results[name]:>12,.0f} blocks/s")
+    print(f"{len(blocks)} blocks, {mismatches} results differ from the legacy implementation")
+    return results
+
+
+def _timed(run):
+    started = time.perf_counter()
+    run()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark code-block classification on crawl dumps")
+    parser.add_argument("paths", nargs="+", help="react_code_examples.json, reactjs_stackoverflow_questions.json[l], ...")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    if not benchmark(args.paths, args.workers, args.repeat):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,22 @@
 import re
 import os
+import sys
+import time
 import asyncio
 import importlib.util
 from functools import lru_cache
+from collections import OrderedDict
 from dotenv import load_dotenv
-from pymongo import MongoClient
 import motor.motor_asyncio
-import google.generativeai as genai
-from query import *
-import streamlit as st
+from query import find_top_k, collapse_chunks, fetch_parents, CHUNK_COLLECTION
+from embed_batcher import EmbeddingBatcher
+from model_router import ModelRouter
+from local_index import LocalIndex, LOCAL_INDEX_PATH, load_current
+from index_reloader import IndexReloader, INDEX_RELOAD_INTERVAL_S
+from retrieval_cache import RetrievalCache
+from embedding_providers import get_provider, check_stored_tag
+from sharding import ShardLayout, ShardedCorpus, SHARDS, SHARD_QUOTAS, parse_quotas
+from resilience import Deadline, CircuitBreaker, CircuitOpen, degraded_answer, STAGE_BUDGETS_S
 
 # Load environment variables
 load_dotenv()
@@ -18,94 +26,490 @@ def get_secret(key):
     value = os.getenv(key)
     if value:
         return value
+    # Only consult st.secrets when running under Streamlit: the API process
+    # must never pay for importing the UI framework.
+    st = sys.modules.get("streamlit")
     try:
-        if hasattr(st, "secrets") and key in st.secrets:
+        if st is not None and hasattr(st, "secrets") and key in st.secrets:
             return st.secrets[key]
     except Exception:
         pass
     raise RuntimeError(f"Secret '{key}' not found in environment variables or st.secrets!")
 
-# Configure Gemini API
-genai.configure(api_key=get_secret("GEMINI_API_KEY"))
+_genai_configured = False
+
+def configure_genai():
+    """Configure Gemini API on first use (google.generativeai is slow to import)."""
+    global _genai_configured
+    if not _genai_configured:
+        import google.generativeai as genai
+        genai.configure(api_key=get_secret("GEMINI_API_KEY"))
+        _genai_configured = True
 
 # MongoDB client management
 _mongodb_client = None
+_mongodb_lock = asyncio.Lock()
 
 async def get_mongodb_client():
-    """Initialize and return a MongoDB client."""
+    """Initialize (once, even under concurrent callers) and return a MongoDB client."""
     global _mongodb_client
-    if _mongodb_client is None:
-        try:
-            _mongodb_client = motor.motor_asyncio.AsyncIOMotorClient(
+    if _mongodb_client is not None:
+        return _mongodb_client
+    async with _mongodb_lock:
+        if _mongodb_client is None:
+            client = motor.motor_asyncio.AsyncIOMotorClient(
                 get_secret("MONGODB_URI"),
                 maxPoolSize=10,
                 serverSelectionTimeoutMS=5000,
                 connectTimeoutMS=5000,
                 socketTimeoutMS=5000
             )
-            await _mongodb_client.server_info()
-        except Exception as e:
-            st.error(f"❌ MongoDB connection error: {e}")
-            raise
+            try:
+                await client.server_info()
+            except Exception as e:
+                print(f"❌ MongoDB connection error: {e}")
+                client.close()
+                raise
+            _mongodb_client = client
     return _mongodb_client
 
-@lru_cache(maxsize=1000)
-def get_embedding_cached(text):
-    """Cache embeddings for faster retrieval."""
-    return get_embedding(text)
+@lru_cache(maxsize=1)
+def load_prompt(path="prompt.txt"):
+    """Read the system prompt once."""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+# Retrieval backend: "atlas" (MongoDB $vectorSearch) or "local" (in-process snapshot)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "atlas")
+# Chunked corpus (upsert.py --chunk): "off" searches whole records, "chunk"
+# returns the best matching chunk per record, "parent" its full record.
+RETRIEVAL_CHUNKS = os.getenv("RETRIEVAL_CHUNKS", "off")
+CHUNK_OVERFETCH = 3
+_local_index = None
+_local_generation = None
+
+def get_local_index():
+    """Load the current snapshot generation once (memory-mapped, shared across workers)."""
+    global _local_index, _local_generation
+    if _local_index is None:
+        _local_generation, _local_index = load_current(LOCAL_INDEX_PATH, mmap=True)
+    return _local_index
+
+def swap_local_index(index, generation=None):
+    """Serve `index` from now on; searches already holding the old one finish on it."""
+    global _local_index, _local_generation
+    check_stored_tag(_stored_tag(index), get_provider(configure=configure_genai))
+    old, _local_index, _local_generation = _local_index, index, generation
+    return old
+
+# Hot-swap of the local index (INDEX_RELOAD_INTERVAL_S, INDEX_RELOAD_SOURCE=snapshot|mongo)
+_index_reloader = None
+
+def get_index_reloader():
+    """The reloader of the local index, or None when the backend is Atlas or reloading is off."""
+    global _index_reloader
+    if _index_reloader is None and RETRIEVAL_BACKEND == "local" and INDEX_RELOAD_INTERVAL_S > 0:
+        get_local_index()
+        _index_reloader = IndexReloader(lambda: _local_index, swap_local_index,
+                                        fetch_version=read_meta_version, build_args=index_build_args(),
+                                        generation=_local_generation)
+    return _index_reloader
+
+def index_build_args():
+    """local_index.py arguments that rebuild the snapshot of the collection the local index mirrors."""
+    base = collection_name(CHUNK_COLLECTION if RETRIEVAL_CHUNKS != "off" else "normalized")
+    return ["--database", "chatcodeai", "--collection", base]
+
+def _stored_tag(index):
+    return index.records[0].get("embedding_provider") if index.size else None
+
+async def check_corpus_provider():
+    """Raise if the corpus was embedded with another provider / projection than the queries."""
+    if RETRIEVAL_BACKEND == "local":
+        stored = _stored_tag(get_local_index())
+    else:
+        client = await get_mongodb_client()
+        base = collection_name(CHUNK_COLLECTION if RETRIEVAL_CHUNKS != "off" else "normalized")
+        name = next(iter(SHARD_LAYOUT.shards(base)))[0] if SHARD_LAYOUT.enabled else base
+        doc = await client["chatcodeai"][name].find_one({"embedding_provider": {"$exists": True}},
+                                                       {"_id": 0, "embedding_provider": 1})
+        stored = doc.get("embedding_provider") if doc else None
+    check_stored_tag(stored, get_provider(configure=configure_genai))
+
+def collection_name(base):
+    """Each embedding provider has its own collections (normalized_local, ...): vectors are never mixed."""
+    return base + get_provider(configure=configure_genai).collection_suffix
+
+async def get_collection():
+    """Return the search target for find_top_k according to RETRIEVAL_BACKEND."""
+    if RETRIEVAL_BACKEND == "local":
+        return get_local_index()
+    client = await get_mongodb_client()
+    base = collection_name(CHUNK_COLLECTION if RETRIEVAL_CHUNKS != "off" else "normalized")
+    if SHARD_LAYOUT.enabled:
+        return get_sharded_corpus(client["chatcodeai"], base)
+    return client["chatcodeai"][base]
+
+# Sharded corpus (SHARDS="react_example,stackoverflow:4"): one collection per
+# source type / hash partition, searched concurrently and merged.
+SHARD_LAYOUT = ShardLayout.from_spec(SHARDS)
+_sharded_corpora = {}
+
+def get_sharded_corpus(db, base):
+    corpus = _sharded_corpora.get(base)
+    if corpus is None:
+        quotas = parse_quotas(SHARD_QUOTAS)
+        if RETRIEVAL_CHUNKS != "off":
+            # Quotas count records; chunk search over-fetches before collapsing to records
+            quotas = {t: q * CHUNK_OVERFETCH for t, q in quotas.items()}
+        shards = [(name, doc_type, db[name]) for name, doc_type in SHARD_LAYOUT.shards(base)]
+        corpus = _sharded_corpora[base] = ShardedCorpus(shards, find_top_k, quotas)
+    return corpus
+
+def shard_stats():
+    return {base: corpus.stats() for base, corpus in _sharded_corpora.items()}
+
+async def fetch_parent_records(docs):
+    """fetch_parents against `normalized`, or against each chunk's parent shard when sharded."""
+    client = await get_mongodb_client()
+    db = client["chatcodeai"]
+    base = collection_name("normalized")
+    if not SHARD_LAYOUT.enabled:
+        return await fetch_parents(docs, db[base])
+    groups = {}
+    for i, doc in enumerate(docs):
+        try:
+            groups.setdefault(SHARD_LAYOUT.route(base, doc), []).append(i)
+        except ValueError:
+            pass  # no shard for this type: keep the chunk itself
+    fetched = await asyncio.gather(*(fetch_parents([docs[i] for i in idx], db[name]) for name, idx in groups.items()))
+    docs = list(docs)
+    for idx, parents in zip(groups.values(), fetched):
+        for i, parent in zip(idx, parents):
+            docs[i] = parent
+    return docs
+
+# Retrieval results cache (LSH of the query embedding + k + filters), dropped
+# whenever upsert.py bumps the corpus version in the `meta` collection.
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "2048"))
+RETRIEVAL_CACHE_TTL_S = float(os.getenv("RETRIEVAL_CACHE_TTL_S", "300"))
+CORPUS_VERSION_CHECK_S = float(os.getenv("CORPUS_VERSION_CHECK_S", "30"))
+retrieval_cache = RetrievalCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL_S)
+_corpus_version = {"value": None, "checked": None}
+
+async def get_corpus_version():
+    """Current corpus version (re-read from Mongo at most every CORPUS_VERSION_CHECK_S)."""
+    if RETRIEVAL_BACKEND == "local":
+        # The generation changes on every publish, even a rebuild of the same version
+        index = get_local_index()
+        return _local_generation if _local_generation is not None else index.version
+    now = time.monotonic()
+    checked = _corpus_version["checked"]
+    if checked is not None and now - checked < CORPUS_VERSION_CHECK_S:
+        return _corpus_version["value"]
+    _corpus_version["checked"] = now
+    try:
+        _corpus_version["value"] = await read_meta_version()
+    except Exception as e:
+        print(f"⚠️ Could not read corpus version: {e}")
+    return _corpus_version["value"]
+
+async def read_meta_version():
+    """Corpus version upsert.py bumps in `meta` after every write."""
+    client = await get_mongodb_client()
+    doc = await client["chatcodeai"]["meta"].find_one({"_id": "corpus"})
+    return doc.get("version", 0) if doc else 0
+
+async def search_cached(query_emb, collection, topk, filters=None):
+    """Top-k docs for one query embedding, served from the retrieval cache when possible."""
+    version = await get_corpus_version() if retrieval_cache.enabled else None
+    docs = retrieval_cache.get(query_emb, topk, filters, version)
+    if docs is None:
+        docs = await find_top_k(query_emb, collection, k=search_k(topk), filters=filters)
+        docs = await resolve_chunks(docs, topk)
+        retrieval_cache.put(query_emb, topk, filters, version, docs)
+    return docs
+
+def search_k(topk):
+    """How many hits to ask for: chunk search over-fetches so enough distinct records remain."""
+    return topk * CHUNK_OVERFETCH if RETRIEVAL_CHUNKS != "off" else topk
+
+async def resolve_chunks(docs, topk):
+    """Deduplicate chunk hits per record and, in "parent" mode, swap in the full records."""
+    if RETRIEVAL_CHUNKS == "off":
+        return docs
+    docs = collapse_chunks(docs, topk)
+    if RETRIEVAL_CHUNKS == "parent" and RETRIEVAL_BACKEND != "local" and docs:
+        docs = await fetch_parent_records(docs)
+    return docs
+
+# Query embeddings: LRU cache in front of a micro-batcher that merges
+# concurrent requests into one multi-content embedding call.
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+EMBED_CACHE_SIZE = 1000
+_embedding_cache = OrderedDict()
+_embedding_batcher = None
+
+def _embed_texts(texts):
+    """Embed with the configured provider (EMBEDDING_PROVIDER=gemini | local)."""
+    return get_provider(configure=configure_genai).embed(texts).tolist()
+
+def get_embedding_batcher():
+    global _embedding_batcher
+    if _embedding_batcher is None:
+        _embedding_batcher = EmbeddingBatcher(_embed_texts, EMBED_BATCH_MAX_WAIT_MS, EMBED_BATCH_MAX_SIZE)
+    return _embedding_batcher
+
+async def get_embedding_cached(text):
+    """Cache embeddings for faster retrieval; misses go through the micro-batcher."""
+    embedding = _embedding_cache.get(text)
+    if embedding is not None:
+        _embedding_cache.move_to_end(text)
+        return embedding
+    embedding = await get_embedding_batcher().embed(text)
+    _embedding_cache[text] = embedding
+    if len(_embedding_cache) > EMBED_CACHE_SIZE:
+        _embedding_cache.popitem(last=False)
+    return embedding
 
 def build_context(docs):
     """Construct context from retrieved documents."""
     return "\n".join(
-        f"[Doc {i}]\nExplanation: {doc.get('explanation')}\nCode: {doc.get('code')}\nLink: {doc.get('link')}\n"
+        f"[Doc {i}]\nExplanation: {doc.get('explanation')}\nCode{_line_range(doc)}: {doc.get('code')}\nLink: {doc.get('link')}\n"
         for i, doc in enumerate(docs, 1)
     )
 
-async def ask_cerebras(question, context, chat_history=None, model="llama-4-scout-17b-16e-instruct"):
-    """Call Cerebras API with chat history."""
-    try:
+def _line_range(doc):
+    # A chunk hit is only part of the snippet; tell the model which lines it sees.
+    if doc.get("parent_id") and doc.get("start_line"):
+        return f" (lines {doc['start_line']}-{doc['end_line']})"
+    return ""
+
+_cerebras_client = None
+
+def get_cerebras_client():
+    """Return the shared async Cerebras client (one connection pool per process)."""
+    global _cerebras_client
+    if _cerebras_client is None:
         spec = importlib.util.find_spec("cerebras.cloud.sdk")
         if spec is None:
             raise ImportError("Install cerebras-cloud-sdk: pip install cerebras-cloud-sdk")
-        from cerebras.cloud.sdk import Cerebras
-    except ImportError as e:
-        return f"❌ Error: {e}"
-
-    api_key = get_secret("CEREBRAS_API_KEY")
-    with open("prompt.txt", "r", encoding="utf-8") as f:
-        system_prompt = f.read().strip()
+        from cerebras.cloud.sdk import AsyncCerebras
+        _cerebras_client = AsyncCerebras(api_key=get_secret("CEREBRAS_API_KEY"))
+    return _cerebras_client
 
-    messages = [{"role": "system", "content": system_prompt}]
+def build_messages(question, context, chat_history=None):
+    """System prompt + history + the user turn with retrieved context."""
+    messages = [{"role": "system", "content": load_prompt()}]
     if chat_history:
         messages.extend(chat_history)
     messages.append({"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}"})
+    return messages
+
+# Model routing: failover across the offered models and hedged requests
+# once the chosen model runs past its p95 latency.
+MODEL_HEDGING = os.getenv("MODEL_HEDGING", "1") == "1"
+HEDGE_MIN_DELAY_S = float(os.getenv("HEDGE_MIN_DELAY_S", "2.0"))
+_model_router = None
+
+async def _cerebras_complete(model, messages, **kwargs):
+    return await get_cerebras_client().chat.completions.create(
+        messages=messages,
+        model=model,
+        temperature=0.2,
+        max_tokens=2048,
+        **kwargs
+    )
+
+def get_model_router():
+    global _model_router
+    if _model_router is None:
+        _model_router = ModelRouter(_cerebras_complete, hedge=MODEL_HEDGING, hedge_min_delay=HEDGE_MIN_DELAY_S)
+    return _model_router
+
+async def generate_answer(question, context, chat_history=None, model="llama-4-scout-17b-16e-instruct", trace=None):
+    """Cerebras completion with chat history (routed: hedging + failover); raises if every model fails."""
+    get_cerebras_client()
+    messages = build_messages(question, context, chat_history)
+    response, used_model = await get_model_router().complete(messages, model)
+    if trace is not None:
+        usage = getattr(response, "usage", None)
+        trace["model_used"] = used_model
+        trace["usage"] = {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+        }
+    return response.choices[0].message.content
 
+async def ask_cerebras(question, context, chat_history=None, model="llama-4-scout-17b-16e-instruct", trace=None):
+    """Call Cerebras API with chat history; errors are returned as the answer text."""
     try:
-        client = Cerebras(api_key=api_key)
-        response = client.chat.completions.create(
-            messages=messages,
-            model=model,
-            temperature=0.2,
-            max_tokens=2048
-        )
-        return response.choices[0].message.content
+        return await generate_answer(question, context, chat_history, model, trace)
+    except ImportError as e:
+        return f"❌ Error: {e}"
     except Exception as e:
         return f"❌ Cerebras API error: {e}"
 
-async def get_chatbot_response(question, chat_history=None, topk=5, model="gpt-oss-120b"):
-    """Main function to get chatbot response."""
-    client = await get_mongodb_client()
-    collection = client["chatcodeai"]["normalized"]
+async def stream_cerebras(question, context, chat_history=None, model="llama-4-scout-17b-16e-instruct"):
+    """
+    Call Cerebras API in streaming mode, yielding answer text as it is generated.
+    Fails over to the next model while nothing has been emitted yet; raises
+    once every model failed (or the one streaming broke off).
+    """
+    get_cerebras_client()
+    messages = build_messages(question, context, chat_history)
+    router = get_model_router()
+    last_error = None
 
+    for candidate in router.candidates(model):
+        started = time.perf_counter()
+        emitted = False
+        try:
+            stream = await _cerebras_complete(candidate, messages, stream=True)
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    emitted = True
+                    yield delta
+            router.record(candidate, time.perf_counter() - started, ok=True)
+            return
+        except Exception as e:
+            router.record(candidate, time.perf_counter() - started, ok=False)
+            last_error = e
+            if emitted:
+                break
+            print(f"⚠️ Model {candidate} failed: {e}")
+    raise RuntimeError(f"Cerebras API error: {last_error}")
+
+def _reset_after_fork():
+    """Drop clients inherited from a pre-fork parent: sockets, gRPC channels and locks are not fork-safe."""
+    global _mongodb_client, _mongodb_lock, _cerebras_client, _genai_configured, _embedding_batcher, _index_reloader
+    _index_reloader = None
+    _sharded_corpora.clear()
+    _mongodb_client = None
+    _mongodb_lock = asyncio.Lock()
+    _cerebras_client = None
+    _genai_configured = False
+    _embedding_batcher = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+# Warm-up state reported by the API readiness endpoint
+readiness = {"ready": False, "started_at": None, "finished_at": None, "error": None}
+
+async def warm_up():
+    """Connect to MongoDB, load the prompt and warm the embedding client / local index."""
+    readiness.update(ready=False, started_at=time.time(), finished_at=None, error=None)
+    try:
+        load_prompt()
+        if RETRIEVAL_BACKEND == "local":
+            await asyncio.to_thread(get_local_index)
+        else:
+            await get_mongodb_client()
+        await get_embedding_cached("React warm-up")
+        await check_corpus_provider()
+        get_cerebras_client()
+        readiness["ready"] = True
+    except Exception as e:
+        readiness["error"] = str(e)
+        print(f"❌ Warm-up failed: {e}")
+    finally:
+        readiness["finished_at"] = time.time()
+    return readiness["ready"]
+
+# Deadlines and per-upstream circuit breakers (REQUEST_DEADLINE_S, *_BUDGET_S, BREAKER_*)
+breakers = {stage: CircuitBreaker(stage) for stage in ("embedding", "search", "generation")}
+RETRIEVAL_UNAVAILABLE = "Sorry, search is temporarily unavailable. Please try again in a moment."
+
+def breaker_stats():
+    return {stage: breaker.stats() for stage, breaker in breakers.items()}
+
+def _mark_degraded(trace, stage, error):
+    reason = "timed out" if isinstance(error, asyncio.TimeoutError) else str(error) or type(error).__name__
+    print(f"⚠️ Degraded answer ({stage}): {reason}")
+    if trace is not None:
+        trace["degraded"] = {"stage": stage, "reason": reason}
+    return reason
+
+async def retrieve(question, topk=5, filters=None, trace=None, deadline=None):
+    """
+    Embed the question and fetch the top-k documents, each stage within its
+    budget of `deadline` and behind its circuit breaker. If search is out of
+    budget or open, a stale retrieval-cache entry is used when there is one
+    (trace["stale_docs"]).
+    """
+    deadline = deadline or Deadline()
+    collection = await get_collection()
+    started = time.perf_counter()
+    query_emb = await breakers["embedding"].call(lambda: get_embedding_cached(question), deadline.budget("embedding"))
+    embedded = time.perf_counter()
+    try:
+        docs = await breakers["search"].call(lambda: search_cached(query_emb, collection, topk, filters),
+                                             deadline.budget("search"))
+    except (CircuitOpen, asyncio.TimeoutError) as e:
+        docs = retrieval_cache.get_stale(query_emb, topk, filters)
+        if docs is None:
+            raise
+        print(f"⚠️ Search unavailable ({e}), serving stale cached results")
+        if trace is not None:
+            trace["stale_docs"] = True
+    if trace is not None:
+        trace["embedding_s"] = embedded - started
+        trace["search_s"] = time.perf_counter() - embedded
+    return docs
+
+def with_attachment(question, attachment=None):
+    """Question as sent to the LLM: the relevant upload chunks are appended, never embedded."""
+    return f"{question}\n\n{attachment}" if attachment else question
+
+def doc_refs(docs):
+    """Compact references to retrieved docs (id + score) instead of the full context."""
+    refs = [{"id": doc.get("crawl_id"), "score": doc.get("score"), "link": doc.get("link")} for doc in docs]
+    for ref, doc in zip(refs, docs):
+        if doc.get("parent_id"):
+            ref["parent_id"] = doc["parent_id"]
+    return refs
+
+async def get_chatbot_response(question, chat_history=None, topk=5, model="gpt-oss-120b", filters=None, attachment=None, trace=None):
+    """
+    Main function to get chatbot response.
+
+    `attachment` (relevant chunks of an uploaded file) goes into the prompt
+    only; retrieval embeds the question alone. If `trace` is a dict it is
+    filled with details of the run: retrieved doc refs, per-stage latency
+    (embedding_s, search_s, generation_s) and token usage.
+
+    Stages run within the request deadline (resilience.Deadline) and behind
+    circuit breakers; when generation fails, times out or is tripped the
+    answer is built from the retrieved docs alone and trace["degraded"] says
+    why.
+    """
     chat_history = chat_history or []
-    query_emb = resize_embedding(get_embedding_cached(question), 1024)
-    docs = await find_top_k(query_emb, collection, k=topk)
+    deadline = Deadline()
+    try:
+        docs = await retrieve(question, topk, filters, trace, deadline)
+    except Exception as e:
+        _mark_degraded(trace, "retrieval", e)
+        return RETRIEVAL_UNAVAILABLE, "", chat_history
+    if trace is not None:
+        trace["docs"] = doc_refs(docs)
 
     if not docs:
         return "Sorry, no relevant information found.", "", chat_history
 
     context = build_context(docs)
-    answer = await ask_cerebras(question, context, chat_history, model)
+    started = time.perf_counter()
+    try:
+        answer = await breakers["generation"].call(
+            lambda: generate_answer(with_attachment(question, attachment), context, chat_history, model, trace),
+            deadline.budget("generation"))
+    except Exception as e:
+        # Retrieval-only answer; kept out of the history so it never becomes LLM context
+        return degraded_answer(docs, _mark_degraded(trace, "generation", e)), context, chat_history
+    if trace is not None:
+        trace["generation_s"] = time.perf_counter() - started
 
     chat_history.extend([
         {"role": "user", "content": question},
@@ -113,17 +517,179 @@ async def get_chatbot_response(question, chat_history=None, topk=5, model="gpt-o
     ])
     return answer, context, chat_history
 
+async def stream_chatbot_response(question, chat_history=None, topk=5, model="gpt-oss-120b", filters=None, attachment=None, trace=None):
+    """
+    Streaming variant of get_chatbot_response: yields answer text chunks
+    (with <think> blocks removed). `chat_history` is extended in place once
+    the answer is complete.
+
+    Same deadline, breakers and degraded answers as get_chatbot_response:
+    if generation fails before emitting anything the retrieval-only answer
+    is streamed instead, if it breaks off midway a notice is appended; either
+    way trace["degraded"] is set and the history is left untouched.
+    """
+    chat_history = chat_history if chat_history is not None else []
+    deadline = Deadline()
+    try:
+        docs = await retrieve(question, topk, filters, trace, deadline)
+    except Exception as e:
+        _mark_degraded(trace, "retrieval", e)
+        yield RETRIEVAL_UNAVAILABLE
+        return
+
+    if not docs:
+        answer = "Sorry, no relevant information found."
+        yield answer
+    else:
+        context = build_context(docs)
+        parts = []
+        prompt_question = with_attachment(question, attachment)
+        generation = breakers["generation"].stream(
+            lambda: stream_cerebras(prompt_question, context, chat_history, model), deadline.budget("generation"))
+        try:
+            async for delta in strip_think_stream(generation):
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            reason = _mark_degraded(trace, "generation", e)
+            if parts:
+                yield f"\n\n⚠️ The answer was cut off ({reason})."
+            else:
+                yield degraded_answer(docs, reason)
+            return
+        answer = "".join(parts)
+
+    chat_history.extend([
+        {"role": "user", "content": question},
+        {"role": "assistant", "content": answer}
+    ])
+
+# Batch question answering (nightly FAQ refresh, quality checks)
+BATCH_EMBED_SIZE = 100
+BATCH_SEARCH_CONCURRENCY = int(os.getenv("BATCH_SEARCH_CONCURRENCY", "8"))
+
+async def embed_questions(questions):
+    """Embed many questions with multi-text requests (cached ones are not re-embedded)."""
+    missing = list(dict.fromkeys(q for q in questions if q not in _embedding_cache))
+    for start in range(0, len(missing), BATCH_EMBED_SIZE):
+        batch = missing[start:start + BATCH_EMBED_SIZE]
+        vectors = await asyncio.to_thread(_embed_texts, batch)
+        for text, vector in zip(batch, vectors):
+            _embedding_cache[text] = vector
+        while len(_embedding_cache) > EMBED_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+    # Read back after all batches: the cache may have evicted entries of a very large batch.
+    return [_embedding_cache.get(q) or await get_embedding_cached(q) for q in questions]
+
+async def retrieve_many(questions, topk=5, filters=None):
+    """Top-k docs for every question; one matrix product on the local index."""
+    collection = await get_collection()
+    embeddings = await embed_questions(questions)
+    if isinstance(collection, LocalIndex):
+        results = collection.search_many(embeddings, k=search_k(topk), filters=filters)
+        return [await resolve_chunks(docs, topk) for docs in results]
+    semaphore = asyncio.Semaphore(BATCH_SEARCH_CONCURRENCY)
+
+    async def search(embedding):
+        async with semaphore:
+            return await search_cached(embedding, collection, topk, filters)
+
+    return await asyncio.gather(*(search(e) for e in embeddings))
+
+async def answer_batch(questions, topk=5, model="gpt-oss-120b", filters=None, concurrency=4):
+    """
+    Answer many independent questions. Async generator yielding one result
+    dict per question as soon as it finishes (not in input order).
+    """
+    all_docs = await retrieve_many(questions, topk, filters)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def answer(index):
+        question, docs = questions[index], all_docs[index]
+        result = {"index": index, "question": question, "docs": doc_refs(docs)}
+        if not docs:
+            result["answer"] = "Sorry, no relevant information found."
+            return result
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                # Same breaker as live traffic: while Cerebras is down the batch fails fast
+                answer = await breakers["generation"].call(
+                    lambda: generate_answer(question, build_context(docs), None, model),
+                    STAGE_BUDGETS_S["generation"])
+                result["answer"] = remove_think_tags(answer)
+            except Exception as e:
+                reason = "timed out" if isinstance(e, asyncio.TimeoutError) else str(e) or type(e).__name__
+                result["error"] = reason
+            result["latency_s"] = time.perf_counter() - started
+        return result
+
+    tasks = [asyncio.ensure_future(answer(i)) for i in range(len(questions))]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def load_questions(path):
+    """Questions from a text file (one per line) or JSONL ({"question": ...} or a "messages" conversation)."""
+    import json
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if not line.startswith("{"):
+                questions.append(line)
+                continue
+            obj = json.loads(line)
+            if obj.get("question"):
+                questions.append(obj["question"])
+            else:
+                user = next((m.get("content") for m in obj.get("messages", []) if m.get("role") == "user"), None)
+                if user:
+                    questions.append(user)
+    return questions
+
+async def batch_main(path, output, model="gpt-oss-120b", topk=5, filters=None, concurrency=4, limit=None):
+    """Answer every question of `path` and write NDJSON results to `output`."""
+    import json
+    questions = load_questions(path)[:limit]
+    started = time.perf_counter()
+    done = 0
+    with open(output, "w", encoding="utf-8") as out:
+        async for result in answer_batch(questions, topk, model, filters, concurrency):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            done += 1
+            if done % 50 == 0:
+                print(f"🔁 {done}/{len(questions)} answered")
+    elapsed = time.perf_counter() - started
+    print(f"✅ {done} answers written to {output} in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.2f} q/s)")
+
 async def main():
     """Entry point for chatbot interaction."""
     import argparse
     parser = argparse.ArgumentParser(description="Chatbot embedding + Cerebras")
     parser.add_argument('--question', type=str, help='Input question')
+    parser.add_argument('--filter', type=str, help='Metadata filter, e.g. "type=react_example;tags=hooks"')
+    parser.add_argument('--batch-file', type=str, help='Answer all questions of a .txt/.jsonl file (e.g. dataset_react.jsonl)')
+    parser.add_argument('--output', type=str, default='batch_answers.jsonl', help='NDJSON output for --batch-file')
+    parser.add_argument('--model', type=str, default='gpt-oss-120b')
+    parser.add_argument('--concurrency', type=int, default=4, help='Parallel LLM calls in batch mode')
+    parser.add_argument('--limit', type=int, help='Only the first N questions in batch mode')
     args = parser.parse_args()
 
+    if args.batch_file:
+        await batch_main(args.batch_file, args.output, args.model, filters=args.filter,
+                         concurrency=args.concurrency, limit=args.limit)
+        return
+
     chat_history = []
 
     if args.question:
-        answer, _, _ = await get_chatbot_response(args.question, chat_history)
+        answer, _, _ = await get_chatbot_response(args.question, chat_history, model=args.model, filters=args.filter)
         print(remove_think_tags(answer))
     else:
         print("🤖 Hello! Type 'quit' to exit.")
@@ -136,12 +702,34 @@ async def main():
                 continue
 
             print("🔍 Processing...")
-            answer, _, chat_history = await get_chatbot_response(question, chat_history)
+            answer, _, chat_history = await get_chatbot_response(question, chat_history, model=args.model, filters=args.filter)
             print(f"\n🤖 Bot: {remove_think_tags(answer)}")
 
 def remove_think_tags(text):
     """Remove reasoning trace or <think> tags from the response."""
     return re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL).strip()
 
+async def strip_think_stream(chunks):
+    """Streaming counterpart of remove_think_tags: drop <think>...</think> spans across chunk boundaries."""
+    buffer, inside = "", False
+    async for chunk in chunks:
+        buffer += chunk
+        while buffer:
+            tag = "</think>" if inside else "<think>"
+            pos = buffer.find(tag)
+            if pos >= 0:
+                if not inside and pos:
+                    yield buffer[:pos]
+                buffer, inside = buffer[pos + len(tag):], not inside
+                continue
+            # Hold back a possible partial tag at the end of the buffer.
+            keep = next((n for n in range(len(tag) - 1, 0, -1) if buffer.endswith(tag[:n])), 0)
+            if not inside and len(buffer) > keep:
+                yield buffer[:len(buffer) - keep]
+            buffer = buffer[len(buffer) - keep:] if keep else ""
+            break
+    if buffer and not inside:
+        yield buffer
+
 if __name__ == "__main__":
     asyncio.run(main())
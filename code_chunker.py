@@ -0,0 +1,251 @@
+import re
+import math
+from collections import Counter
+
+# Top-level declarations that start a new chunk (JS/TS/JSX/TSX).
+DECLARATION_RE = re.compile(
+    r'^(?:export\s+(?:default\s+)?)?(?:declare\s+)?(?:async\s+)?'
+    r'(?:function\s*\*?\s*(?P<func>[A-Za-z_$][\w$]*)'
+    r'|class\s+(?P<cls>[A-Za-z_$][\w$]*)'
+    r'|(?:const|let|var)\s+(?P<var>[A-Za-z_$][\w$]*)'
+    r'|interface\s+(?P<iface>[A-Za-z_$][\w$]*)'
+    r'|type\s+(?P<type>[A-Za-z_$][\w$]*)\s*(?:<[^=]*>)?\s*='
+    r'|enum\s+(?P<enum>[A-Za-z_$][\w$]*))'
+)
+IMPORT_RE = re.compile(r'^(?:import\b|export\s+\*|export\s+\{[^}]*\}\s+from\b)')
+TOKEN_RE = re.compile(r'[A-Za-z_$][\w$]*|\d+')
+CAMEL_RE = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+')
+
+
+def _line_depths(lines):
+    """Bracket depth at the start of each line, skipping strings and comments."""
+    depths = []
+    depth = 0
+    quote = None
+    block_comment = False
+    for line in lines:
+        depths.append(depth)
+        i = 0
+        while i < len(line):
+            ch = line[i]
+            nxt = line[i + 1] if i + 1 < len(line) else ""
+            if block_comment:
+                if ch == "*" and nxt == "/":
+                    block_comment = False
+                    i += 1
+            elif quote:
+                if ch == "\\":
+                    i += 1
+                elif ch == quote:
+                    quote = None
+            elif ch == "/" and nxt == "/":
+                break
+            elif ch == "/" and nxt == "*":
+                block_comment = True
+                i += 1
+            elif ch in "'\"`":
+                quote = ch
+            elif ch in "{([":
+                depth += 1
+            elif ch in "})]":
+                depth = max(0, depth - 1)
+            i += 1
+        # Unterminated ' or " never span lines in valid code; template literals may.
+        if quote in ("'", '"'):
+            quote = None
+    return depths
+
+
+def _kind(match, text):
+    name = next((v for v in match.groupdict().values() if v), None) if match else None
+    if match is None:
+        return "statement", None
+    if match.group("cls"):
+        return "component" if re.search(r'extends\s+(?:React\.)?(?:Pure)?Component\b', text) else "class", name
+    if match.group("iface") or match.group("type") or match.group("enum"):
+        return "type", name
+    if name and re.match(r'use[A-Z0-9]', name):
+        return "hook", name
+    if match.group("var") and not re.search(r'=>|\bfunction\b', text.split("\n", 1)[0] + text[:200]):
+        return "statement", name
+    if name and name[0].isupper():
+        return "component", name
+    return "function", name
+
+
+def _window(chunk, max_chars, overlap_lines):
+    """Split an oversized chunk into overlapping line windows."""
+    lines = chunk["text"].split("\n")
+    pieces = []
+    start = 0
+    while start < len(lines):
+        size, end = 0, start
+        while end < len(lines) and (size + len(lines[end]) + 1 <= max_chars or end == start):
+            size += len(lines[end]) + 1
+            end += 1
+        pieces.append(dict(
+            chunk,
+            text="\n".join(lines[start:end]),
+            start_line=chunk["start_line"] + start,
+            end_line=chunk["start_line"] + end - 1,
+            part=len(pieces) + 1,
+        ))
+        if end >= len(lines):
+            break
+        start = max(start + 1, end - overlap_lines)
+    return pieces
+
+
+def split_code(code, max_chars=2000, overlap_lines=0):
+    """
+    Split source code into syntax-aware chunks at top-level boundaries
+    (imports, components, hooks, functions, classes, types). Chunks longer
+    than `max_chars` are cut into line windows overlapping by `overlap_lines`.
+    Each chunk: {"kind", "name", "start_line", "end_line", "text"} (1-based lines).
+    """
+    lines = code.split("\n")
+    depths = _line_depths(lines)
+    chunks = []
+    current = None
+
+    def close(end):
+        if current is not None:
+            raw = "\n".join(lines[current["start"]:end])
+            text = raw.strip("\n")
+            if text.strip():
+                start_line = current["start"] + 1 + raw[:len(raw) - len(raw.lstrip("\n"))].count("\n")
+                chunks.append({"start_line": start_line, "end_line": start_line + text.count("\n"),
+                               "text": text, "is_import": current["is_import"]})
+
+    prev = ""
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        top_level = depths[i] == 0
+        is_comment = stripped.startswith(("//", "/*", "*"))
+        is_import = top_level and bool(IMPORT_RE.match(stripped))
+        starts_block = top_level and (
+            bool(DECLARATION_RE.match(stripped))
+            or (current is not None and current["is_import"] != is_import and not is_comment)
+            # The previous top-level statement just closed (e.g. a CSS rule or an IIFE).
+            or prev.endswith(("}", "};", ")", ");"))
+        )
+        if current is None or (starts_block and current["has_code"] and not (is_import and current["is_import"])):
+            # Leading comments belong to the declaration that follows them.
+            start = i if current is None or current["comment_start"] is None else current["comment_start"]
+            close(start)
+            current = {"start": start, "is_import": is_import, "has_code": False, "comment_start": None}
+        if is_comment:
+            if current["has_code"] and current["comment_start"] is None:
+                current["comment_start"] = i
+        else:
+            current["has_code"] = True
+            current["comment_start"] = None
+            current["is_import"] = current["is_import"] or is_import
+        prev = stripped
+    close(len(lines))
+
+    result = []
+    for chunk in chunks:
+        if chunk.pop("is_import"):
+            kind, name = "imports", None
+        else:
+            first = next((l.strip() for l in chunk["text"].split("\n")
+                          if l.strip() and not l.strip().startswith(("//", "/*", "*"))), "")
+            kind, name = _kind(DECLARATION_RE.match(first), chunk["text"])
+        chunk.update(kind=kind, name=name)
+        if len(chunk["text"]) > max_chars:
+            result.extend(_window(chunk, max_chars, overlap_lines))
+        else:
+            result.append(chunk)
+    return result
+
+
+def tokenize(text):
+    """Lower-cased identifier tokens, with camelCase / snake_case split into parts."""
+    tokens = []
+    for token in TOKEN_RE.findall(text):
+        tokens.append(token.lower())
+        parts = CAMEL_RE.findall(token)
+        if len(parts) > 1:
+            tokens.extend(p.lower() for p in parts)
+    return tokens
+
+
+def rank_chunks(chunks, question, k1=1.2, b=0.75):
+    """BM25 scores of each chunk against the question."""
+    query = set(tokenize(question))
+    docs = [Counter(tokenize(c["text"])) for c in chunks]
+    if not docs or not query:
+        return [0.0] * len(chunks)
+    avg_len = sum(sum(d.values()) for d in docs) / len(docs) or 1.0
+    df = Counter(t for d in docs for t in query if t in d)
+    n = len(docs)
+    scores = []
+    for d in docs:
+        length = sum(d.values())
+        score = 0.0
+        for t in query:
+            tf = d.get(t)
+            if tf:
+                idf = math.log(1 + (n - df[t] + 0.5) / (df[t] + 0.5))
+                score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_len))
+        scores.append(score)
+    return scores
+
+
+def select_relevant_chunks(chunks, question, max_chars=6000):
+    """
+    Pick the chunks most relevant to the question within a character budget,
+    returned in file order. With no lexical overlap, the head of the file is used.
+    """
+    scores = rank_chunks(chunks, question)
+    order = sorted(range(len(chunks)), key=lambda i: (-scores[i], i))
+    picked, used = [], 0
+    for i in order:
+        size = len(chunks[i]["text"]) + 1
+        if used + size > max_chars:
+            continue
+        picked.append(i)
+        used += size
+    return [dict(chunks[i], score=scores[i]) for i in sorted(picked)]
+
+
+def format_attachment(filename, selected, total):
+    """Render the selected chunks for the prompt, with line ranges for orientation."""
+    header = f"[Relevant parts of uploaded file {filename} ({len(selected)} of {total} chunks):]"
+    parts = [header]
+    for chunk in selected:
+        label = f"{chunk['kind']} {chunk['name']}" if chunk.get("name") else chunk["kind"]
+        parts.append(f"// lines {chunk['start_line']}-{chunk['end_line']} ({label})\n{chunk['text']}")
+    return "\n".join(parts)
+
+
+def chunk_upload(code, max_chars=6000, minify=None):
+    """
+    Chunk the original text, so line ranges refer to the user's file, then
+    minify each chunk with `minify` if given (chunks left empty are dropped).
+    """
+    chunks = split_code(code, max_chars=min(2000, max_chars))
+    if minify is None:
+        return chunks
+    result = []
+    for chunk in chunks:
+        text = minify(chunk["text"])
+        if text.strip():
+            result.append(dict(chunk, text=text))
+    return result
+
+
+def select_upload_context(filename, chunks, question, max_chars=6000):
+    """Keep only the chunks (from `chunk_upload`) relevant to the question."""
+    if not chunks:
+        return ""
+    selected = select_relevant_chunks(chunks, question, max_chars)
+    return format_attachment(filename, selected, len(chunks))
+
+
+def build_upload_context(filename, code, question, max_chars=6000, minify=None):
+    """Chunk an uploaded file and keep only the parts relevant to the question."""
+    return select_upload_context(filename, chunk_upload(code, max_chars, minify), question, max_chars)
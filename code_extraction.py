@@ -0,0 +1,181 @@
+import os
+import re
+import json
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from code_features import classify
+
+# Code extraction for StackOverflow bodies, run as its own stage: the crawler
+# feeds raw API items to a process pool while it keeps fetching, and stored
+# dumps can be re-extracted offline with all cores.
+
+MARKDOWN_FENCE_RE = re.compile(r'```[a-zA-Z0-9]*\n([\s\S]*?)```', re.MULTILINE)
+MARKDOWN_CODE_TAG_RE = re.compile(r'<code>([\s\S]*?)</code>', re.MULTILINE)
+
+try:
+    import lxml.html
+    from lxml import etree
+    HAS_LXML = True
+except ImportError:  # pragma: no cover - lxml is in requirements.txt
+    HAS_LXML = False
+
+
+def _joined_text(element):
+    # Same as BeautifulSoup get_text("\n", strip=True): stripped text nodes, one per line.
+    # (comments are not text nodes, but still split the text around them)
+    return "\n".join(t.strip() for t in element.xpath("descendant::text()") if t.strip())
+
+
+def _html_code_blocks(body_html):
+    """Code in <pre> elements, then in <code> elements outside any <pre>."""
+    if HAS_LXML:
+        try:
+            root = lxml.html.fragment_fromstring(body_html, create_parent="div")
+        except (etree.ParserError, ValueError):
+            return []
+        blocks = [_joined_text(pre) for pre in root.iter("pre")]
+        blocks += [_joined_text(code) for code in root.xpath(".//code[not(ancestor::pre)]")]
+        return blocks
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(body_html, "html.parser")
+    blocks = [pre.get_text("\n", strip=True) for pre in soup.find_all("pre")]
+    blocks += [code.get_text("\n", strip=True) for code in soup.find_all("code") if code.find_parent("pre") is None]
+    return blocks
+
+
+def extract_code_blocks(body_markdown, body_html=None):
+    """Code blocks of a post: fenced / <code> in the markdown, else <pre> / <code> in the HTML."""
+    code_blocks = []
+    if body_markdown:
+        code_blocks += MARKDOWN_FENCE_RE.findall(body_markdown)
+        code_blocks += MARKDOWN_CODE_TAG_RE.findall(body_markdown)
+    if not code_blocks and body_html:
+        code_blocks = _html_code_blocks(body_html)
+    return [c.strip() for c in code_blocks if c.strip()]
+
+
+def explain_code(title, code_text):
+    return f"Đoạn code này liên quan đến: {title}"
+
+
+def build_code_blocks_meta(title, body_markdown, body_html):
+    code_blocks_meta = []
+    for code in extract_code_blocks(body_markdown, body_html):
+        features = classify(code, title)
+        code_blocks_meta.append({
+            "code": code,
+            "code_language": features["code_language"],
+            "code_type": features["code_type"],
+            "tags": features["tags"],
+            "code_length": len(code.splitlines()),
+            "explanation": explain_code(title, code)
+        })
+    return code_blocks_meta
+
+
+class ExtractionStage:
+    """
+    Ordered process-pool stage between a fetcher and a writer.
+
+    `submit(*args)` queues fn(*args) on the pool and returns the results that
+    are ready, in submission order, so the caller writes them while the pool
+    keeps parsing and the fetcher keeps downloading. With more than
+    `max_pending` items queued, submit waits for the oldest one
+    (backpressure). workers=0 runs fn inline.
+    """
+
+    def __init__(self, fn, workers=None, max_pending=256):
+        self.fn = fn
+        self.workers = os.cpu_count() if workers is None else workers
+        self.max_pending = max_pending
+        self._pool = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 0 else None
+        self._pending = deque()
+
+    def submit(self, *args):
+        if self._pool is None:
+            return [self.fn(*args)]
+        self._pending.append(self._pool.submit(self.fn, *args))
+        ready = []
+        while self._pending and (self._pending[0].done() or len(self._pending) > self.max_pending):
+            ready.append(self._pending.popleft().result())
+        return ready
+
+    def drain(self):
+        """Wait for and return every remaining result, in order."""
+        results = [future.result() for future in self._pending]
+        self._pending.clear()
+        return results
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def reextract_record(record):
+    """Recompute the code blocks of a stored question (and its answer) from its bodies."""
+    record = dict(record)
+    title = record.get("title", "")
+    record["code_blocks"] = build_code_blocks_meta(title, record.get("body_markdown", ""), record.get("body_html", ""))
+    if record.get("answer"):
+        answer = dict(record["answer"])
+        answer["code_blocks"] = build_code_blocks_meta(title, answer.get("body_markdown", ""), answer.get("body_html", ""))
+        record["answer"] = answer
+    return record
+
+
+def _read_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+
+def reextract(input_path, output_path, workers=None):
+    """Offline re-extraction of a StackOverflow dump (JSON or JSONL), spread over `workers` processes."""
+    count = 0
+    jsonl = output_path.endswith(".jsonl")
+    with ExtractionStage(reextract_record, workers) as stage, open(output_path, "w", encoding="utf-8") as out:
+        if not jsonl:
+            out.write("[\n")
+
+        def write(records):
+            nonlocal count
+            for record in records:
+                if not jsonl and count:
+                    out.write(",\n")
+                out.write(json.dumps(record, ensure_ascii=False))
+                if jsonl:
+                    out.write("\n")
+                count += 1
+
+        for record in _read_records(input_path):
+            write(stage.submit(record))
+        write(stage.drain())
+        if not jsonl:
+            out.write("\n]\n")
+    print(f"Đã trích xuất lại code của {count} câu hỏi vào {output_path}")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-extract code blocks from stored StackOverflow bodies")
+    parser.add_argument("input", help="reactjs_stackoverflow_questions.json[l]")
+    parser.add_argument("output")
+    parser.add_argument("--workers", type=int, default=None, help="Processes (default: all cores, 0 = inline)")
+    args = parser.parse_args()
+    reextract(args.input, args.output, args.workers)
+
+
+if __name__ == "__main__":
+    main()
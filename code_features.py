@@ -0,0 +1,118 @@
+import re
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+# Code-block features shared by crawl_react_doc.py and crawl_react_stackov.py:
+# language, type and tags from one classification pass per block. Every
+# keyword of the tables is looked up once (C substring search, which beats a
+# combined `re` alternation on these block sizes, see
+# benchmark_code_features.py) and the hits are shared by all three features.
+
+# Rule tables, in priority order; every keyword they mention joins the matcher.
+LANGUAGE_RULES = [
+    # (language, prefixes of the stripped code, keywords anywhere, (opening, closing) wrapper)
+    ("javascript/jsx", ("import",), ("function", "export default"), None),
+    ("html/jsx", (), (), ("<", ">")),
+    ("shell", ("npm", "yarn"), (), None),
+]
+TYPE_RULES = [
+    # (type, keywords anywhere, prefixes of the stripped code), first match wins
+    ("function", ("function",), ()),
+    ("class", ("class",), ()),
+    ("component", ("export default",), ()),
+    ("import", (), ("import",)),
+    ("command", (), ("npm", "yarn")),
+]
+TAG_KEYWORDS = {
+    "useState": "state",
+    "useEffect": "effect",
+    "useReducer": "reducer",
+    "props": "props",
+    "export default": "component",
+}
+TITLE_STOPWORDS = frozenset([
+    'react', 'a', 'the', 'to', 'of', 'in', 'and', 'for', 'on', 'with', 'is', 'by', 'as', 'an', 'at', 'from'
+])
+
+
+def _keywords():
+    keywords = set(TAG_KEYWORDS)
+    for _, _, words, _ in LANGUAGE_RULES:
+        keywords.update(words)
+    for _, words, _ in TYPE_RULES:
+        keywords.update(words)
+    return tuple(sorted(keywords))
+
+
+KEYWORDS = _keywords()
+KEYWORD_RE = re.compile("|".join(re.escape(k) for k in sorted(KEYWORDS, key=len, reverse=True)))
+
+
+# Rules with keyword sets, so a rule test is one C-level isdisjoint().
+_LANGUAGE_RULES = [(language, prefixes, frozenset(words), wrapper)
+                   for language, prefixes, words, wrapper in LANGUAGE_RULES]
+_TYPE_RULES = [(code_type, frozenset(words), prefixes) for code_type, words, prefixes in TYPE_RULES]
+
+
+def _language(stripped, found):
+    for language, prefixes, words, wrapper in _LANGUAGE_RULES:
+        if (prefixes and stripped.startswith(prefixes)) or not found.isdisjoint(words) \
+                or (wrapper and stripped.startswith(wrapper[0]) and stripped.endswith(wrapper[1])):
+            return language
+    return 'unknown'
+
+
+def _type(stripped, found):
+    for code_type, words, prefixes in _TYPE_RULES:
+        if not found.isdisjoint(words) or (prefixes and stripped.startswith(prefixes)):
+            return code_type
+    return 'snippet'
+
+
+@lru_cache(maxsize=4096)
+def title_tags(title):
+    """Title words minus stopwords (cached: every block of a page shares its title)."""
+    return frozenset(word for word in title.lower().replace('–', '').replace('-', '').split()
+                     if word not in TITLE_STOPWORDS)
+
+
+def classify(code_text, title=""):
+    """Language, type and tags of a code block; each keyword is searched once."""
+    stripped = code_text.strip()
+    found = frozenset(filter(code_text.__contains__, KEYWORDS))
+    tags = title_tags(title)
+    if found:
+        tags = tags.union([TAG_KEYWORDS[k] for k in found if k in TAG_KEYWORDS])
+    return {
+        "code_language": _language(stripped, found),
+        "code_type": _type(stripped, found),
+        "tags": list(tags),
+    }
+
+
+def get_code_language(code_text):
+    return classify(code_text)["code_language"]
+
+
+def get_code_type(code_text):
+    return classify(code_text)["code_type"]
+
+
+def extract_tags(title, code_text):
+    return classify(code_text, title)["tags"]
+
+
+def _classify_pair(pair):
+    title, code_text = pair
+    return classify(code_text, title)
+
+
+def classify_many(blocks, workers=None, chunksize=256):
+    """
+    Classify an iterable of (title, code) pairs, in order. With `workers` > 1
+    the blocks are spread over a process pool in chunks of `chunksize`.
+    """
+    if not workers or workers <= 1:
+        return [classify(code_text, title) for title, code_text in blocks]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_classify_pair, blocks, chunksize=chunksize))
@@ -0,0 +1,77 @@
+import uuid
+from datetime import datetime, timezone
+
+from pymongo import ReturnDocument
+
+
+class ConversationStore:
+    """
+    Chat histories in MongoDB (one document per conversation), so every
+    worker process sees the same history whichever one a request lands on.
+
+    Ids are issued by the server (`create`) and every read or write is
+    scoped to the owner that created the conversation: an unknown id and
+    somebody else's id look the same (None). Each conversation carries a
+    monotonically increasing `version` (number of messages ever appended),
+    so clients can keep their own copy and ask only for what changed since
+    the version they hold. Idle conversations expire through a TTL index.
+    """
+
+    def __init__(self, get_collection, ttl=3600, max_messages=40):
+        self.get_collection = get_collection  # async () -> motor collection
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._indexed = False
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+    async def _collection(self):
+        collection = await self.get_collection()
+        if not self._indexed:
+            await collection.create_index("updated_at", expireAfterSeconds=int(self.ttl))
+            self._indexed = True
+        return collection
+
+    async def create(self, owner):
+        """Start an empty conversation for `owner` and return its id."""
+        conversation_id = self.new_id()
+        collection = await self._collection()
+        await collection.insert_one({"_id": conversation_id, "owner": owner, "messages": [], "version": 0,
+                                     "updated_at": datetime.now(timezone.utc)})
+        return conversation_id
+
+    async def _get(self, conversation_id, owner):
+        collection = await self._collection()
+        return await collection.find_one({"_id": conversation_id, "owner": owner})
+
+    async def history(self, conversation_id, owner):
+        """The retained messages (the last `max_messages`) to send to the LLM, or None if unknown."""
+        item = await self._get(conversation_id, owner)
+        return item["messages"] if item else None
+
+    async def version(self, conversation_id, owner):
+        item = await self._get(conversation_id, owner)
+        return item["version"] if item else None
+
+    async def append(self, conversation_id, owner, messages):
+        """Append messages atomically and return the new version (None if unknown)."""
+        collection = await self._collection()
+        item = await collection.find_one_and_update(
+            {"_id": conversation_id, "owner": owner},
+            {"$push": {"messages": {"$each": messages, "$slice": -self.max_messages}},
+             "$inc": {"version": len(messages)},
+             "$set": {"updated_at": datetime.now(timezone.utc)}},
+            projection={"version": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        return item["version"] if item else None
+
+    async def since(self, conversation_id, owner, version=0):
+        """Messages appended after `version` (as far as still retained) and the current version, or None."""
+        item = await self._get(conversation_id, owner)
+        if item is None:
+            return None
+        missing = max(0, item["version"] - version)
+        return (item["messages"][-missing:] if missing else []), item["version"]
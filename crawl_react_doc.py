@@ -1,113 +1,264 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from webdriver_manager.chrome import ChromeDriverManager
-
+import os
 import time
 import tqdm
 import json
 import hashlib
+import argparse
+import requests
 from datetime import datetime
+from urllib.parse import urljoin, urldefrag
+from bs4 import BeautifulSoup
+from code_features import classify
 
 
-def get_code_language(code_text):
-	if code_text.strip().startswith('import') or 'function' in code_text or 'export default' in code_text:
-		return 'javascript/jsx'
-	if code_text.strip().startswith('<') and code_text.strip().endswith('>'):
-		return 'html/jsx'
-	if code_text.strip().startswith('npm') or code_text.strip().startswith('yarn'):
-		return 'shell'
-	return 'unknown'
-
-def get_code_type(code_text):
-	if 'function' in code_text:
-		return 'function'
-	if 'class' in code_text:
-		return 'class'
-	if 'export default' in code_text:
-		return 'component'
-	if code_text.strip().startswith('import'):
-		return 'import'
-	if code_text.strip().startswith('npm') or code_text.strip().startswith('yarn'):
-		return 'command'
-	return 'snippet'
-
-def extract_tags(title, code_text):
-	tags = set()
-	for word in title.lower().replace('–', '').replace('-', '').split():
-		if word not in ['react', 'a', 'the', 'to', 'of', 'in', 'and', 'for', 'on', 'with', 'is', 'by', 'as', 'an', 'at', 'from']:
-			tags.add(word)
-	if 'useState' in code_text:
-		tags.add('state')
-	if 'useEffect' in code_text:
-		tags.add('effect')
-	if 'useReducer' in code_text:
-		tags.add('reducer')
-	if 'props' in code_text:
-		tags.add('props')
-	if 'export default' in code_text:
-		tags.add('component')
-	return list(tags)
-
 def explain_code(title, code_text):
 	# Simple explanation using title, can be improved with AI
 	return f"{title}"
 
-def crawl_react_dev_code_examples():
-	driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()))
-	driver.get("https://react.dev/learn")
+BASE_URL = "https://react.dev/learn"
+PAGE_CACHE_DIR = ".page_cache"
+OUTPUT_FILE = "react_code_examples.json"
+CHANGES_FILE = "react_code_changes.json"
+# Tombstone ({"crawl_id", "deleted": true}) của các block đã biến mất khỏi
+# trang; normalize.py giữ nguyên, upsert.py xóa record và chunk tương ứng.
+DELETIONS_FILE = "react_code_deletions.json"
 
-	# Lấy tất cả link bài học trong mục Learn
-	links = driver.find_elements(By.CSS_SELECTOR, "a[href^='/learn/']")
-	lesson_urls = set([l.get_attribute("href") for l in links if l.get_attribute("href")])
 
-	all_code_blocks = []
-	seen_hashes = set()
-	crawl_id = hashlib.md5(str(datetime.now()).encode()).hexdigest()
+class PageCache:
+	"""
+	Cache trang theo URL: ETag / Last-Modified / sha256 của body, và các
+	code block đã trích xuất lưu theo hash nội dung (pages/<sha256>.json).
+	Trang không đổi (304 hoặc cùng hash) thì dùng lại block, không parse lại.
+	"""
+
+	def __init__(self, directory=PAGE_CACHE_DIR):
+		self.directory = directory
+		self.index_path = os.path.join(directory, "index.json")
+		os.makedirs(os.path.join(directory, "pages"), exist_ok=True)
+		self.index = {}
+		if os.path.exists(self.index_path):
+			with open(self.index_path, "r", encoding="utf-8") as f:
+				self.index = json.load(f)
+
+	def _page_path(self, body_hash):
+		return os.path.join(self.directory, "pages", f"{body_hash}.json")
+
+	def conditional_headers(self, url):
+		entry = self.index.get(url, {})
+		headers = {}
+		if self.blocks(url) is None:
+			return headers
+		if entry.get("etag"):
+			headers["If-None-Match"] = entry["etag"]
+		if entry.get("last_modified"):
+			headers["If-Modified-Since"] = entry["last_modified"]
+		return headers
+
+	def body_hash(self, url):
+		return self.index.get(url, {}).get("body_hash")
+
+	def blocks(self, url):
+		"""Code block đã lưu của URL, hoặc None nếu chưa có trong cache."""
+		body_hash = self.body_hash(url)
+		if not body_hash or not os.path.exists(self._page_path(body_hash)):
+			return None
+		with open(self._page_path(body_hash), "r", encoding="utf-8") as f:
+			return json.load(f)
+
+	def block_ids(self, url):
+		"""crawl_id của các block hiện có của URL (cache cũ chưa lưu thì đọc từ file trang)."""
+		entry = self.index.get(url, {})
+		if "block_ids" in entry:
+			return set(entry["block_ids"])
+		return {b["crawl_id"] for b in self.blocks(url) or []}
+
+	def store(self, url, response, body_hash, blocks):
+		with open(self._page_path(body_hash), "w", encoding="utf-8") as f:
+			json.dump(blocks, f, ensure_ascii=False)
+		self.touch(url, response, body_hash)
+		self.index[url]["block_ids"] = sorted({b["crawl_id"] for b in blocks})
+
+	def forget(self, url):
+		"""Bỏ URL khỏi cache (trang không còn trong mục Learn); trả về crawl_id các block của nó."""
+		ids = self.block_ids(url)
+		self.index.pop(url, None)
+		return ids
+
+	def prune(self):
+		"""Xóa các file pages/<hash>.json không còn URL nào trỏ tới."""
+		used = {entry.get("body_hash") for entry in self.index.values()}
+		removed = 0
+		for name in os.listdir(os.path.join(self.directory, "pages")):
+			if name.endswith(".json") and name[:-len(".json")] not in used:
+				os.remove(os.path.join(self.directory, "pages", name))
+				removed += 1
+		return removed
+
+	def touch(self, url, response, body_hash):
+		entry = self.index.setdefault(url, {})
+		entry.update(
+			body_hash=body_hash,
+			etag=response.headers.get("ETag") or entry.get("etag"),
+			last_modified=response.headers.get("Last-Modified") or entry.get("last_modified"),
+			checked_at=datetime.now().isoformat(),
+		)
+
+	def save(self):
+		tmp = self.index_path + ".tmp"
+		with open(tmp, "w", encoding="utf-8") as f:
+			json.dump(self.index, f, ensure_ascii=False, indent=2)
+		os.replace(tmp, self.index_path)
+
+
+def fetch_page(session, url, cache, force=False):
+	"""
+	GET có điều kiện. Trả về (html, body_hash); html là None nếu trang
+	không đổi so với lần crawl trước (304 hoặc body cùng hash).
+	"""
+	headers = {} if force else cache.conditional_headers(url)
+	response = session.get(url, headers=headers, timeout=30)
+	if response.status_code == 304:
+		cache.touch(url, response, cache.body_hash(url))
+		return None, cache.body_hash(url)
+	response.raise_for_status()
+	body_hash = hashlib.sha256(response.content).hexdigest()
+	if not force and body_hash == cache.body_hash(url) and cache.blocks(url) is not None:
+		cache.touch(url, response, body_hash)
+		return None, body_hash
+	return response, body_hash
+
+
+def lesson_urls(session):
+	"""Tất cả link bài học trong mục Learn (bỏ #fragment)."""
+	response = session.get(BASE_URL, timeout=30)
+	response.raise_for_status()
+	soup = BeautifulSoup(response.text, "html.parser")
+	urls = set()
+	for a in soup.select("a[href^='/learn/']"):
+		urls.add(urldefrag(urljoin(BASE_URL, a["href"]))[0])
+	return sorted(urls)
+
+
+def block_crawl_id(url, code_text):
+	# Ổn định giữa các lần crawl: cùng URL + cùng code thì cùng crawl_id
+	return hashlib.md5(f"{url}|{code_text}".encode("utf-8")).hexdigest()
+
+
+def extract_page_blocks(url, html):
+	"""Trích xuất các code block (<pre>) của một trang bài học."""
+	soup = BeautifulSoup(html, "html.parser")
+	title = soup.title.get_text(strip=True) if soup.title else url
+	# Lấy section/chapter từ title nếu có
+	section = title.split('–')[0].strip() if '–' in title else title
 	timestamp = datetime.now().isoformat()
+	blocks = []
+	for pre in soup.find_all("pre"):
+		code_text = pre.get_text().strip()
+		if not code_text:
+			continue
+		features = classify(code_text, title)
+		blocks.append({
+			"timestamp": timestamp,
+			"crawl_id": block_crawl_id(url, code_text),
+			"url": url,
+			"source_title": title,
+			"section": section,
+			"code": code_text,
+			"code_language": features["code_language"],
+			"code_type": features["code_type"],
+			"tags": features["tags"],
+			"code_length": len(code_text.splitlines()),
+			"topic": section,
+			"purpose": section,
+			"explanation": explain_code(title, code_text)
+		})
+	return blocks
+
+
+def mark_duplicates(blocks):
+	seen_hashes = set()
+	for item in blocks:
+		code_hash = hashlib.md5(item["code"].encode()).hexdigest()
+		item["is_duplicate"] = code_hash in seen_hashes
+		seen_hashes.add(code_hash)
+	return blocks
 
-	for url in tqdm.tqdm(lesson_urls, desc="Crawling lessons"):
-		driver.get(url)
-		time.sleep(1)  # Chờ trang load
-		title = driver.title
-		# Lấy section/chapter từ title nếu có
-		section = title.split('–')[0].strip() if '–' in title else title
-		code_blocks = driver.find_elements(By.TAG_NAME, "pre")
-		for block in code_blocks:
-			code_text = block.text.strip()
-			if code_text:
-				code_hash = hashlib.md5(code_text.encode()).hexdigest()
-				is_duplicate = code_hash in seen_hashes
-				seen_hashes.add(code_hash)
-				code_language = get_code_language(code_text)
-				code_type = get_code_type(code_text)
-				tags = extract_tags(title, code_text)
-				code_length = len(code_text.splitlines())
-				item = {
-					"timestamp": timestamp,
-					"crawl_id": crawl_id,
-					"url": url,
-					"source_title": title,
-					"section": section,
-					"code": code_text,
-					"code_language": code_language,
-					"code_type": code_type,
-					"tags": tags,
-					"code_length": code_length,
-					"is_duplicate": is_duplicate,
-					"topic": section,
-					"purpose": section,
-					"explanation": explain_code(title, code_text)
-				}
-				all_code_blocks.append(item)
-
-	driver.quit()
+
+def load_tombstones(path=DELETIONS_FILE):
+	if not os.path.exists(path):
+		return {}
+	with open(path, "r", encoding="utf-8") as f:
+		return {t["crawl_id"]: t for t in json.load(f)}
+
+
+def crawl_react_dev_code_examples(cache_dir=PAGE_CACHE_DIR, force=False, delay=0.2):
+	"""
+	Crawl lại react.dev/learn theo kiểu incremental: chỉ trang thay đổi mới
+	được tải đầy đủ và trích xuất. OUTPUT_FILE luôn chứa toàn bộ code block
+	hiện tại; CHANGES_FILE chỉ chứa block của các trang đã đổi (đưa vào
+	normalize.py / upsert.py để không embedding lại những gì không đổi).
+
+	Block bị sửa hoặc xóa trên trang (và trang bị gỡ khỏi mục Learn) sinh
+	tombstone trong CHANGES_FILE và DELETIONS_FILE, để upsert.py xóa record
+	cũ thay vì giữ nó mãi trong corpus.
+	"""
+	cache = PageCache(cache_dir)
+	session = requests.Session()
+	session.headers["User-Agent"] = "chat-react-ai-crawler"
+
+	all_code_blocks = []
+	changed_blocks = []
+	removed_ids = set()
+	stats = {"unchanged": 0, "changed": 0, "errors": 0}
+	urls = lesson_urls(session)
+	for url in set(cache.index) - set(urls):
+		removed_ids |= cache.forget(url)
+	for url in tqdm.tqdm(urls, desc="Crawling lessons"):
+		try:
+			response, body_hash = fetch_page(session, url, cache, force)
+		except requests.RequestException as e:
+			print(f"Lỗi khi tải {url}: {e}")
+			stats["errors"] += 1
+			blocks = cache.blocks(url) or []
+		else:
+			if response is None:
+				stats["unchanged"] += 1
+				blocks = cache.blocks(url)
+			else:
+				stats["changed"] += 1
+				blocks = extract_page_blocks(url, response.text)
+				removed_ids |= cache.block_ids(url) - {b["crawl_id"] for b in blocks}
+				cache.store(url, response, body_hash, blocks)
+				changed_blocks.extend(blocks)
+		all_code_blocks.extend(blocks)
+		time.sleep(delay)
+	cache.save()
+	pruned = cache.prune()
+
+	# Tombstone tích lũy đến khi upsert; block xuất hiện lại thì bỏ tombstone của nó
+	current_ids = {b["crawl_id"] for b in all_code_blocks}
+	removed_ids -= current_ids
+	tombstones = load_tombstones()
+	now = datetime.now().isoformat()
+	new_tombstones = [{"crawl_id": i, "deleted": True, "timestamp": now} for i in sorted(removed_ids)]
+	tombstones.update((t["crawl_id"], t) for t in new_tombstones)
+	tombstones = [t for i, t in tombstones.items() if i not in current_ids]
+	with open(DELETIONS_FILE, "w", encoding="utf-8") as f:
+		json.dump(tombstones, f, ensure_ascii=False, indent=2)
 
 	# Lưu các đoạn code vào file JSON
-	with open("react_code_examples.json", "w", encoding="utf-8") as f:
-		json.dump(all_code_blocks, f, ensure_ascii=False, indent=2)
-	print(f"Đã lưu {len(all_code_blocks)} đoạn code vào react_code_examples.json")
+	with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
+		json.dump(mark_duplicates(all_code_blocks), f, ensure_ascii=False, indent=2)
+	with open(CHANGES_FILE, "w", encoding="utf-8") as f:
+		json.dump(changed_blocks + new_tombstones, f, ensure_ascii=False, indent=2)
+	print(f"Đã lưu {len(all_code_blocks)} đoạn code vào {OUTPUT_FILE}")
+	print(f"Trang đổi: {stats['changed']}, không đổi: {stats['unchanged']}, lỗi: {stats['errors']}; "
+		  f"{len(changed_blocks)} đoạn code mới/đổi, {len(new_tombstones)} bị xóa trong {CHANGES_FILE}; "
+		  f"{len(tombstones)} tombstone trong {DELETIONS_FILE}, {pruned} file trang cũ đã xóa")
 
 if __name__ == "__main__":
-	crawl_react_dev_code_examples()
-
+	parser = argparse.ArgumentParser(description="Crawl code examples from react.dev/learn (incremental)")
+	parser.add_argument('--cache-dir', default=PAGE_CACHE_DIR)
+	parser.add_argument('--force', action='store_true', help='Bỏ qua cache, tải và trích xuất lại mọi trang')
+	args = parser.parse_args()
+	crawl_react_dev_code_examples(args.cache_dir, args.force)
@@ -1,11 +1,12 @@
 
-import re
+import os
 import requests
 import time
 import json
-from datetime import datetime
+import argparse
+from datetime import datetime, timedelta
 from tqdm import tqdm
-from bs4 import BeautifulSoup
+from code_extraction import ExtractionStage, build_code_blocks_meta
 
 def read_api_key():
 	with open("key.env", "r", encoding="utf-8") as f:
@@ -15,73 +16,7 @@ def read_api_key():
 	return None
 
 
-# Trích xuất các đoạn code từ markdown (```...``` hoặc <code>...</code>)
-def extract_code_blocks(body_markdown, body_html=None):
-	code_blocks = []
-	# Trích xuất code trong ``` ... ```
-	if body_markdown:
-		code_blocks += re.findall(r'```[a-zA-Z0-9]*\n([\s\S]*?)```', body_markdown, re.MULTILINE)
-		code_blocks += re.findall(r'<code>([\s\S]*?)</code>', body_markdown, re.MULTILINE)
-	# Nếu không có code trong markdown, thử lấy từ body_html
-	if not code_blocks and body_html:
-		soup = BeautifulSoup(body_html, "html.parser")
-		# Lấy code trong <pre><code>...</code></pre>
-		for pre in soup.find_all("pre"):
-			code = pre.get_text("\n", strip=True)
-			if code.strip():
-				code_blocks.append(code.strip())
-		# Lấy code trong <code>...</code> (không nằm trong <pre>)
-		for code_tag in soup.find_all("code"):
-			if code_tag.find_parent("pre") is None:
-				code = code_tag.get_text("\n", strip=True)
-				if code.strip():
-					code_blocks.append(code.strip())
-	return [c.strip() for c in code_blocks if c.strip()]
-
-def get_code_language(code_text):
-	if code_text.strip().startswith('import') or 'function' in code_text or 'export default' in code_text:
-		return 'javascript/jsx'
-	if code_text.strip().startswith('<') and code_text.strip().endswith('>'):
-		return 'html/jsx'
-	if code_text.strip().startswith('npm') or code_text.strip().startswith('yarn'):
-		return 'shell'
-	return 'unknown'
-
-def get_code_type(code_text):
-	if 'function' in code_text:
-		return 'function'
-	if 'class' in code_text:
-		return 'class'
-	if 'export default' in code_text:
-		return 'component'
-	if code_text.strip().startswith('import'):
-		return 'import'
-	if code_text.strip().startswith('npm') or code_text.strip().startswith('yarn'):
-		return 'command'
-	return 'snippet'
-
-def extract_tags(title, code_text):
-	tags = set()
-	for word in title.lower().replace('–', '').replace('-', '').split():
-		if word not in ['react', 'a', 'the', 'to', 'of', 'in', 'and', 'for', 'on', 'with', 'is', 'by', 'as', 'an', 'at', 'from']:
-			tags.add(word)
-	if 'useState' in code_text:
-		tags.add('state')
-	if 'useEffect' in code_text:
-		tags.add('effect')
-	if 'useReducer' in code_text:
-		tags.add('reducer')
-	if 'props' in code_text:
-		tags.add('props')
-	if 'export default' in code_text:
-		tags.add('component')
-	return list(tags)
-
-def explain_code(title, code_text):
-	return f"Đoạn code này liên quan đến: {title}"
-
-
-def crawl_stackoverflow_reactjs(max_pages=150, page_size=50):
+def crawl_stackoverflow_reactjs(max_pages=150, page_size=50, workers=None):
 	api_key = read_api_key()
 	crawl_id = datetime.now().strftime('%Y%m%d%H%M%S')
 	# Đọc dữ liệu cũ nếu có
@@ -96,6 +31,8 @@ def crawl_stackoverflow_reactjs(max_pages=150, page_size=50):
 		existing_ids = set()
 
 	new_questions = []
+	# Trích xuất code chạy trong process pool, song song với việc tải trang
+	stage = ExtractionStage(build_question_record, workers)
 	for page in tqdm(range(1, max_pages + 1), desc="Crawling pages"):
 		url = (
 			f"https://api.stackexchange.com/2.3/questions"
@@ -112,48 +49,186 @@ def crawl_stackoverflow_reactjs(max_pages=150, page_size=50):
 			qid = item["question_id"]
 			if qid in existing_ids:
 				continue  # Bỏ qua nếu đã có
-			body_markdown = item.get("body_markdown", "")
-			body_html = item.get("body", "")
-			code_blocks = extract_code_blocks(body_markdown, body_html)
-			code_blocks_meta = []
-			for code in code_blocks:
-				code_language = get_code_language(code)
-				code_type = get_code_type(code)
-				tags = extract_tags(item["title"], code)
-				code_length = len(code.splitlines())
-				code_meta = {
-					"code": code,
-					"code_language": code_language,
-					"code_type": code_type,
-					"tags": tags,
-					"code_length": code_length,
-					"explanation": explain_code(item["title"], code)
-				}
-				code_blocks_meta.append(code_meta)
-			question = {
-				"timestamp": datetime.now().isoformat(),
-				"crawl_id": crawl_id,
-				"question_id": qid,
-				"title": item["title"],
-				"link": item["link"],
-				"tags": item["tags"],
-				"creation_date": datetime.utcfromtimestamp(item["creation_date"]).isoformat(),
-				"score": item["score"],
-				"owner": item["owner"].get("display_name", "") if "owner" in item else "",
-				"is_answered": item["is_answered"],
-				"view_count": item["view_count"],
-				"answer_count": item["answer_count"],
-				"body_markdown": body_markdown,
-				"body_html": body_html,
-				"code_blocks": code_blocks_meta,
-			}
-			new_questions.append(question)
+			new_questions.extend(stage.submit(item, crawl_id))
 		time.sleep(1)  # Tránh bị giới hạn API
+	new_questions.extend(stage.drain())
+	stage.close()
 
 	all_questions = existing_questions + new_questions
 	with open("reactjs_stackoverflow_questions.json", "w", encoding="utf-8") as f:
 		json.dump(all_questions, f, ensure_ascii=False, indent=2)
 	print(f"Đã lưu {len(new_questions)} câu hỏi mới, tổng cộng {len(all_questions)} câu hỏi vào reactjs_stackoverflow_questions.json")
 
+
+# --- Incremental sync: high-water mark + JSONL store ---
+API_URL = "https://api.stackexchange.com/2.3"
+SYNC_STORE = "reactjs_stackoverflow_questions.jsonl"
+SYNC_STATE = "stackoverflow_sync_state.json"
+MAX_IDS_PER_CALL = 100  # giới hạn của API cho /questions/{ids}/answers
+
+
+def api_get(path, params, api_key=None, stats=None):
+	"""Gọi Stack Exchange API, tôn trọng trường `backoff` trả về."""
+	params = dict(params, site="stackoverflow")
+	if api_key:
+		params["key"] = api_key
+	resp = requests.get(f"{API_URL}{path}", params=params, timeout=30)
+	if stats is not None:
+		stats["api_calls"] += 1
+	resp.raise_for_status()
+	data = resp.json()
+	if stats is not None and "quota_remaining" in data:
+		stats["quota_remaining"] = data["quota_remaining"]
+	if data.get("backoff"):
+		time.sleep(data["backoff"])
+	return data
+
+
+def load_sync_state(path=SYNC_STATE):
+	try:
+		with open(path, "r", encoding="utf-8") as f:
+			return json.load(f)
+	except (FileNotFoundError, json.JSONDecodeError):
+		return {}
+
+
+def save_sync_state(state, path=SYNC_STATE):
+	tmp = path + ".tmp"
+	with open(tmp, "w", encoding="utf-8") as f:
+		json.dump(state, f, indent=2)
+	os.replace(tmp, path)
+
+
+def fetch_best_answers(question_ids, api_key=None, stats=None):
+	"""
+	Câu trả lời tốt nhất (accepted, nếu không có thì điểm cao nhất) cho mỗi
+	câu hỏi, lấy theo lô tối đa 100 id mỗi lần gọi /questions/{ids}/answers.
+	"""
+	best = {}
+	for start in range(0, len(question_ids), MAX_IDS_PER_CALL):
+		ids = ";".join(str(q) for q in question_ids[start:start + MAX_IDS_PER_CALL])
+		page = 1
+		while True:
+			data = api_get(f"/questions/{ids}/answers", {
+				"order": "desc", "sort": "votes", "filter": "withbody",
+				"pagesize": 100, "page": page,
+			}, api_key, stats)
+			for answer in data.get("items", []):
+				qid = answer["question_id"]
+				current = best.get(qid)
+				if current is None or (answer.get("is_accepted") and not current.get("is_accepted")) \
+						or (answer.get("is_accepted") == current.get("is_accepted") and answer["score"] > current["score"]):
+					best[qid] = answer
+			if not data.get("has_more"):
+				break
+			page += 1
+	return best
+
+
+def build_question_record(item, crawl_id, answer=None):
+	body_markdown = item.get("body_markdown", "")
+	body_html = item.get("body", "")
+	record = {
+		"timestamp": datetime.now().isoformat(),
+		"crawl_id": crawl_id,
+		"question_id": item["question_id"],
+		"title": item["title"],
+		"link": item["link"],
+		"tags": item["tags"],
+		"creation_date": datetime.utcfromtimestamp(item["creation_date"]).isoformat(),
+		"score": item["score"],
+		"owner": item["owner"].get("display_name", "") if "owner" in item else "",
+		"is_answered": item["is_answered"],
+		"view_count": item["view_count"],
+		"answer_count": item["answer_count"],
+		"body_markdown": body_markdown,
+		"body_html": body_html,
+		"code_blocks": build_code_blocks_meta(item["title"], body_markdown, body_html),
+	}
+	if answer:
+		record["answer"] = {
+			"answer_id": answer["answer_id"],
+			"is_accepted": answer.get("is_accepted", False),
+			"score": answer["score"],
+			"body_html": answer.get("body", ""),
+			"code_blocks": build_code_blocks_meta(item["title"], answer.get("body_markdown", ""), answer.get("body", "")),
+		}
+	return record
+
+
+def sync_stackoverflow_reactjs(store=SYNC_STORE, state_path=SYNC_STATE, since_days=7, page_size=100, max_pages=50,
+							   workers=None):
+	"""
+	Đồng bộ incremental: chỉ lấy câu hỏi tạo sau high-water mark (`fromdate`),
+	lấy kèm câu trả lời theo lô và append vào file JSONL. Trích xuất code chạy
+	trong process pool trong lúc trang tiếp theo đang được tải. State của một
+	trang chỉ được lưu khi mọi record của trang đó đã được ghi, nên có thể
+	dừng giữa chừng rồi chạy tiếp.
+	"""
+	api_key = read_api_key() if os.path.exists("key.env") else None
+	state = load_sync_state(state_path)
+	high_water = state.get("high_water") or int((datetime.now() - timedelta(days=since_days)).timestamp())
+	# Câu hỏi tạo đúng giây high_water đã lưu (fromdate là inclusive)
+	skip_ids = set(state.get("ids_at_high_water", []))
+	seen_at_mark = set(skip_ids)
+	crawl_id = datetime.now().strftime('%Y%m%d%H%M%S')
+	stats = {"api_calls": 0, "quota_remaining": None, "new_questions": 0}
+
+	fromdate = high_water
+	page = 1
+	submitted = written = 0
+	checkpoints = []  # (số record đã submit sau trang, state của trang)
+
+	def write(records):
+		nonlocal written
+		for record in records:
+			out.write(json.dumps(record, ensure_ascii=False) + "\n")
+		written += len(records)
+		out.flush()
+		while checkpoints and checkpoints[0][0] <= written:
+			save_sync_state(checkpoints.pop(0)[1], state_path)
+
+	with open(store, "a", encoding="utf-8") as out, ExtractionStage(build_question_record, workers) as stage:
+		while page <= max_pages:
+			data = api_get("/questions", {
+				"order": "asc", "sort": "creation", "tagged": "reactjs",
+				"fromdate": fromdate, "pagesize": page_size, "page": page, "filter": "withbody",
+			}, api_key, stats)
+			items = [i for i in data.get("items", [])
+					 if not (i["creation_date"] == fromdate and i["question_id"] in skip_ids)]
+			answered = [i["question_id"] for i in items if i.get("answer_count")]
+			answers = fetch_best_answers(answered, api_key, stats) if answered else {}
+			for item in items:
+				write(stage.submit(item, crawl_id, answers.get(item["question_id"])))
+				submitted += 1
+				if item["creation_date"] > high_water:
+					high_water = item["creation_date"]
+					seen_at_mark = set()
+				if item["creation_date"] == high_water:
+					seen_at_mark.add(item["question_id"])
+			stats["new_questions"] += len(items)
+			checkpoints.append((submitted, {"high_water": high_water, "ids_at_high_water": sorted(seen_at_mark),
+											"last_sync": datetime.now().isoformat()}))
+			write([])
+			if not data.get("has_more"):
+				break
+			page += 1
+			time.sleep(0.5)  # Tránh bị giới hạn API
+		write(stage.drain())
+
+	print(f"Đã append {stats['new_questions']} câu hỏi mới vào {store} "
+		  f"({stats['api_calls']} API calls, quota còn {stats['quota_remaining']})")
+	return stats
+
+
 if __name__ == "__main__":
-	crawl_stackoverflow_reactjs(max_pages=150, page_size=50)  
+	parser = argparse.ArgumentParser(description="Crawl câu hỏi reactjs trên StackOverflow")
+	parser.add_argument('--sync', action='store_true', help='Đồng bộ incremental từ high-water mark vào file JSONL')
+	parser.add_argument('--since-days', type=int, default=7, help='Lần sync đầu tiên: lấy câu hỏi của N ngày gần nhất')
+	parser.add_argument('--store', default=SYNC_STORE)
+	parser.add_argument('--workers', type=int, default=None, help='Số process trích xuất code (mặc định: số core, 0 = chạy tuần tự)')
+	args = parser.parse_args()
+	if args.sync:
+		sync_stackoverflow_reactjs(args.store, since_days=args.since_days, workers=args.workers)
+	else:
+		crawl_stackoverflow_reactjs(max_pages=150, page_size=50, workers=args.workers)  
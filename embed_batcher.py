@@ -0,0 +1,87 @@
+import time
+import asyncio
+
+# Gemini batchEmbedContents accepts at most 100 texts per request.
+MAX_API_BATCH = 100
+
+
+class EmbeddingBatcher:
+    """
+    Async micro-batcher for query embeddings.
+
+    Texts submitted within `max_wait_ms` of each other (or until `max_batch`
+    texts are pending) are sent as one multi-content embedding request and
+    the vectors are fanned back out to the awaiting callers. `embed_batch`
+    is a blocking function list[str] -> list[vector]; it runs in a thread.
+    """
+
+    def __init__(self, embed_batch, max_wait_ms=5.0, max_batch=32):
+        self.embed_batch = embed_batch
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_batch = max(1, min(int(max_batch), MAX_API_BATCH))
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self.metrics = {
+            "requests": 0,
+            "batches": 0,
+            "texts_sent": 0,
+            "errors": 0,
+            "max_batch_seen": 0,
+            "total_batch_latency_ms": 0.0,
+        }
+
+    async def embed(self, text):
+        """Return the embedding of `text`, sharing one API call with concurrent callers."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self.metrics["requests"] += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        # Identical concurrent questions share a single slot in the request.
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        started = time.perf_counter()
+        try:
+            vectors = await asyncio.to_thread(self.embed_batch, texts)
+        except Exception as e:
+            self.metrics["errors"] += 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        by_text = dict(zip(texts, vectors))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+        self.metrics["batches"] += 1
+        self.metrics["texts_sent"] += len(texts)
+        self.metrics["max_batch_seen"] = max(self.metrics["max_batch_seen"], len(texts))
+        self.metrics["total_batch_latency_ms"] += (time.perf_counter() - started) * 1000
+
+    def stats(self):
+        """Snapshot of batching metrics."""
+        m = dict(self.metrics)
+        batches = m["batches"] or 1
+        m["avg_batch_size"] = m["texts_sent"] / batches
+        m["avg_batch_latency_ms"] = m.pop("total_batch_latency_ms") / batches
+        m["api_calls_saved"] = m["requests"] - m["batches"] - m["errors"]
+        m["pending"] = len(self._pending)
+        m["max_wait_ms"] = self.max_wait * 1000
+        m["max_batch"] = self.max_batch
+        return m
@@ -0,0 +1,179 @@
+import os
+import json
+import zlib
+import hashlib
+import argparse
+from functools import lru_cache
+
+import numpy as np
+from code_chunker import tokenize
+from embedding_transform import EMBEDDING_DIM, RANDOM_SEED, Projection, random_orthogonal, fit_pca, l2_normalize, transform, projection_tag
+
+# Embedding providers: every one maps texts to L2-normalized EMBEDDING_DIM
+# vectors and carries a `tag` stored on each document it embedded, so
+# vectors of different providers (or of a refitted local model) are never
+# compared with each other.
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "gemini")
+LOCAL_EMBEDDING_PATH = os.getenv("LOCAL_EMBEDDING_PATH", "local_embedding.npz")
+HASH_FEATURES = 8192
+MAX_BATCH = 1024
+
+
+class GeminiProvider:
+    """Gemini embed_content (batched), projected into the shared index space."""
+
+    name = "gemini"
+    collection_suffix = ""
+
+    def __init__(self, model="models/embedding-001", configure=None):
+        self.model = model
+        self.configure = configure
+        # The projection is part of the vector space: a refit must not match old documents
+        self.tag = f"gemini:{model}:{projection_tag()}"
+
+    def embed(self, texts):
+        from query import get_raw_embeddings
+        if self.configure is not None:
+            self.configure()
+        return transform(get_raw_embeddings(texts, self.model))
+
+
+@lru_cache(maxsize=200000)
+def _bucket(token):
+    # Stable across processes (unlike hash()): index and sign from one CRC32.
+    h = zlib.crc32(token.encode("utf-8"))
+    return h % HASH_FEATURES, 1.0 if h & 0x80000000 else -1.0
+
+
+def _features(text):
+    """Hashed unigram + bigram tokens with sublinear TF: (indices, values)."""
+    tokens = tokenize(text)
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    counts = {}
+    for gram in grams:
+        index, sign = _bucket(gram)
+        counts[index] = counts.get(index, 0.0) + sign
+    if not counts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    return indices, np.sign(values) * (1.0 + np.log(np.maximum(np.abs(values), 1.0)))
+
+
+def _tfidf(texts, idf):
+    """Dense (n, HASH_FEATURES) TF-IDF rows, L2-normalized."""
+    x = np.zeros((len(texts), HASH_FEATURES), dtype=np.float32)
+    for row, text in enumerate(texts):
+        indices, values = _features(text or "")
+        x[row, indices] = values
+    return l2_normalize(x * idf)
+
+
+class LocalHashingProvider:
+    """
+    CPU-only embeddings: hashed TF-IDF over code-aware tokens (camelCase /
+    snake_case split, unigrams + bigrams), projected to EMBEDDING_DIM with a
+    low-rank projection fitted on the corpus (LSA), or a seeded random
+    orthogonal one until `fit` has been run.
+    """
+
+    name = "local"
+    collection_suffix = "_local"
+
+    def __init__(self, idf=None, projection=None):
+        self.idf = np.ones(HASH_FEATURES, dtype=np.float32) if idf is None else np.asarray(idf, dtype=np.float32)
+        self.projection = projection or random_orthogonal(HASH_FEATURES, EMBEDDING_DIM)
+        digest = hashlib.sha1(self.idf.tobytes())
+        digest.update(self.projection.fingerprint().encode("utf-8"))
+        self.tag = f"local-hash:{digest.hexdigest()[:12]}"
+
+    def embed(self, texts):
+        texts = list(texts)
+        out = np.empty((len(texts), self.projection.out_dim), dtype=np.float32)
+        for start in range(0, len(texts), MAX_BATCH):
+            batch = texts[start:start + MAX_BATCH]
+            out[start:start + len(batch)] = self.projection.apply(_tfidf(batch, self.idf))
+        return l2_normalize(out)
+
+    @classmethod
+    def fit(cls, texts, target_dim=EMBEDDING_DIM):
+        """Fit IDF weights and an LSA projection on a sample of corpus texts."""
+        texts = [t for t in texts if t]
+        df = np.zeros(HASH_FEATURES, dtype=np.float32)
+        for text in texts:
+            indices, _ = _features(text)
+            df[indices] += 1
+        idf = (np.log((1.0 + len(texts)) / (1.0 + df)) + 1.0).astype(np.float32)
+        return cls(idf, fit_pca(_tfidf(texts, idf), target_dim, RANDOM_SEED))
+
+    def save(self, path=LOCAL_EMBEDDING_PATH):
+        np.savez(path, idf=self.idf, components=self.projection.components,
+                 mean=self.projection.mean, method=np.array(self.projection.method))
+
+    @classmethod
+    def load(cls, path=LOCAL_EMBEDDING_PATH):
+        """Fitted model from `path`, or the unfitted (random projection) model if it does not exist."""
+        if not path or not os.path.exists(path):
+            return cls()
+        with np.load(path) as data:
+            projection = Projection(data["components"], data["mean"], str(data["method"]))
+            if projection.in_dim != HASH_FEATURES:
+                raise ValueError(f"{path} was fitted for {projection.in_dim} hash features, expected {HASH_FEATURES}")
+            return cls(data["idf"], projection)
+
+
+_providers = {}
+
+
+def check_stored_tag(stored, provider):
+    """
+    Raise if documents were embedded by another provider or projection than
+    `provider` (the vectors would not be comparable). Documents without a
+    tag, or with a tag from before projections were tagged, only warn.
+    """
+    if stored is None or stored == provider.tag:
+        return
+    if provider.tag.startswith(stored + ":"):
+        print(f"⚠️ Documents carry the untagged-projection tag '{stored}'; re-run upsert to tag them {provider.tag}")
+        return
+    raise RuntimeError(f"Documents were embedded with '{stored}' but queries use '{provider.tag}'. "
+                       "Use the same provider and projection artifact, or re-embed the corpus.")
+
+
+def get_provider(name=None, configure=None):
+    """The configured provider (EMBEDDING_PROVIDER), created once per process."""
+    name = name or EMBEDDING_PROVIDER
+    provider = _providers.get(name)
+    if provider is None:
+        if name == "gemini":
+            provider = GeminiProvider(configure=configure)
+        elif name == "local":
+            provider = LocalHashingProvider.load(LOCAL_EMBEDDING_PATH)
+        else:
+            raise ValueError(f"Unknown embedding provider '{name}'. Use 'gemini' or 'local'.")
+        _providers[name] = provider
+    return provider
+
+
+def main():
+    """Fit the local provider on the normalized corpus."""
+    from upsert import build_embed_text
+
+    parser = argparse.ArgumentParser(description="Fit the local (CPU) embedding provider on the corpus")
+    parser.add_argument('--input', default='normalized.json', help='Normalized corpus JSON')
+    parser.add_argument('--sample', type=int, default=2000, help='Number of records used for fitting')
+    parser.add_argument('--dim', type=int, default=EMBEDDING_DIM, help='Target dimension')
+    parser.add_argument('--output', default=LOCAL_EMBEDDING_PATH)
+    args = parser.parse_args()
+
+    with open(args.input, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    rng = np.random.default_rng(RANDOM_SEED)
+    picked = rng.permutation(len(records))[:args.sample]
+    provider = LocalHashingProvider.fit([build_embed_text(records[i]) for i in picked], args.dim)
+    provider.save(args.output)
+    print(f"Saved local embedding model {provider.tag} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+import argparse
+import hashlib
+import numpy as np
+
+# Target dimension of every stored and query vector. Must match the
+# `numDimensions` of the Atlas vector index.
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1024"))
+PROJECTION_PATH = os.getenv("EMBEDDING_PROJECTION_PATH", "embedding_projection.npz")
+RANDOM_SEED = 1234
+EMBED_SAMPLE_BATCH = 100  # texts per embedding request when sampling the corpus
+
+_projections = {}
+
+
+class Projection:
+    """Linear map from the raw embedding space down to `out_dim`."""
+
+    def __init__(self, components, mean=None, method="random"):
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        in_dim = self.components.shape[0]
+        self.mean = np.zeros(in_dim, dtype=np.float32) if mean is None else np.asarray(mean, dtype=np.float32)
+        self.method = method
+
+    @property
+    def in_dim(self):
+        return self.components.shape[0]
+
+    @property
+    def out_dim(self):
+        return self.components.shape[1]
+
+    def fingerprint(self):
+        """Short stable id of the projection, used to tag artifacts."""
+        digest = hashlib.sha1(self.components.tobytes())
+        digest.update(self.mean.tobytes())
+        return f"{self.method}-{self.in_dim}x{self.out_dim}-{digest.hexdigest()[:12]}"
+
+    def apply(self, vectors):
+        return (vectors - self.mean) @ self.components
+
+    def save(self, path=PROJECTION_PATH):
+        np.savez(path, components=self.components, mean=self.mean, method=np.array(self.method))
+
+    @classmethod
+    def load(cls, path=PROJECTION_PATH):
+        with np.load(path) as data:
+            return cls(data["components"], data["mean"], str(data["method"]))
+
+
+def _check_reduces(in_dim, target_dim):
+    if in_dim <= target_dim:
+        raise ValueError(
+            f"Raw dimension {in_dim} is not above the target {target_dim}: transform() pads such "
+            f"vectors (or keeps them as they are) and never applies a projection, so none should be built."
+        )
+
+
+def random_orthogonal(in_dim, target_dim=EMBEDDING_DIM, seed=RANDOM_SEED):
+    """Seeded random projection with orthonormal columns (preserves angles on average)."""
+    _check_reduces(in_dim, target_dim)
+    rng = np.random.default_rng(seed)
+    q, _ = np.linalg.qr(rng.standard_normal((in_dim, target_dim)))
+    return Projection(q, method="random")
+
+
+def fit_pca(vectors, target_dim=EMBEDDING_DIM, seed=RANDOM_SEED):
+    """Fit a PCA projection on a sample of raw corpus embeddings."""
+    x = np.asarray(vectors, dtype=np.float32)
+    _check_reduces(x.shape[1], target_dim)
+    mean = x.mean(axis=0)
+    _, _, vt = np.linalg.svd(x - mean, full_matrices=False)
+    components = vt[:target_dim].T
+    if components.shape[1] < target_dim:
+        # Fewer samples than target dims: complete the basis with random
+        # directions orthogonal to the principal components.
+        rng = np.random.default_rng(seed)
+        extra = rng.standard_normal((x.shape[1], target_dim - components.shape[1]))
+        q, _ = np.linalg.qr(np.hstack([components, extra]))
+        components = q[:, :target_dim]
+    return Projection(components, mean, method="pca")
+
+
+def get_projection(in_dim, target_dim=EMBEDDING_DIM, path=PROJECTION_PATH):
+    """Return the projection for `in_dim` -> `target_dim` (fitted artifact if available)."""
+    key = (in_dim, target_dim, path)
+    projection = _projections.get(key)
+    if projection is None:
+        if path and os.path.exists(path):
+            projection = Projection.load(path)
+            if (projection.in_dim, projection.out_dim) != (in_dim, target_dim):
+                raise ValueError(
+                    f"Projection {path} maps {projection.in_dim}->{projection.out_dim}, "
+                    f"expected {in_dim}->{target_dim}. Refit it or change EMBEDDING_DIM."
+                )
+        else:
+            print(f"⚠️ No projection artifact at {path}: using the seeded random projection "
+                  f"({in_dim}->{target_dim}). Vectors made with a fitted one will not match.")
+            projection = random_orthogonal(in_dim, target_dim)
+        _projections[key] = projection
+    return projection
+
+
+def projection_tag(target_dim=EMBEDDING_DIM, path=PROJECTION_PATH):
+    """
+    Identity of the transform applied to raw vectors, for provider tags:
+    the fitted artifact's fingerprint, or the seeded random fallback.
+    """
+    if path and os.path.exists(path):
+        return f"{target_dim}:{Projection.load(path).fingerprint()}"
+    return f"{target_dim}:random-s{RANDOM_SEED}"
+
+
+def l2_normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def transform(vectors, target_dim=EMBEDDING_DIM):
+    """Project raw embeddings (1-D or 2-D) to `target_dim` and L2-normalize them."""
+    x = np.asarray(vectors, dtype=np.float32)
+    single = x.ndim == 1
+    x = np.atleast_2d(x)
+    in_dim = x.shape[1]
+    if in_dim > target_dim:
+        x = get_projection(in_dim, target_dim).apply(x)
+    elif in_dim < target_dim:
+        # Zero padding keeps cosine similarity intact.
+        x = np.pad(x, ((0, 0), (0, target_dim - in_dim)))
+    x = l2_normalize(x.astype(np.float32, copy=False))
+    return x[0] if single else x
+
+
+def main():
+    """Fit a projection artifact on a sample of the corpus."""
+    import json
+    import google.generativeai as genai
+    from upsert import read_env_key, build_embed_text
+    from query import get_raw_embeddings
+
+    parser = argparse.ArgumentParser(description="Fit the embedding projection on the corpus")
+    parser.add_argument('--input', default='normalized.json', help='Normalized corpus JSON')
+    parser.add_argument('--sample', type=int, default=2000, help='Number of records to embed for fitting')
+    parser.add_argument('--dim', type=int, default=EMBEDDING_DIM, help='Target dimension')
+    parser.add_argument('--method', choices=['pca', 'random'], default='pca')
+    parser.add_argument('--output', default=PROJECTION_PATH)
+    args = parser.parse_args()
+
+    genai.configure(api_key=read_env_key("GEMINI_API_KEY"))
+    if args.method == 'random':
+        vectors = get_raw_embeddings(["react"])
+    else:
+        with open(args.input, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        rng = np.random.default_rng(RANDOM_SEED)
+        picked = rng.permutation(len(records))[:args.sample]
+        texts = [t for t in (build_embed_text(records[i]) for i in picked) if t]
+        # One request per batch of texts, not one per text
+        vectors = np.concatenate([get_raw_embeddings(texts[i:i + EMBED_SAMPLE_BATCH])
+                                  for i in range(0, len(texts), EMBED_SAMPLE_BATCH)])
+    if vectors.shape[1] <= args.dim:
+        parser.error(f"Raw embeddings have {vectors.shape[1]} dimensions, not more than --dim {args.dim}: "
+                     f"they are padded, not projected, so no artifact was written.")
+    if args.method == 'random':
+        projection = random_orthogonal(vectors.shape[1], args.dim)
+    else:
+        projection = fit_pca(vectors, args.dim)
+
+    projection.save(args.output)
+    print(f"Saved projection {projection.fingerprint()} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+import chatbot
+from model_router import ModelRouter
+from local_index import LocalIndex
+from resilience import CircuitBreaker, Deadline
+
+# Offline RAG evaluation: run a question set through retrieval + generation,
+# record embedding / search / LLM responses to a cassette so later runs can
+# replay them deterministically without network access, and report answer
+# quality next to per-stage latency and token usage.
+
+CASSETTE_PATH = "eval_cassette.jsonl"
+EVAL_DEADLINE_S = 24 * 3600  # effectively no request deadline while evaluating
+CODE_BLOCK_RE = re.compile(r'```(?:tsx|jsx|typescript|ts|javascript|js)?[^\n]*\n(.*?)```', re.S)
+
+
+class CassetteMiss(Exception):
+    """A replayed call has no recorded response."""
+
+
+class Cassette:
+    """
+    JSONL store of recorded responses keyed by a hash of the request.
+
+    Modes: "record" (replay what exists, call through and append the rest),
+    "replay" (recorded responses only, a miss raises CassetteMiss) and
+    "live" (always call through, nothing stored).
+    """
+
+    def __init__(self, path=CASSETTE_PATH, mode="record"):
+        self.path = path
+        self.mode = mode
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if mode != "live" and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry["value"]
+
+    @staticmethod
+    def key(kind, payload):
+        raw = json.dumps([kind, payload], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        if self.mode == "live" or key not in self.entries:
+            if self.mode == "replay":
+                self.misses += 1
+                raise CassetteMiss(f"No recorded response for {key[:12]} (run with --mode record)")
+            return None
+        self.hits += 1
+        return self.entries[key]
+
+    def put(self, key, value):
+        if self.mode != "record":
+            return
+        self.entries[key] = value
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": key, "value": value}, ensure_ascii=False, default=str) + "\n")
+
+    async def call(self, kind, payload, fetch):
+        """Recorded value for (kind, payload), or `await fetch()` (and record it)."""
+        key = self.key(kind, payload)
+        value = self.get(key)
+        if value is None:
+            value = await fetch()
+            self.put(key, value)
+        return value
+
+
+def _vector_key(embedding):
+    # Rounded so a replayed vector maps to the same search entry.
+    return [round(float(x), 6) for x in embedding]
+
+
+def install_cassette(cassette):
+    """Route chatbot's embedding, search and LLM calls through the cassette."""
+    real_embed = chatbot._embed_texts
+    real_complete = chatbot._cerebras_complete
+    real_find_top_k = chatbot.find_top_k
+    real_get_collection = chatbot.get_collection
+
+    # Vectors of another provider (or another fit of the local one) must not be replayed.
+    provider_tag = chatbot.get_provider(configure=chatbot.configure_genai).tag
+
+    def embed_texts(texts):
+        # Per-text entries: the batch composition does not change the keys.
+        vectors = {}
+        missing = []
+        for text in texts:
+            key = cassette.key("embedding", {"provider": provider_tag, "text": text})
+            value = cassette.get(key)
+            if value is None:
+                missing.append(text)
+            else:
+                vectors[text] = value
+        if missing:
+            for text, vector in zip(missing, real_embed(missing)):
+                cassette.put(cassette.key("embedding", {"provider": provider_tag, "text": text}), vector)
+                vectors[text] = vector
+        return [vectors[text] for text in texts]
+
+    async def complete(model, messages, **kwargs):
+        async def fetch():
+            response = await real_complete(model, messages, **kwargs)
+            usage = getattr(response, "usage", None)
+            return {
+                "content": response.choices[0].message.content,
+                "usage": {
+                    "prompt_tokens": getattr(usage, "prompt_tokens", None),
+                    "completion_tokens": getattr(usage, "completion_tokens", None),
+                },
+            }
+        value = await cassette.call("completion", {"model": model, "messages": messages}, fetch)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=value["content"]))],
+            usage=SimpleNamespace(**value["usage"]),
+        )
+
+    async def find_top_k(query_embedding, collection, k=5, filters=None):
+        # The local index is already offline and deterministic: search it for real,
+        # so index changes are evaluated even when replaying.
+        if isinstance(collection, LocalIndex):
+            return await real_find_top_k(query_embedding, collection, k, filters)
+
+        async def fetch():
+            return await real_find_top_k(query_embedding, collection, k, filters)
+        payload = {"vector": _vector_key(query_embedding), "k": k, "filters": filters}
+        return await cassette.call("search", payload, fetch)
+
+    async def get_collection():
+        if cassette.mode == "replay" and chatbot.RETRIEVAL_BACKEND != "local":
+            return None  # every Atlas search is replayed; no connection needed
+        return await real_get_collection()
+
+    if cassette.mode == "replay":
+        # generate_answer checks the client up front; replay never touches it.
+        chatbot.get_cerebras_client = lambda: None
+    chatbot._embed_texts = embed_texts
+    chatbot.find_top_k = find_top_k
+    chatbot.get_collection = get_collection
+    chatbot._embedding_batcher = None
+    chatbot._embedding_cache.clear()
+    # Every question must really be searched (and its latency measured).
+    chatbot.retrieval_cache.max_entries = 0
+    # No hedging: the answer must not depend on which model won a race.
+    chatbot._model_router = ModelRouter(complete, hedge=False)
+    # No breakers or deadlines: a miss or a slow recording must fail only its
+    # own item (reported as an error), never turn later items into canned answers.
+    chatbot.breakers.update({stage: CircuitBreaker(stage, failures=float("inf")) for stage in chatbot.breakers})
+    chatbot.Deadline = lambda: Deadline(total=EVAL_DEADLINE_S, budgets={})
+
+
+def load_eval_set(path, limit=None):
+    """
+    Evaluation items: {"question", "expected"} where `expected` lists
+    crawl_ids or links that count as a retrieval hit. Accepts the curated
+    JSONL format, a JSON list, or dataset_react.jsonl conversations
+    (no labels: only answer metrics are scored).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        rows = json.loads(text)
+    else:
+        rows = [json.loads(line) if line.lstrip().startswith("{") else {"question": line.strip()}
+                for line in text.splitlines() if line.strip()]
+    items = []
+    for row in rows:
+        question = row.get("question")
+        if not question:
+            question = next((m.get("content") for m in row.get("messages", []) if m.get("role") == "user"), None)
+        if question:
+            expected = row.get("expected") or []
+            items.append({"question": question, "expected": [expected] if isinstance(expected, str) else expected})
+    return items[:limit]
+
+
+def extract_code_blocks(answer):
+    return [block.strip() for block in CODE_BLOCK_RE.findall(answer or "") if block.strip()]
+
+
+def is_hit(docs, expected):
+    return any(doc.get("id") in expected or doc.get("parent_id") in expected or doc.get("link") in expected
+               for doc in docs)
+
+
+async def evaluate_item(index, item, semaphore, topk, model, filters):
+    trace = {}
+    result = {"index": index, "question": item["question"]}
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            answer, _, _ = await chatbot.get_chatbot_response(item["question"], None, topk, model, filters, trace=trace)
+            result["answer"] = chatbot.remove_think_tags(answer)
+        except Exception as e:
+            result["error"] = str(e)
+            result["answer"] = ""
+        result["total_s"] = time.perf_counter() - started
+    if "degraded" in trace:
+        # Upstream errors and cassette misses come back as degraded answers, not exceptions
+        result["error"] = f"degraded ({trace['degraded']['stage']}): {trace['degraded']['reason']}"
+    for stage in ("embedding_s", "search_s", "generation_s"):
+        result[stage] = trace.get(stage)
+    result["docs"] = trace.get("docs", [])
+    result["usage"] = trace.get("usage")
+    result["model_used"] = trace.get("model_used")
+    if item["expected"]:
+        result["hit"] = is_hit(result["docs"], item["expected"])
+    result["answer_chars"] = len(result["answer"])
+    result["code_blocks"] = extract_code_blocks(result["answer"])
+    return result
+
+
+def type_check(results):
+    """tsc pass rate of the generated code blocks (all blocks of an answer must pass)."""
+    from evaluate_test_cases import find_working_npx_command, check_tsx_file
+    npx_command = find_working_npx_command(required=False)
+    if npx_command is None:
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        for result in results:
+            if not result["code_blocks"]:
+                continue
+            checks = []
+            for i, code in enumerate(result["code_blocks"]):
+                path = os.path.join(tmp, f"Answer{result['index']}_{i}.tsx")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(code)
+                checks.append(check_tsx_file(npx_command, path))
+            result["tsc_passed"] = all(c["passed"] for c in checks)
+            result["tsc_errors"] = [c["errors"] for c in checks if not c["passed"]]
+
+
+def percentile(values, q):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(results, elapsed):
+    labeled = [r for r in results if "hit" in r]
+    checked = [r for r in results if "tsc_passed" in r]
+    answered = [r for r in results if r["answer"] and "error" not in r]
+    summary = {
+        "questions": len(results),
+        "errors": sum(1 for r in results if "error" in r),
+        "wall_time_s": elapsed,
+        "retrieval_hit_rate": sum(r["hit"] for r in labeled) / len(labeled) if labeled else None,
+        "labeled": len(labeled),
+        "avg_answer_chars": sum(r["answer_chars"] for r in answered) / len(answered) if answered else None,
+        "answers_with_code": sum(1 for r in results if r["code_blocks"]),
+        "tsc_pass_rate": sum(r["tsc_passed"] for r in checked) / len(checked) if checked else None,
+        "tsc_checked": len(checked),
+        "latency": {},
+        "tokens": {
+            "prompt": sum((r["usage"] or {}).get("prompt_tokens") or 0 for r in results),
+            "completion": sum((r["usage"] or {}).get("completion_tokens") or 0 for r in results),
+        },
+    }
+    for stage in ("embedding_s", "search_s", "generation_s", "total_s"):
+        values = [r.get(stage) for r in results]
+        summary["latency"][stage] = {"p50": percentile(values, 0.5), "p95": percentile(values, 0.95)}
+    return summary
+
+
+async def run_eval(items, topk=5, model="gpt-oss-120b", filters=None, concurrency=4):
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        evaluate_item(i, item, semaphore, topk, model, filters) for i, item in enumerate(items)
+    ))
+    return results, time.perf_counter() - started
+
+
+def print_summary(summary, cassette):
+    def fmt(value, pct=False):
+        if value is None:
+            return "-"
+        return f"{value * 100:.1f}%" if pct else f"{value:.3f}"
+
+    print(f"📊 {summary['questions']} questions, {summary['errors']} errors, {summary['wall_time_s']:.1f}s")
+    print(f"   retrieval hit rate: {fmt(summary['retrieval_hit_rate'], True)} ({summary['labeled']} labeled)")
+    print(f"   avg answer length:  {fmt(summary['avg_answer_chars'])} chars")
+    print(f"   tsc pass rate:      {fmt(summary['tsc_pass_rate'], True)} ({summary['tsc_checked']} answers with code)")
+    for stage, p in summary["latency"].items():
+        print(f"   {stage:<13} p50={fmt(p['p50'])}s p95={fmt(p['p95'])}s")
+    print(f"   tokens: {summary['tokens']['prompt']} prompt / {summary['tokens']['completion']} completion")
+    print(f"   cassette ({cassette.mode}): {cassette.hits} replayed, {cassette.misses} missing, {len(cassette.entries)} stored")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Evaluate retrieval + generation on a question set")
+    parser.add_argument("questions", help="Curated JSONL ({\"question\", \"expected\": [...]}) or dataset_react.jsonl")
+    parser.add_argument("--mode", choices=["record", "replay", "live"], default="record")
+    parser.add_argument("--cassette", default=CASSETTE_PATH)
+    parser.add_argument("--output", default="rag_eval_report.json")
+    parser.add_argument("--model", default="gpt-oss-120b")
+    parser.add_argument("--topk", type=int, default=5)
+    parser.add_argument("--filter", dest="filters", default=None)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--tsc", action="store_true", help="Type-check generated code blocks with tsc")
+    args = parser.parse_args()
+
+    cassette = Cassette(args.cassette, args.mode)
+    install_cassette(cassette)
+    items = load_eval_set(args.questions, args.limit)
+    results, elapsed = await run_eval(items, args.topk, args.model, args.filters, args.concurrency)
+    if args.tsc:
+        type_check(results)
+    summary = summarize(results, elapsed)
+    summary.update(mode=args.mode, model=args.model, topk=args.topk, filters=args.filters)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"summary": summary, "results": results}, f, ensure_ascii=False, indent=2)
+    print_summary(summary, cassette)
+    print(f"✅ Report written to {args.output}")
+    if args.mode == "replay" and cassette.misses:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -8,10 +8,8 @@ from tqdm import tqdm
 # Thư mục chứa các file TSX component
 directory = 'test_cases'
 
-results = []
-
 # Hàm trợ giúp để tìm npx command phù hợp
-def find_working_npx_command():
+def find_working_npx_command(required=True):
     if platform.system() == 'Windows':
         # Trên Windows, thử lần lượt các biến thể của npx
         commands = ['npx.cmd', 'npx', 'npx.exe']
@@ -33,20 +31,14 @@ def find_working_npx_command():
     # Nếu không tìm thấy command nào hoạt động
     print("KHÔNG TÌM THẤY LỆNH NPX HOẠT ĐỘNG!")
     print("Hãy đảm bảo Node.js được cài đặt đúng cách.")
-    sys.exit(1)
-
-# Tìm npx command phù hợp
-npx_command = find_working_npx_command()
-
-# Duyệt qua các file .tsx với tqdm
-tsx_files = [f for f in os.listdir(directory) if f.endswith('.tsx')]
+    if required:
+        sys.exit(1)
+    return None
 
-# Kiểm tra trước xem có tsconfig.json không
-tsconfig_path = os.path.join(directory, 'tsconfig.json')
-use_tsconfig = os.path.exists(tsconfig_path)
-
-for filename in tqdm(tsx_files, desc="Đang kiểm tra TSX", unit="file"):
-    filepath = os.path.join(directory, filename)
+def check_tsx_file(npx_command, filepath, tsconfig_path=None):
+    """Type-check one TSX file with tsc; returns {'file', 'passed', 'errors'} (also used by evaluate_rag.py)."""
+    filename = os.path.basename(filepath)
+    use_tsconfig = tsconfig_path is not None
     # Chạy TypeScript compiler với tsconfig nếu có, hoặc thêm các cờ cần thiết
     try:
         if use_tsconfig:
@@ -84,35 +76,54 @@ for filename in tqdm(tsx_files, desc="Đang kiểm tra TSX", unit="file"):
             if errors_for_file:
                 error_output = '\n'.join(errors_for_file)
         
-        results.append({
+        return {
             'file': filename,
             'passed': passed,
             'errors': error_output.strip() if not passed else ''
-        })
+        }
     except Exception as e:
         # Xử lý nếu có lỗi khi chạy command
         print(f"Lỗi khi kiểm tra file {filename}: {str(e)}")
-        results.append({
+        return {
             'file': filename, 
             'passed': False,
             'errors': f"Lỗi hệ thống: {str(e)}"
-        })
+        }
+
+def main():
+    # Tìm npx command phù hợp
+    npx_command = find_working_npx_command()
+
+    # Duyệt qua các file .tsx với tqdm
+    tsx_files = [f for f in os.listdir(directory) if f.endswith('.tsx')]
+
+    # Kiểm tra trước xem có tsconfig.json không
+    tsconfig_path = os.path.join(directory, 'tsconfig.json')
+    if not os.path.exists(tsconfig_path):
+        tsconfig_path = None
+
+    results = []
+    for filename in tqdm(tsx_files, desc="Đang kiểm tra TSX", unit="file"):
+        results.append(check_tsx_file(npx_command, os.path.join(directory, filename), tsconfig_path))
+
+    # Tính tổng và pass rate
+    total = len(results)
+    passed_count = sum(1 for r in results if r['passed'])
+    pass_rate = passed_count / total * 100 if total > 0 else 0
 
-# Tính tổng và pass rate
-total = len(results)
-passed_count = sum(1 for r in results if r['passed'])
-pass_rate = passed_count / total * 100 if total > 0 else 0
+    # Ghi kết quả ra file JSON
+    output_file = 'syntax_check_results.json'
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'total': total,
+            'passed': passed_count,
+            'pass_rate_percent': pass_rate,
+            'details': results
+        }, f, ensure_ascii=False, indent=2)
 
-# Ghi kết quả ra file JSON
-output_file = 'syntax_check_results.json'
-with open(output_file, 'w', encoding='utf-8') as f:
-    json.dump({
-        'total': total,
-        'passed': passed_count,
-        'pass_rate_percent': pass_rate,
-        'details': results
-    }, f, ensure_ascii=False, indent=2)
+    # In tóm tắt lên console
+    print(f"Đã kiểm tra {total} file.\nPass: {passed_count}/{total} ({pass_rate:.2f}%).")
+    print(f"Chi tiết kết quả được lưu ở {output_file}.")
 
-# In tóm tắt lên console
-print(f"Đã kiểm tra {total} file.\nPass: {passed_count}/{total} ({pass_rate:.2f}%).")
-print(f"Chi tiết kết quả được lưu ở {output_file}.")
+if __name__ == "__main__":
+    main()
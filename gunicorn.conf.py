@@ -0,0 +1,38 @@
+import os
+import gc
+import multiprocessing
+
+# Multi-worker serving: a gunicorn master forking uvicorn workers.
+#   gunicorn app:app -c gunicorn.conf.py
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# The app splits its admission limits across the workers (see app.py)
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# Import the app in the master so read-only state is shared copy-on-write by
+# every worker. Network clients are rebuilt in each child (see
+# chatbot._reset_after_fork) and connected by the app lifespan.
+preload_app = True
+
+# Keep the preloaded objects on shared pages: no collections in the master
+# while the app and index load (no freed holes between them), then freeze
+# everything so the workers' collector never writes to those objects.
+# Refcount updates of records a worker actually reads still copy their pages.
+gc.disable()
+
+
+def when_ready(server):
+    """Load the local index once in the master, before any worker is forked."""
+    import chatbot
+    if chatbot.RETRIEVAL_BACKEND == "local":
+        index = chatbot.get_local_index()
+        server.log.info(f"Local index loaded before fork: {index.size} records")
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
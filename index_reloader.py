@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import fcntl
+import asyncio
+import weakref
+
+import local_index
+from local_index import LOCAL_INDEX_PATH, current_generation, load_current
+
+# Background hot-swap of the in-process LocalIndex. Every interval the
+# reloader checks (with a stat-cheap read) whether `<path>.current` points at
+# a new snapshot generation and, if so, maps it and builds its bitmaps in a
+# worker thread, then swaps the reference in one assignment. Searches that
+# already hold the old index finish on it; the old generation is freed when
+# the last of them drops it.
+#
+# With source="mongo" the reloader also follows the corpus version upsert.py
+# writes to `meta`: when it is newer than the loaded index, one process
+# (file lock) runs `local_index.py` as a child process to rebuild and
+# publish the snapshot, so the serving worker never holds the collection,
+# and every process, including the builder, maps it as above.
+INDEX_RELOAD_INTERVAL_S = float(os.getenv("INDEX_RELOAD_INTERVAL_S", "30"))
+INDEX_RELOAD_SOURCE = os.getenv("INDEX_RELOAD_SOURCE", "snapshot")  # "snapshot" | "mongo"
+
+
+class IndexReloader:
+    """
+    `get_index()` / `swap(index, generation)` read and replace the served
+    index; `fetch_version()` (async, mongo source only) returns the corpus
+    version and `build_args` are the extra `local_index.py` arguments
+    (--collection, --database) of the snapshot build.
+    """
+
+    def __init__(self, get_index, swap, path=LOCAL_INDEX_PATH, interval=INDEX_RELOAD_INTERVAL_S,
+                 source=INDEX_RELOAD_SOURCE, fetch_version=None, build_args=(), generation=None):
+        if source not in ("snapshot", "mongo"):
+            raise ValueError("source must be 'snapshot' or 'mongo'")
+        if source == "mongo" and fetch_version is None:
+            raise ValueError("source='mongo' needs fetch_version")
+        self.get_index = get_index
+        self.swap = swap
+        self.path = path
+        self.interval = interval
+        self.source = source
+        self.fetch_version = fetch_version
+        self.build_args = list(build_args)
+        # Generation of the index being served (as loaded by the caller)
+        self.generation = generation if generation is not None else current_generation(path)
+        self._retired = weakref.WeakSet()
+        self.metrics = {"checks": 0, "swaps": 0, "builds": 0, "errors": 0,
+                        "last_load_s": None, "last_build_s": None, "last_swap_at": None}
+
+    async def run(self):
+        """Reload loop; runs until cancelled."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check_once()
+            except Exception as e:
+                self.metrics["errors"] += 1
+                print(f"⚠️ Index reload failed: {e}")
+
+    async def check_once(self):
+        """Swap in a newer generation if there is one (building it first for the mongo source)."""
+        self.metrics["checks"] += 1
+        if self.source == "mongo":
+            version = await self.fetch_version()
+            current = self.get_index().version if self.get_index() is not None else None
+            if version is not None and (current is None or version > current):
+                await self._build(version)
+        generation = current_generation(self.path)
+        if generation is None or generation == self.generation:
+            return False
+        started = time.perf_counter()
+        # mmap + bitmap build happen off the event loop
+        loaded_generation, index = await asyncio.to_thread(load_current, self.path, True)
+        self.metrics["last_load_s"] = time.perf_counter() - started
+        self._swap_in(loaded_generation, index)
+        return True
+
+    def _swap_in(self, generation, index):
+        old = self.swap(index, generation)
+        self.generation = generation
+        if old is not None:
+            self._retired.add(old)
+        self.metrics["swaps"] += 1
+        self.metrics["last_swap_at"] = time.time()
+        print(f"🔄 Local index swapped to generation {generation}: {index.size} records, version {index.version}")
+
+    async def _build(self, version):
+        lock = open(f"{self.path}.lock", "w")
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # another worker is building it; it shows up as a new generation
+            if self._published_version() >= version:
+                return
+            started = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, local_index.__file__, "--output", self.path, *self.build_args)
+            try:
+                code = await process.wait()
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+            if code != 0:
+                raise RuntimeError(f"Snapshot build exited with status {code}")
+            self.metrics["builds"] += 1
+            self.metrics["last_build_s"] = time.perf_counter() - started
+        finally:
+            lock.close()
+
+    def _published_version(self):
+        generation = current_generation(self.path)
+        if generation is None or "-v" not in generation:
+            return -1
+        version = generation.rsplit("-v", 1)[1]
+        return int(version) if version.isdigit() else -1
+
+    def stats(self):
+        index = self.get_index()
+        return dict(self.metrics, source=self.source, interval_s=self.interval, generation=self.generation,
+                    version=index.version if index is not None else None,
+                    size=index.size if index is not None else None,
+                    # Retired generations still referenced by in-flight searches
+                    retired_alive=len(self._retired))
@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import glob
+import hashlib
+import argparse
+from itertools import islice
+
+from extract_first_record import split_content
+from code_features import classify
+
+# Streaming ingestion of the Hugging Face `cfahlgren1/react-code-instructions`
+# dataset (see dataset.py) from local Parquet or JSONL files. Rows are read
+# in batches, each code block of the assistant answer becomes a normalized
+# record (type "react_instruction"), and records are embedded and upserted
+# in bounded batches, so memory stays flat however large the dataset is.
+DATASET_TYPE = "react_instruction"
+DATASET_LINK = "https://huggingface.co/datasets/cfahlgren1/react-code-instructions"
+EXPLANATION_CHARS = 1000
+EMBED_TEXT_CHARS = 8000
+PARQUET_BATCH_ROWS = 512
+EMBED_RETRIES = 3
+
+try:
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+def iter_rows(paths):
+    """Dataset rows (dicts), one at a time, from .parquet and .jsonl files."""
+    for path in paths:
+        if path.endswith(".parquet"):
+            if not HAS_PYARROW:
+                raise RuntimeError("Reading Parquet needs pyarrow (pip install pyarrow)")
+            parquet = pq.ParquetFile(path)
+            for batch in parquet.iter_batches(batch_size=PARQUET_BATCH_ROWS):
+                yield from batch.to_pylist()
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
+
+def _messages(row):
+    messages = row.get("messages")
+    if isinstance(messages, str):
+        try:
+            messages = json.loads(messages)
+        except json.JSONDecodeError:
+            return []
+    return messages if isinstance(messages, list) else []
+
+
+def row_to_records(row):
+    """Normalized records of one conversation: one per code block of the assistant answer."""
+    messages = _messages(row)
+    prompt = next((m.get("content") or "" for m in messages if m.get("role") == "user"), "")
+    answer = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "assistant"), "")
+    if not isinstance(answer, str) or not answer:
+        return []
+    text, code_blocks = split_content(answer)
+    explanation = "\n".join(part for part in (prompt.strip(), text) if part)[:EXPLANATION_CHARS]
+    records = []
+    for code in (c.strip() for c in code_blocks):
+        if not code:
+            continue
+        features = classify(code)
+        records.append({
+            # Rows often share a prompt: the id covers the code too, so their answers don't overwrite each other
+            "crawl_id": hashlib.md5(f"{prompt}|{code}".encode("utf-8")).hexdigest(),
+            "type": DATASET_TYPE,
+            "explanation": explanation,
+            "code": code,
+            "tags": features["tags"],
+            "link": DATASET_LINK,
+            "code_language": features["code_language"],
+        })
+    return records
+
+
+def iter_records(paths, limit=None):
+    records = (record for row in iter_rows(paths) for record in row_to_records(row))
+    return islice(records, limit) if limit else records
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def embed_batch(provider, texts):
+    """provider.embed with retries and exponential backoff (rate limits / transient errors)."""
+    for attempt in range(EMBED_RETRIES):
+        try:
+            return provider.embed(texts).tolist()
+        except Exception as e:
+            if attempt == EMBED_RETRIES - 1:
+                raise
+            wait = 2 ** attempt
+            print(f"⚠️ Embedding batch failed ({e}), retrying in {wait}s")
+            time.sleep(wait)
+
+
+class Progress:
+    """Records/s and batch latency, printed every `every` seconds."""
+
+    def __init__(self, every=5.0):
+        self.every = every
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.counts = {"records": 0, "written": 0, "failed": 0, "batches": 0}
+
+    def update(self, **counts):
+        for key, value in counts.items():
+            self.counts[key] += value
+        now = time.perf_counter()
+        if now - self.last >= self.every:
+            self.last = now
+            self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.counts["records"] / elapsed if elapsed else 0.0
+        print(f"📦 {self.counts['records']} records, {self.counts['written']} written, "
+              f"{self.counts['failed']} failed, {self.counts['batches']} batches, "
+              f"{rate:,.0f} records/s, {elapsed:.0f}s")
+
+
+def ingest(paths, batch_size=100, limit=None, provider=None, collection=None, layout=None,
+           chunk=False, output=None):
+    """
+    Stream the dataset into MongoDB (or, with `output`, into a normalized JSONL
+    file without embedding). Returns the progress counters.
+    """
+    from upsert import build_embed_text, build_chunk_records, ensure_vector_index, bump_corpus_version, read_env_key
+    from embedding_providers import get_provider
+    from query import CHUNK_COLLECTION
+
+    records = iter_records(paths, limit)
+    if chunk:
+        records = (c for record in records for c in build_chunk_records(record))
+    progress = Progress()
+
+    if output:
+        with open(output, "w", encoding="utf-8") as out:
+            for batch in batched(records, batch_size):
+                for record in batch:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                progress.update(records=len(batch), written=len(batch), batches=1)
+        progress.report()
+        return progress.counts
+
+    from pymongo import MongoClient, UpdateOne, DeleteMany
+    from pymongo.errors import BulkWriteError
+    provider = provider or get_provider()
+    layout = layout if layout is not None and layout.enabled else None
+    if layout and DATASET_TYPE not in layout.partitions:
+        raise ValueError(f"Type '{DATASET_TYPE}' has no shard; add it to SHARDS")
+    base = collection or ((CHUNK_COLLECTION if chunk else "normalized") + provider.collection_suffix)
+    names = [name for name, _ in layout.shards(base)] if layout else [base]
+
+    client = MongoClient(read_env_key("MONGODB_URI"))
+    db = client.get_default_database()
+    for name in names:
+        db[name].create_index("crawl_id", unique=True)
+        if chunk:
+            db[name].create_index("parent_id")
+        ensure_vector_index(db[name])
+
+    try:
+        for batch in batched(records, batch_size):
+            started = time.perf_counter()
+            try:
+                vectors = embed_batch(provider, [build_embed_text(r)[:EMBED_TEXT_CHARS] for r in batch])
+            except Exception as e:
+                # Never write zero vectors: the batch is skipped and reported
+                print(f"❌ Skipping batch of {len(batch)} records: {e}")
+                progress.update(records=len(batch), failed=len(batch), batches=1)
+                continue
+            operations = {}
+            for record, vector in zip(batch, vectors):
+                doc = dict(record, embedding=vector, embedding_provider=provider.tag)
+                target = layout.route(base, doc) if layout else base
+                ops = operations.setdefault(target, [])
+                ops.append(UpdateOne({"crawl_id": doc["crawl_id"]}, {"$set": doc}, upsert=True))
+                if chunk and doc["chunk_index"] == doc["chunk_count"] - 1:
+                    ops.append(DeleteMany({"parent_id": doc["parent_id"], "chunk_index": {"$gte": doc["chunk_count"]}}))
+            failed = 0
+            for name, ops in operations.items():
+                try:
+                    db[name].bulk_write(ops, ordered=False)
+                except BulkWriteError as e:
+                    # Unordered: the other operations were applied; report the failed ones and go on
+                    errors = e.details.get("writeErrors", [])
+                    failed += len(errors)
+                    detail = errors[0].get("errmsg") if errors else e
+                    print(f"❌ {len(errors)} write errors in batch {progress.counts['batches'] + 1} ({name}): {detail}")
+            failed = min(failed, len(batch))
+            progress.update(records=len(batch), written=len(batch) - failed, failed=failed, batches=1)
+            if progress.counts["batches"] == 1:
+                print(f"First batch: {len(batch)} records in {time.perf_counter() - started:.2f}s")
+        if progress.counts["written"]:
+            print(f"Corpus version: {bump_corpus_version(db)}")
+    finally:
+        client.close()
+    progress.report()
+    return progress.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream the react-code-instructions dataset into the corpus")
+    parser.add_argument("paths", nargs="*", help="Parquet / JSONL files (default: data/*.parquet, dataset_react.jsonl)")
+    parser.add_argument("--batch-size", type=int, default=100, help="Records per embedding call and bulk write")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many records")
+    parser.add_argument("--collection", default=None, help="Target collection (default: normalized + provider suffix)")
+    parser.add_argument("--provider", choices=["gemini", "local"], default=None)
+    parser.add_argument("--shards", default=None, help='Shard layout, e.g. "react_example,stackoverflow:4,react_instruction:2"')
+    parser.add_argument("--chunk", action="store_true", help="Split code into chunks (normalized_chunks)")
+    parser.add_argument("--output", default=None, help="Write normalized JSONL here instead of embedding/upserting")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob("data/*.parquet")) or ["dataset_react.jsonl"]
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        parser.error(f"File not found: {', '.join(missing)}")
+    print(f"Ingesting {len(paths)} files: {paths}")
+
+    provider = layout = None
+    if not args.output:
+        from upsert import read_env_key
+        from embedding_providers import get_provider
+        from sharding import ShardLayout
+        provider = get_provider(args.provider)
+        if provider.name == "gemini":
+            import google.generativeai as genai
+            genai.configure(api_key=read_env_key("GEMINI_API_KEY"))
+        layout = ShardLayout.from_spec(args.shards) if args.shards is not None else ShardLayout.from_spec()
+    ingest(paths, args.batch_size, args.limit, provider, args.collection, layout, args.chunk, args.output)
+
+
+if __name__ == "__main__":
+    main()
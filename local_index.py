@@ -0,0 +1,289 @@
+import os
+import glob
+import json
+import time
+import argparse
+import numpy as np
+from search_filters import FILTER_FIELDS, parse_filters
+
+# In-process retrieval backend: a snapshot of the `normalized` collection
+# (embeddings + metadata) searched with NumPy instead of Atlas.
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "corpus_snapshot")
+META_FIELDS = ("crawl_id", "type", "explanation", "code", "link", "tags", "code_language",
+               "parent_id", "start_line", "end_line", "embedding_provider")
+# Above this fraction of the corpus, a filter is applied as a mask over a full
+# scan: gathering the candidate rows would copy most of the matrix first.
+FULL_SCAN_SELECTIVITY = float(os.getenv("LOCAL_INDEX_FULL_SCAN_SELECTIVITY", "0.3"))
+
+
+def _field_values(record, field):
+    value = record.get(field)
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return value
+    return [value]
+
+
+class LocalIndex:
+    """Brute-force cosine index with packed bitmap indexes over metadata."""
+
+    def __init__(self, embeddings, records, version=None):
+        self.embeddings = embeddings
+        self.records = records
+        self.version = version
+        self.size = len(records)
+        self.bitmaps = self._build_bitmaps()
+
+    def _build_bitmaps(self):
+        """Precompute one packed bitmap per (field, value) pair."""
+        positions = {field: {} for field in FILTER_FIELDS}
+        for row, record in enumerate(self.records):
+            for field in FILTER_FIELDS:
+                for value in _field_values(record, field):
+                    positions[field].setdefault(value, []).append(row)
+        bitmaps = {}
+        for field, values in positions.items():
+            bitmaps[field] = {}
+            for value, rows in values.items():
+                bits = np.zeros(self.size, dtype=bool)
+                bits[rows] = True
+                bitmaps[field][value] = np.packbits(bits)
+        return bitmaps
+
+    def candidates(self, filters):
+        """Row ids matching the filters, or None when nothing is filtered."""
+        if not filters:
+            return None
+        empty = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        combined = None
+        for field, values in filters.items():
+            field_bits = empty
+            for value in values:
+                field_bits = field_bits | self.bitmaps.get(field, {}).get(value, empty)
+            combined = field_bits if combined is None else combined & field_bits
+        return np.flatnonzero(np.unpackbits(combined, count=self.size))
+
+    def _scores(self, queries, rows):
+        """
+        Scores of the candidate rows against `queries` (a vector or a
+        (dim, n) matrix) and the row id behind each score, or None when
+        scores are indexed by row id already.
+        """
+        if rows is None:
+            return self.embeddings @ queries, None
+        if len(rows) > FULL_SCAN_SELECTIVITY * self.size:
+            scores = self.embeddings @ queries
+            excluded = np.ones(self.size, dtype=bool)
+            excluded[rows] = False
+            scores[excluded] = -np.inf
+            return scores, None
+        # Narrow filter: only the candidate rows are scored.
+        return self.embeddings[rows] @ queries, rows
+
+    def search(self, query_embedding, k=5, filters=None):
+        """Top-k records by cosine similarity, scored like Atlas vectorSearchScore."""
+        filters = parse_filters(filters)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        rows = self.candidates(filters)
+        if rows is not None and len(rows) == 0:
+            return []
+        k = min(k, self.size if rows is None else len(rows))
+        if k <= 0:
+            return []
+        scores, rows = self._scores(query, rows)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for i in top:
+            row = int(i) if rows is None else int(rows[i])
+            doc = dict(self.records[row])
+            # Atlas cosine score is normalized to [0, 1].
+            doc["score"] = float((1.0 + scores[i]) / 2.0)
+            results.append(doc)
+        return results
+
+    def search_many(self, query_embeddings, k=5, filters=None):
+        """Top-k for a batch of queries, scored with a single matrix product."""
+        filters = parse_filters(filters)
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        rows = self.candidates(filters)
+        if rows is not None and len(rows) == 0:
+            return [[] for _ in range(len(queries))]
+        k = min(k, self.size if rows is None else len(rows))
+        if k <= 0:
+            return [[] for _ in range(len(queries))]
+        scores, rows = self._scores(queries.T, rows)  # (candidates, queries)
+        top = np.argpartition(-scores, k - 1, axis=0)[:k]
+        results = []
+        for j in range(scores.shape[1]):
+            column = top[:, j]
+            column = column[np.argsort(-scores[column, j])]
+            docs = []
+            for i in column:
+                row = int(i) if rows is None else int(rows[i])
+                doc = dict(self.records[row])
+                doc["score"] = float((1.0 + scores[i, j]) / 2.0)
+                docs.append(doc)
+            results.append(docs)
+        return results
+
+    def save(self, path=LOCAL_INDEX_PATH):
+        np.save(f"{path}.npy", np.ascontiguousarray(self.embeddings, dtype=np.float32))
+        with open(f"{path}.json", "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "records": self.records}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path=LOCAL_INDEX_PATH, mmap=False):
+        """Load a snapshot; with mmap=True the embedding matrix stays in the shared page cache."""
+        embeddings = np.load(f"{path}.npy", mmap_mode="r" if mmap else None)
+        with open(f"{path}.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(embeddings, meta["records"], meta.get("version"))
+
+    @classmethod
+    def from_documents(cls, docs, version=None, size_hint=0):
+        """Build an index from documents carrying an `embedding` field (e.g. a streamed cursor)."""
+        builder = IndexBuilder(size_hint)
+        for doc in docs:
+            builder.add(doc)
+        return builder.build(version)
+
+
+class IndexBuilder:
+    """
+    Collects documents one at a time straight into a float32 matrix,
+    preallocated for `size_hint` rows and doubled when that runs out, so a
+    large collection is never held as Python lists of floats.
+    """
+
+    def __init__(self, size_hint=0):
+        self.size_hint = max(0, int(size_hint or 0))
+        self.embeddings = None
+        self.records = []
+
+    def add(self, doc):
+        embedding = doc.get("embedding")
+        if not embedding:
+            return
+        row = len(self.records)
+        if self.embeddings is None:
+            self.embeddings = np.empty((max(self.size_hint, 1), len(embedding)), dtype=np.float32)
+        elif row == self.embeddings.shape[0]:
+            grown = np.empty((row * 2, self.embeddings.shape[1]), dtype=np.float32)
+            grown[:row] = self.embeddings
+            self.embeddings = grown
+        self.embeddings[row] = embedding
+        self.records.append({field: doc.get(field) for field in META_FIELDS if field in doc})
+
+    def build(self, version=None):
+        if self.embeddings is None:
+            return LocalIndex(np.empty((0, 0), dtype=np.float32), [], version)
+        embeddings = self.embeddings
+        if embeddings.shape[0] != len(self.records):
+            embeddings = embeddings[:len(self.records)].copy()  # drop the unused tail of the preallocation
+        return LocalIndex(embeddings, self.records, version)
+
+
+# Snapshot generations: every publish writes new `<path>.<generation>.npy/.json`
+# files and then atomically repoints `<path>.current` at them, so a reader
+# never sees a half-written snapshot and files mapped by a running process
+# are never modified in place (old ones are unlinked, which keeps existing
+# mappings valid until they are dropped). Records are stored one per line
+# (.jsonl) so a background load can parse them in slices: a single json.load
+# of a large snapshot would hold the GIL, and stall the event loop, throughout.
+SNAPSHOT_KEEP = 3
+LOAD_SLICE_RECORDS = 1000
+
+
+def save_generation(index, prefix):
+    np.save(f"{prefix}.npy", np.ascontiguousarray(index.embeddings, dtype=np.float32))
+    with open(f"{prefix}.jsonl", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"version": index.version, "size": index.size}) + "\n")
+        for record in index.records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def load_generation(prefix, mmap=False):
+    embeddings = np.load(f"{prefix}.npy", mmap_mode="r" if mmap else None)
+    records = []
+    with open(f"{prefix}.jsonl", "r", encoding="utf-8") as f:
+        meta = json.loads(f.readline())
+        for line in f:
+            records.append(json.loads(line))
+            if len(records) % LOAD_SLICE_RECORDS == 0:
+                time.sleep(0)  # release the GIL between slices
+    if len(records) != embeddings.shape[0] or len(records) != meta["size"]:
+        raise ValueError(f"Snapshot {prefix} is inconsistent: {len(records)} records, {embeddings.shape[0]} embeddings")
+    return LocalIndex(embeddings, records, meta["version"])
+
+
+def current_generation(path=LOCAL_INDEX_PATH):
+    """Generation `<path>.current` points at, or None (legacy single snapshot)."""
+    try:
+        with open(f"{path}.current", "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_current(path=LOCAL_INDEX_PATH, mmap=False):
+    """(generation, index) of the current snapshot; falls back to the legacy `<path>.npy/.json`."""
+    generation = current_generation(path)
+    if generation is None:
+        return None, LocalIndex.load(path, mmap=mmap)
+    return generation, load_generation(f"{path}.{generation}", mmap=mmap)
+
+
+def publish_snapshot(index, path=LOCAL_INDEX_PATH, keep=SNAPSHOT_KEEP):
+    """Write `index` as a new generation, make it current, and prune the oldest generations."""
+    generation = f"{int(time.time() * 1000)}-v{index.version}"
+    save_generation(index, f"{path}.{generation}")
+    tmp = f"{path}.current.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(generation)
+    os.replace(tmp, f"{path}.current")
+    generations = sorted(os.path.basename(p)[len(os.path.basename(path)) + 1:-len(".jsonl")]
+                         for p in glob.glob(f"{glob.escape(path)}.*-v*.jsonl"))
+    for old in generations[:max(0, len(generations) - keep)]:
+        if old == generation:
+            continue
+        for suffix in (".npy", ".jsonl"):
+            try:
+                os.remove(f"{path}.{old}{suffix}")
+            except FileNotFoundError:
+                pass
+    return generation
+
+
+def build_snapshot(collection, path=LOCAL_INDEX_PATH, version=None):
+    """Dump a Mongo collection into a new local index snapshot generation."""
+    projection = {field: 1 for field in META_FIELDS}
+    projection.update({"_id": 0, "embedding": 1})
+    index = LocalIndex.from_documents(collection.find({}, projection), version,
+                                      size_hint=collection.estimated_document_count())
+    publish_snapshot(index, path)
+    return index
+
+
+def main():
+    from pymongo import MongoClient
+    from query import get_secret
+
+    parser = argparse.ArgumentParser(description="Build a local retrieval snapshot from MongoDB")
+    parser.add_argument('--collection', default='normalized')
+    parser.add_argument('--database', default=None, help='Database (default: the one in MONGODB_URI)')
+    parser.add_argument('--output', default=LOCAL_INDEX_PATH, help='Snapshot path prefix (.npy/.json)')
+    args = parser.parse_args()
+
+    client = MongoClient(get_secret("MONGODB_URI"))
+    db = client[args.database] if args.database else client.get_default_database()
+    # Tag the snapshot with the corpus version upsert.py bumps, so servers can tell it is newer
+    meta = db["meta"].find_one({"_id": "corpus"})
+    index = build_snapshot(db[args.collection], args.output, meta.get("version") if meta else None)
+    client.close()
+    print(f"✅ Saved {index.size} records (version {index.version}) as {args.output}.{current_generation(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import time
+import asyncio
+from collections import deque
+
+# Models offered in the UI (streamlit_interface.py), in default preference order.
+MODELS = ["gpt-oss-120b", "llama-3.3-70b", "qwen-3-235b-a22b-instruct-2507"]
+
+
+class ModelStats:
+    """Latency / error EWMAs and a window of recent latencies for one model."""
+
+    def __init__(self, alpha=0.2, window=200):
+        self.alpha = alpha
+        self.latency_ewma = None
+        self.error_ewma = 0.0
+        self.samples = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.cancelled = 0
+
+    def record_cancelled(self):
+        """A request cut short (lost a hedge race): no latency or error sample."""
+        self.cancelled += 1
+
+    def record(self, latency, ok=True):
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.error_ewma += self.alpha * ((0.0 if ok else 1.0) - self.error_ewma)
+        # Fast failures would drag the latency estimate down; only successes count.
+        if ok and latency is not None:
+            self.samples.append(latency)
+            if self.latency_ewma is None:
+                self.latency_ewma = latency
+            else:
+                self.latency_ewma += self.alpha * (latency - self.latency_ewma)
+
+    def p95(self):
+        if len(self.samples) < 10:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def cost(self, default_latency):
+        """Routing cost: expected latency inflated by the recent error rate."""
+        latency = self.latency_ewma if self.latency_ewma is not None else default_latency
+        return latency * (1.0 + 4.0 * self.error_ewma)
+
+    def snapshot(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_ewma_s": self.latency_ewma,
+            "error_ewma": self.error_ewma,
+            "p95_s": self.p95(),
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "cancelled": self.cancelled,
+        }
+
+
+class ModelRouter:
+    """
+    Route completions across models with failover and optional hedging.
+
+    `call(model, messages)` is an async function that returns the upstream
+    response or raises; it is injected so the router can be exercised with
+    stub endpoints. The requested model goes first unless it is currently
+    failing; once it runs past its p95-based deadline a hedged request goes
+    to the next best model, the first success wins and the loser is
+    cancelled. Errors fail over to the next model.
+    """
+
+    def __init__(self, call, models=MODELS, hedge=True, hedge_min_delay=2.0,
+                 default_deadline=10.0, unhealthy_error_rate=0.5, max_attempts=3):
+        self.call = call
+        self.models = list(models)
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.default_deadline = default_deadline
+        self.unhealthy_error_rate = unhealthy_error_rate
+        self.max_attempts = max_attempts
+        self.stats = {}
+
+    def _stats(self, model):
+        if model not in self.stats:
+            self.stats[model] = ModelStats()
+        return self.stats[model]
+
+    def candidates(self, model=None):
+        """Models to try, in order: the requested one (if healthy), then the cheapest others."""
+        others = sorted(
+            (m for m in self.models if m != model),
+            key=lambda m: self._stats(m).cost(self.default_deadline),
+        )
+        if model is None:
+            return others[:self.max_attempts]
+        if self._stats(model).error_ewma >= self.unhealthy_error_rate and others:
+            return ([others[0], model] + others[1:])[:self.max_attempts]
+        return ([model] + others)[:self.max_attempts]
+
+    def record(self, model, latency, ok=True):
+        """Record an outcome observed outside complete() (e.g. a streamed answer)."""
+        self._stats(model).record(latency, ok)
+
+    def hedge_deadline(self, model):
+        p95 = self._stats(model).p95()
+        return max(self.hedge_min_delay, p95 if p95 is not None else self.default_deadline)
+
+    async def _attempt(self, model, messages):
+        started = time.perf_counter()
+        try:
+            result = await self.call(model, messages)
+        except asyncio.CancelledError:
+            # Lost a hedge race: the elapsed time is only a lower bound of the
+            # latency, recording it as a sample would bias the estimate.
+            self._stats(model).record_cancelled()
+            raise
+        except Exception:
+            self._stats(model).record(time.perf_counter() - started, ok=False)
+            raise
+        self._stats(model).record(time.perf_counter() - started, ok=True)
+        return result
+
+    async def complete(self, messages, model=None):
+        """Return (result, model_used). Raises the last error if every candidate fails."""
+        queue = self.candidates(model)
+        running = {}
+        hedged = False
+        last_error = None
+
+        def launch():
+            next_model = queue.pop(0)
+            task = asyncio.ensure_future(self._attempt(next_model, messages))
+            running[task] = next_model
+            return next_model
+
+        primary = launch()
+        try:
+            while running:
+                timeout = None
+                if self.hedge and not hedged and queue:
+                    timeout = self.hedge_deadline(primary)
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    self._stats(primary).hedges += 1
+                    launch()
+                    continue
+                for task in done:
+                    used = running.pop(task)
+                    if task.exception() is None:
+                        if hedged and used != primary:
+                            self._stats(used).hedge_wins += 1
+                        return task.result(), used
+                    last_error = task.exception()
+                    print(f"⚠️ Model {used} failed: {last_error}")
+                if queue and not running:
+                    primary = launch()
+        finally:
+            for task in running:
+                task.cancel()
+        raise last_error or RuntimeError("No model available")
+
+    def snapshot(self):
+        return {model: stats.snapshot() for model, stats in self.stats.items()}
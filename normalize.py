@@ -19,6 +19,9 @@ def detect_type(item):
     return None
 
 def normalize_item(item):
+    # Tombstone của crawler (block đã bị xóa khỏi nguồn): upsert.py xóa record
+    if isinstance(item, dict) and item.get("deleted") and item.get("crawl_id"):
+        return {"crawl_id": item["crawl_id"], "deleted": True}
 
     def make_unique_crawl_id(item):
         # Ưu tiên sử dụng crawl_id gốc nếu có và là dạng UUID hoặc MD5 (32 ký tự hex)
@@ -61,11 +64,13 @@ def normalize_item(item):
             "code_language": item.get("code_language", None),
         }
     if t == "stackoverflow":
-        # Lấy code đầu tiên trong code_blocks nếu có
+        # Ưu tiên code của câu trả lời (accepted / điểm cao nhất) nếu đã sync,
+        # nếu không lấy code đầu tiên trong code_blocks của câu hỏi
         code = None
         code_language = None
-        if isinstance(item.get("code_blocks"), list) and len(item["code_blocks"]) > 0:
-            first = item["code_blocks"][0]
+        blocks = (item.get("answer") or {}).get("code_blocks") or item.get("code_blocks")
+        if isinstance(blocks, list) and len(blocks) > 0:
+            first = blocks[0]
             code = first.get("code", None)
             code_language = first.get("code_language", None)
             
@@ -98,7 +103,11 @@ def normalize_files(input_files, output_file):
             continue
         with open(path, "r", encoding="utf-8") as f:
             try:
-                data = json.load(f)
+                if path.endswith(".jsonl"):
+                    # JSONL store (append-only, crawl_react_stackov.py --sync)
+                    data = [json.loads(line) for line in f if line.strip()]
+                else:
+                    data = json.load(f)
             except Exception as e:
                 print(f"Lỗi đọc file {path}: {e}")
                 continue
@@ -118,15 +127,18 @@ def normalize_files(input_files, output_file):
 if __name__ == "__main__":
     # Parse command-line arguments for flexible input and output
     parser = argparse.ArgumentParser(description="Normalize and merge JSON crawl data.")
-    parser.add_argument('-i', '--input', nargs='*', help='List of input JSON files to process. Defaults to all .json files in directory.')
+    parser.add_argument('-i', '--input', nargs='*', help='List of input JSON/JSONL files to process. Defaults to all .json files (and the StackOverflow JSONL store) in directory.')
     parser.add_argument('-o', '--output', default='normalized.json', help='Output JSON file name')
     args = parser.parse_args()
     # Discover input files dynamically if not provided
     if args.input:
         input_files = args.input
     else:
-        # All JSON files except the output file and any normalized outputs
+        # All JSON files except the output file, any normalized outputs and
+        # incremental crawl deltas (already contained in the full crawl files)
         input_files = [f for f in glob.glob('*.json')
-                       if f != args.output and not f.startswith('normalized')]
+                       if f != args.output and not f.startswith('normalized')
+                       and not f.endswith('_changes.json')]
+        input_files += glob.glob('*stackoverflow_questions.jsonl')
     print(f"Found {len(input_files)} input files: {input_files}")
     normalize_files(input_files, args.output)
@@ -0,0 +1,114 @@
+import os
+import re
+import time
+import hmac
+import uuid
+import random
+import asyncio
+
+# Per-request profiling of the chat endpoint with pyinstrument (optional
+# dependency). A request is profiled when the caller sends the profiling
+# token (X-Profile-Token header or ?profile_token=...), or at random with
+# probability PROFILE_SAMPLE_RATE. The profile follows the request's own
+# async context, so time spent awaiting Gemini, Mongo or Cerebras is shown
+# under the awaiting frame and concurrent requests do not leak into it.
+# Profiles are written as speedscope JSON (https://www.speedscope.app).
+# With no token and a zero sample rate the middleware is not installed.
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+PROFILE_INTERVAL_S = float(os.getenv("PROFILE_INTERVAL_S", "0.001"))
+PROFILE_PATHS = ("/api/chat",)
+
+PROFILE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+    HAS_PYINSTRUMENT = True
+except ImportError:
+    HAS_PYINSTRUMENT = False
+
+
+class RequestProfiler:
+    """Opt-in (token) or sampled profiling of single requests, stored as speedscope files."""
+
+    def __init__(self, token=PROFILE_TOKEN, sample_rate=PROFILE_SAMPLE_RATE, directory=PROFILE_DIR,
+                 keep=PROFILE_KEEP, interval=PROFILE_INTERVAL_S, paths=PROFILE_PATHS):
+        self.token = token
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.keep = keep
+        self.interval = interval
+        self.paths = paths
+        self.metrics = {"profiled": 0, "requested": 0, "sampled": 0, "failed": 0}
+
+    @property
+    def enabled(self):
+        return HAS_PYINSTRUMENT and (bool(self.token) or self.sample_rate > 0)
+
+    def authorized(self, request):
+        supplied = request.headers.get("x-profile-token") or request.query_params.get("profile_token")
+        return bool(self.token and supplied) and hmac.compare_digest(supplied, self.token)
+
+    def _path(self, profile_id):
+        return os.path.join(self.directory, f"{profile_id}.speedscope.json")
+
+    def _store(self, profiler):
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = uuid.uuid4().hex
+        with open(self._path(profile_id), "w", encoding="utf-8") as f:
+            f.write(profiler.output(renderer=SpeedscopeRenderer()))
+        files = sorted((os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                        if name.endswith(".speedscope.json")), key=os.path.getmtime)
+        for path in files[:max(0, len(files) - self.keep)]:
+            os.remove(path)
+        return profile_id
+
+    def load(self, profile_id):
+        """Stored speedscope JSON of a profile, or None."""
+        if not PROFILE_ID_RE.match(profile_id or ""):
+            return None
+        try:
+            with open(self._path(profile_id), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    async def middleware(self, request, call_next):
+        """FastAPI http middleware: profile the request if asked for (or sampled)."""
+        if not request.url.path.startswith(self.paths):
+            return await call_next(request)
+        requested = self.authorized(request)
+        if not requested and not (self.sample_rate > 0 and random.random() < self.sample_rate):
+            return await call_next(request)
+
+        self.metrics["requested" if requested else "sampled"] += 1
+        profiler = Profiler(interval=self.interval, async_mode="enabled")
+        started, cpu_started = time.perf_counter(), time.process_time()
+        profiler.start()
+        try:
+            response = await call_next(request)
+        finally:
+            profiler.stop()
+        wall_s, cpu_s = time.perf_counter() - started, time.process_time() - cpu_started
+        try:
+            profile_id = await asyncio.to_thread(self._store, profiler)
+        except Exception as e:
+            self.metrics["failed"] += 1
+            print(f"⚠️ Could not store profile: {e}")
+            return response
+        self.metrics["profiled"] += 1
+        print(f"[PROFILE] {request.url.path} {profile_id}: {wall_s:.3f}s wall, {cpu_s:.3f}s CPU")
+        if requested:
+            # CPU is process time over the request (includes concurrent requests).
+            # Only callers holding the token learn where their profile is
+            response.headers["X-Profile-Id"] = profile_id
+            response.headers["X-Profile-Wall-s"] = f"{wall_s:.4f}"
+            response.headers["X-Profile-CPU-s"] = f"{cpu_s:.4f}"
+        return response
+
+    def stats(self):
+        return dict(self.metrics, enabled=self.enabled, sample_rate=self.sample_rate)
@@ -1,11 +1,11 @@
 import os
 import json
 import argparse
-import toml
 import numpy as np
-from pymongo import MongoClient
-import google.generativeai as genai
-import motor.motor_asyncio
+from embedding_transform import transform
+from search_filters import parse_filters, to_atlas_filter
+from local_index import LocalIndex
+from sharding import ShardedCorpus
 
 # Secret management
 def get_secret(key, env_file="key.env", toml_file="streamlit.toml"):
@@ -13,6 +13,7 @@ def get_secret(key, env_file="key.env", toml_file="streamlit.toml"):
     if key in os.environ:
         return os.environ[key]
     try:
+        import toml
         config = toml.load(toml_file)
         if key in config.get("secrets", {}):
             return config["secrets"][key]
@@ -28,62 +29,119 @@ def get_secret(key, env_file="key.env", toml_file="streamlit.toml"):
     return None
 
 # Embedding utilities
+def get_raw_embeddings(texts, model="models/embedding-001"):
+    """Generate raw (untransformed) embeddings for several texts in one Gemini request."""
+    import google.generativeai as genai
+    texts = list(texts)
+    response = genai.embed_content(model=model, content=texts)
+    embeddings = response.get('embedding') or response[0].get('embedding')
+    return np.asarray(embeddings, dtype=np.float32).reshape(len(texts), -1)
+
+def get_raw_embedding(text, model="models/embedding-001"):
+    """Generate the raw (untransformed) embedding using Gemini API."""
+    return get_raw_embeddings([text], model)[0]
+
+def get_embeddings(texts, model="models/embedding-001"):
+    """Batch version of get_embedding, returns a (len(texts), EMBEDDING_DIM) array."""
+    return transform(get_raw_embeddings(texts, model))
+
 def get_embedding(text, model="models/embedding-001"):
-    """Generate embeddings using Gemini API."""
-    response = genai.embed_content(model=model, content=[text])
-    embedding = response.get('embedding') or response[0].get('embedding')
-    if isinstance(embedding, list) and len(embedding) > 0 and isinstance(embedding[0], list):
-        embedding = embedding[0]
-    flat = [float(x) if isinstance(x, (int, float)) else 0.0 for x in embedding]
-    if len(flat) == 3072:
-        half = len(flat) // 2
-        flat = [(flat[i] + flat[i + half]) / 2 for i in range(half)]
-    return flat
-
-def resize_embedding(embedding, target_dim=1024):
-    """Resize embeddings to the target dimension."""
-    current_dim = len(embedding)
-    if current_dim == target_dim:
-        return embedding
-    return embedding + [0.0] * (target_dim - current_dim) if current_dim < target_dim else embedding[:target_dim]
+    """Generate an embedding in the shared index space (projected and normalized)."""
+    return transform(get_raw_embedding(text, model)).tolist()
 
 # Vector search
-async def find_top_k(query_embedding, collection, k=5):
-    """Find top-k documents using vector search asynchronously."""
+async def find_top_k(query_embedding, collection, k=5, filters=None):
+    """
+    Find top-k documents using vector search asynchronously.
+
+    `filters` restricts candidates by type/tags/code_language before scoring
+    (Atlas `filter` on indexed fields, bitmap indexes for a LocalIndex).
+    A ShardedCorpus fans the search out to its shards and merges the hits.
+    Search errors propagate, so callers (circuit breakers) can see them.
+    """
+    filters = parse_filters(filters)
+    if isinstance(collection, LocalIndex):
+        return collection.search(query_embedding, k=k, filters=filters)
+    if isinstance(collection, ShardedCorpus):
+        return await collection.search(query_embedding, k=k, filters=filters)
+
+    vector_search = {
+        "index": "vector_index",
+        "path": "embedding",
+        "queryVector": query_embedding,
+        "numCandidates": 100,
+        "limit": k
+    }
+    atlas_filter = to_atlas_filter(filters)
+    if atlas_filter:
+        vector_search["filter"] = atlas_filter
     pipeline = [
-        {
-            "$vectorSearch": {
-                "index": "vector_index",
-                "path": "embedding",
-                "queryVector": query_embedding,
-                "numCandidates": 100,
-                "limit": k
-            }
-        },
+        {"$vectorSearch": vector_search},
         {
             "$project": {
                 "_id": 0,
+                "crawl_id": 1,
                 "type": 1,
                 "explanation": 1,
                 "code": 1,
                 "link": 1,
+                "tags": 1,
+                "code_language": 1,
+                "parent_id": 1,
+                "start_line": 1,
+                "end_line": 1,
                 "score": {"$meta": "vectorSearchScore"}
             }
         }
     ]
-    try:
-        cursor = collection.aggregate(pipeline)
-        if hasattr(cursor, 'to_list'):
-            return await cursor.to_list(length=k)
-        return list(cursor)
-    except Exception as e:
-        print(f"❌ Search error: {e}")
-        return []
+    cursor = collection.aggregate(pipeline)
+    if hasattr(cursor, 'to_list'):
+        return await cursor.to_list(length=k)
+    return list(cursor)
+
+# Chunked corpus (upsert.py --chunk): one document per code chunk, with
+# `parent_id` pointing at the full record in `normalized`.
+CHUNK_COLLECTION = "normalized_chunks"
+
+def collapse_chunks(docs, k=5):
+    """Keep the best-scoring chunk of each parent record (docs arrive best first)."""
+    seen = set()
+    best = []
+    for doc in docs:
+        parent = doc.get("parent_id") or doc.get("crawl_id")
+        if parent in seen:
+            continue
+        seen.add(parent)
+        best.append(doc)
+        if len(best) == k:
+            break
+    return best
+
+async def fetch_parents(chunk_docs, parent_collection):
+    """Replace each chunk with its full parent record (keeping the chunk's score and line range)."""
+    ids = [doc["parent_id"] for doc in chunk_docs if doc.get("parent_id")]
+    projection = {"_id": 0, "crawl_id": 1, "type": 1, "explanation": 1, "code": 1,
+                  "link": 1, "tags": 1, "code_language": 1}
+    cursor = parent_collection.find({"crawl_id": {"$in": ids}}, projection)
+    parents = await cursor.to_list(length=len(ids)) if hasattr(cursor, "to_list") else list(cursor)
+    by_id = {p["crawl_id"]: p for p in parents}
+    docs = []
+    for doc in chunk_docs:
+        parent = by_id.get(doc.get("parent_id"))
+        if parent is None:
+            docs.append(doc)
+        else:
+            docs.append(dict(parent, score=doc.get("score"),
+                             matched_lines=[doc.get("start_line"), doc.get("end_line")]))
+    return docs
 
 async def main():
     """Main entry point for querying chatbot."""
+    from pymongo import MongoClient
+    import google.generativeai as genai
     parser = argparse.ArgumentParser(description="Query chatbot with embedding search")
     parser.add_argument('--question', type=str, help='Input question')
+    parser.add_argument('--filter', type=str, help='Metadata filter, e.g. "type=react_example;tags=hooks"')
     args = parser.parse_args()
 
     genai.configure(api_key=get_secret("GEMINI_API_KEY"))
@@ -91,10 +149,14 @@ async def main():
     collection = client.get_default_database()["normalized"]
 
     query = args.question or input("Enter your question: ")
-    query_emb = resize_embedding(get_embedding(query), 1024)
+    query_emb = get_embedding(query)
 
     print("🔍 Searching...")
-    results = await find_top_k(query_emb, collection, k=8)
+    try:
+        results = await find_top_k(query_emb, collection, k=8, filters=args.filter)
+    except Exception as e:
+        print(f"❌ Search error: {e}")
+        return
     for i, doc in enumerate(results, 1):
         print(f"\n--- Result #{i} ---")
         print(f"Explanation: {doc.get('explanation')}")
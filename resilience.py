@@ -0,0 +1,171 @@
+import os
+import time
+import asyncio
+
+# Request deadlines and circuit breakers for the upstreams of a chat request
+# (Gemini embedding, vector search, Cerebras generation). A request gets an
+# end-to-end deadline; every stage runs under min(stage budget, time left),
+# and an upstream that keeps failing or timing out is skipped for a while
+# instead of being waited on. The caller then answers in degraded mode.
+REQUEST_DEADLINE_S = float(os.getenv("REQUEST_DEADLINE_S", "20"))
+STAGE_BUDGETS_S = {
+    "embedding": float(os.getenv("EMBEDDING_BUDGET_S", "3")),
+    "search": float(os.getenv("SEARCH_BUDGET_S", "3")),
+    "generation": float(os.getenv("GENERATION_BUDGET_S", "15")),
+}
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_S = float(os.getenv("BREAKER_RESET_S", "30"))
+
+
+class CircuitOpen(Exception):
+    """The upstream's breaker is open: the call was not attempted."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} circuit open, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class Deadline:
+    """End-to-end budget of one request, split into per-stage budgets."""
+
+    def __init__(self, total=REQUEST_DEADLINE_S, budgets=None):
+        self.total = total
+        self.budgets = dict(STAGE_BUDGETS_S if budgets is None else budgets)
+        self.started = time.monotonic()
+
+    def remaining(self):
+        return max(0.0, self.total - (time.monotonic() - self.started))
+
+    def budget(self, stage):
+        """Seconds `stage` may take: its own budget, capped by what is left of the request."""
+        return min(self.budgets.get(stage, self.total), self.remaining())
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failures` consecutive failures (errors or timeouts);
+    open -> half-open after `reset_timeout`, letting one trial call through;
+    the trial closes the breaker again or re-opens it.
+    """
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_S):
+        self.name = name
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self.metrics = {"calls": 0, "failures": 0, "timeouts": 0, "rejected": 0, "opened": 0}
+
+    def allow(self):
+        """Whether a call may be attempted now (moves open -> half-open when due)."""
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+        if self.state == "half_open":
+            return not self._trial_running
+        return self.state == "closed"
+
+    def retry_after(self):
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.metrics["failures"] += 1
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failures:
+            if self.state != "open":
+                self.metrics["opened"] += 1
+                print(f"⚠️ Circuit {self.name} opened after {self.consecutive_failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def _admit(self, timeout):
+        """Start a call (raises CircuitOpen / asyncio.TimeoutError); returns whether it is the half-open trial."""
+        if not self.allow():
+            self.metrics["rejected"] += 1
+            raise CircuitOpen(self.name, self.retry_after())
+        if timeout <= 0:
+            self.metrics["rejected"] += 1
+            raise asyncio.TimeoutError(f"no time left for {self.name}")
+        trial = self.state == "half_open"
+        self._trial_running = trial
+        self.metrics["calls"] += 1
+        return trial
+
+    async def call(self, fn, timeout):
+        """Await fn() within `timeout` seconds. Raises CircuitOpen, asyncio.TimeoutError or fn's error."""
+        trial = self._admit(timeout)
+        try:
+            result = await asyncio.wait_for(fn(), timeout)
+        except asyncio.TimeoutError:
+            self.metrics["timeouts"] += 1
+            self.record_failure()
+            raise
+        except asyncio.CancelledError:
+            raise  # the client left; says nothing about the upstream
+        except Exception:
+            self.record_failure()
+            raise
+        finally:
+            if trial:
+                self._trial_running = False
+        self.record_success()
+        return result
+
+    async def stream(self, fn, timeout):
+        """Streaming counterpart of call(): yield the items of the async generator fn(), all within `timeout` seconds."""
+        trial = self._admit(timeout)
+        ends_at = time.monotonic() + timeout
+        items = fn()
+        try:
+            while True:
+                remaining = ends_at - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError(f"{self.name} ran out of time")
+                try:
+                    item = await asyncio.wait_for(items.__anext__(), remaining)
+                except StopAsyncIteration:
+                    break
+                yield item
+        except asyncio.TimeoutError:
+            self.metrics["timeouts"] += 1
+            self.record_failure()
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            raise  # the consumer stopped reading
+        except Exception:
+            self.record_failure()
+            raise
+        finally:
+            if trial:
+                self._trial_running = False
+            await items.aclose()
+        self.record_success()
+
+    def stats(self):
+        return dict(self.metrics, state=self.state, consecutive_failures=self.consecutive_failures,
+                    retry_after_s=self.retry_after())
+
+
+def degraded_answer(docs, reason):
+    """Answer from the retrieved docs alone, for when generation is unavailable or out of time."""
+    lines = [f"⚠️ The answer generator is unavailable right now ({reason}). "
+             "These are the most relevant snippets found for your question:"]
+    for i, doc in enumerate(docs, 1):
+        explanation = (doc.get("explanation") or "").strip()
+        if len(explanation) > 300:
+            explanation = explanation[:300].rstrip() + "…"
+        lines.append(f"\n**{i}. {explanation or 'Snippet'}**")
+        if doc.get("code"):
+            language = (doc.get("code_language") or "").split("/")[0].replace("unknown", "")
+            lines.append(f"```{language}\n{doc['code']}\n```")
+        if doc.get("link"):
+            lines.append(f"Link: {doc['link']}")
+    return "\n".join(lines)
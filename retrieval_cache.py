@@ -0,0 +1,156 @@
+import time
+from itertools import count
+from collections import OrderedDict
+
+import numpy as np
+from search_filters import filters_key
+
+
+class RetrievalCache:
+    """
+    LRU + TTL cache of retrieval results for similar query embeddings.
+
+    Lookup is banded locality-sensitive hashing: `tables` hash tables, each
+    keyed by `bits` signs of random hyperplane projections (plus k, filters).
+    Two queries at cosine c agree on one bit with probability
+    1 - acos(c)/pi, so with short bands a near-identical question shares at
+    least one bucket with high probability (12 bits x 8 tables: ~99% at
+    cosine 0.98), while unrelated ones rarely do. Every candidate found
+    this way is checked exactly: only the closest with cosine >=
+    `min_similarity` is served. When the corpus version changes, every
+    entry is dropped.
+    """
+
+    def __init__(self, max_entries=2048, ttl=300.0, bits=12, tables=8, min_similarity=0.98, seed=1234):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bits = bits
+        self.tables = tables
+        self.min_similarity = min_similarity
+        self.seed = seed
+        self.version = None
+        self._planes = None
+        self._items = OrderedDict()  # entry id -> entry (LRU order)
+        self._buckets = [{} for _ in range(tables)]  # per table: bucket key -> {entry ids}
+        self._ids = count()
+        self.metrics = {"hits": 0, "misses": 0, "rejected_collisions": 0,
+                        "expired": 0, "evictions": 0, "invalidations": 0, "stale_hits": 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _signatures(self, vector):
+        """One short signature per table."""
+        if self._planes is None or self._planes.shape[1] != vector.shape[0]:
+            rng = np.random.default_rng(self.seed)
+            self._planes = rng.standard_normal((self.tables * self.bits, vector.shape[0])).astype(np.float32)
+        signs = (self._planes @ vector > 0).reshape(self.tables, self.bits)
+        return [np.packbits(row).tobytes() for row in signs]
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._items:
+                self.metrics["invalidations"] += 1
+            self.clear()
+            self.version = version
+
+    def keys(self, vector, k, filters):
+        """Bucket key of the query in every table."""
+        query = (k, filters_key(filters))
+        return [(signature, query) for signature in self._signatures(vector)]
+
+    def _best(self, vector, keys, fresh_only):
+        """(entry id, entry) of the closest candidate within min_similarity, or (None, None)."""
+        candidates = set()
+        for table, key in zip(self._buckets, keys):
+            candidates |= table.get(key, set())
+        best_id, best, best_similarity = None, None, self.min_similarity
+        now = time.monotonic()
+        for entry_id in candidates:
+            item = self._items[entry_id]
+            similarity = float(item["vector"] @ vector)
+            if similarity < self.min_similarity:
+                self.metrics["rejected_collisions"] += 1
+                continue
+            if fresh_only and now - item["stored"] > self.ttl:
+                # Kept (until evicted) as a fallback for get_stale()
+                self.metrics["expired"] += 1
+                continue
+            if similarity >= best_similarity:
+                best_id, best, best_similarity = entry_id, item, similarity
+        return best_id, best
+
+    def get(self, embedding, k, filters=None, version=None):
+        """Cached documents for this query, or None."""
+        if not self.enabled:
+            return None
+        self._check_version(version)
+        vector = np.asarray(embedding, dtype=np.float32)
+        entry_id, item = self._best(vector, self.keys(vector, k, filters), fresh_only=True)
+        if item is None:
+            self.metrics["misses"] += 1
+            return None
+        self._items.move_to_end(entry_id)
+        self.metrics["hits"] += 1
+        return [dict(doc) for doc in item["docs"]]
+
+    def get_stale(self, embedding, k, filters=None):
+        """Cached documents ignoring the TTL, for when the search backend is unavailable."""
+        if not self.enabled:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        _, item = self._best(vector, self.keys(vector, k, filters), fresh_only=False)
+        if item is None:
+            return None
+        self.metrics["stale_hits"] += 1
+        return [dict(doc) for doc in item["docs"]]
+
+    def put(self, embedding, k, filters, version, docs):
+        if not self.enabled or not docs:
+            return  # an empty result may be a search error; never pin it
+        self._check_version(version)
+        vector = np.asarray(embedding, dtype=np.float32)
+        keys = self.keys(vector, k, filters)
+        # The same query again (a miss after expiry): replace its entry instead of adding one
+        previous_id, _ = self._best(vector, keys, fresh_only=False)
+        if previous_id is not None and float(self._items[previous_id]["vector"] @ vector) >= 1.0 - 1e-6:
+            self._remove(previous_id)
+        entry_id = next(self._ids)
+        self._items[entry_id] = {
+            "vector": vector,
+            "keys": keys,
+            "docs": [dict(doc) for doc in docs],
+            "stored": time.monotonic(),
+        }
+        for table, key in zip(self._buckets, keys):
+            table.setdefault(key, set()).add(entry_id)
+        while len(self._items) > self.max_entries:
+            self._remove(next(iter(self._items)))
+            self.metrics["evictions"] += 1
+
+    def _remove(self, entry_id):
+        item = self._items.pop(entry_id)
+        for table, key in zip(self._buckets, item["keys"]):
+            bucket = table.get(key)
+            bucket.discard(entry_id)
+            if not bucket:
+                del table[key]
+
+    def clear(self):
+        self._items.clear()
+        for table in self._buckets:
+            table.clear()
+
+    def stats(self):
+        lookups = self.metrics["hits"] + self.metrics["misses"]
+        return dict(
+            self.metrics,
+            hit_ratio=self.metrics["hits"] / lookups if lookups else None,
+            size=len(self._items),
+            max_entries=self.max_entries,
+            ttl_s=self.ttl,
+            bits=self.bits,
+            tables=self.tables,
+            corpus_version=self.version,
+        )
@@ -0,0 +1,72 @@
+import json
+
+# Metadata fields that can be used to pre-filter vector search. Every field
+# listed here must also be declared as a `filter` path in the Atlas index
+# (see upsert.VECTOR_INDEX_DEFINITION).
+FILTER_FIELDS = ("type", "tags", "code_language")
+
+
+def parse_filters(expr):
+    """
+    Parse a filter expression into {field: [values]}.
+
+    Accepts None, a dict ({"type": "react_example", "tags": ["hooks"]}),
+    a JSON object string, or the compact form
+    "type=react_example;tags=hooks,state;code_language=typescript".
+    Values of one field are OR-ed, different fields are AND-ed.
+    """
+    if not expr:
+        return {}
+    if isinstance(expr, str):
+        expr = expr.strip()
+        if expr.startswith("{"):
+            expr = json.loads(expr)
+        else:
+            pairs = {}
+            for part in expr.split(";"):
+                if not part.strip():
+                    continue
+                if "=" not in part:
+                    raise ValueError(f"Invalid filter clause '{part}', expected field=value")
+                field, values = part.split("=", 1)
+                pairs[field.strip()] = [v.strip() for v in values.split(",") if v.strip()]
+            expr = pairs
+    if not isinstance(expr, dict):
+        raise ValueError("Filter must be a dict or a string expression")
+
+    filters = {}
+    for field, values in expr.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Unsupported filter field '{field}'. Allowed: {', '.join(FILTER_FIELDS)}")
+        if isinstance(values, (str, int, float, bool)) or values is None:
+            values = [values]
+        if not isinstance(values, (list, tuple)):
+            raise ValueError(f"Filter '{field}' must be a value or a list of values")
+        for v in values:
+            if v is not None and not isinstance(v, (str, int, float, bool)):
+                raise ValueError(f"Filter '{field}' values must be strings or numbers, got {type(v).__name__}")
+        # Sorted by type, then text, so mixed types (1 and "1") still give one canonical order
+        values = sorted({v for v in values if v is not None and v != ""}, key=lambda v: (type(v).__name__, str(v)))
+        if values:
+            filters[field] = values
+    return filters
+
+
+def filters_key(filters):
+    """Canonical string of a filter expression, for use in cache keys."""
+    parsed = parse_filters(filters)
+    return json.dumps(parsed, sort_keys=True) if parsed else ""
+
+
+def to_atlas_filter(filters):
+    """Translate parsed filters into an Atlas `$vectorSearch.filter` document."""
+    clauses = []
+    for field, values in filters.items():
+        if len(values) == 1:
+            clauses.append({field: {"$eq": values[0]}})
+        else:
+            clauses.append({field: {"$in": list(values)}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
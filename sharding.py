@@ -0,0 +1,183 @@
+import os
+import time
+import zlib
+import heapq
+import asyncio
+
+from search_filters import parse_filters
+
+# Sharded corpus: one collection (and vector index) per source type, optionally
+# hash-partitioned, e.g. SHARDS="react_example,stackoverflow:4" gives
+# normalized_react_example and normalized_stackoverflow_0..3. A search fans out
+# to every shard concurrently and k-way merges the per-shard top-k lists, so
+# its latency follows the slowest shard instead of the size of the corpus.
+SHARDS = os.getenv("SHARDS", "")
+SHARD_QUOTAS = os.getenv("SHARD_QUOTAS", "")  # max results per type, e.g. "stackoverflow=3"
+SHARD_TIMEOUT_S = float(os.getenv("SHARD_TIMEOUT_S", "2"))
+SHARD_SCORE_NORM = os.getenv("SHARD_SCORE_NORM", "none")  # "none" | "zscore"
+SCORE_STATS_ALPHA = 0.05
+SCORE_STATS_WARMUP = 20
+
+
+def _parse_pairs(spec, sep):
+    pairs = {}
+    for part in (spec or "").replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, value = part.partition(sep)
+        if value and not value.strip().isdigit():
+            raise ValueError(f"Invalid shard setting '{part}'")
+        pairs[name.strip()] = int(value) if value else None
+    return pairs
+
+
+def parse_quotas(spec):
+    """"stackoverflow=3,react_example=5" -> {type: max results}."""
+    quotas = _parse_pairs(spec, "=")
+    missing = [t for t, q in quotas.items() if q is None]
+    if missing:
+        raise ValueError(f"Quota without a value for: {', '.join(missing)}")
+    return quotas
+
+
+class ShardLayout:
+    """Which collection every record lives in: one per type, times `partitions` hash partitions."""
+
+    def __init__(self, partitions=None):
+        self.partitions = dict(partitions or {})
+        if any(p < 1 for p in self.partitions.values()):
+            raise ValueError("A shard needs at least one partition")
+
+    @classmethod
+    def from_spec(cls, spec=SHARDS):
+        """"react_example,stackoverflow:4" -> ShardLayout({"react_example": 1, "stackoverflow": 4})."""
+        return cls({t: p or 1 for t, p in _parse_pairs(spec, ":").items()})
+
+    @property
+    def enabled(self):
+        return bool(self.partitions)
+
+    def collection(self, base, doc_type, partition=0):
+        if self.partitions[doc_type] == 1:
+            return f"{base}_{doc_type}"
+        return f"{base}_{doc_type}_{partition}"
+
+    def shards(self, base):
+        """[(collection name, type)] of every shard."""
+        return [(self.collection(base, t, p), t) for t, n in self.partitions.items() for p in range(n)]
+
+    def route(self, base, record):
+        """Shard collection of a record. Chunks hash on their parent so a record's chunks stay together."""
+        doc_type = record.get("type")
+        if doc_type not in self.partitions:
+            raise ValueError(f"Type '{doc_type}' has no shard (SHARDS={SHARDS!r})")
+        key = record.get("parent_id") or record.get("crawl_id") or ""
+        return self.collection(base, doc_type, zlib.crc32(key.encode("utf-8")) % self.partitions[doc_type])
+
+
+class ShardedCorpus:
+    """
+    Fan-out search over shard collections (Atlas collections or LocalIndex).
+
+    `search_fn` is the single-collection search (query.find_top_k). Every
+    shard is asked for min(k, type quota) hits, which keeps the merged top-k
+    exact; a shard that does not answer within `timeout` is left out of that
+    result instead of holding the request. With score_norm="zscore" scores
+    are standardized per shard (running mean/std of the shard's hits) before
+    merging, so a shard whose scores run systematically higher does not take
+    every slot.
+    """
+
+    def __init__(self, shards, search_fn, quotas=None, timeout=SHARD_TIMEOUT_S, score_norm=SHARD_SCORE_NORM):
+        if score_norm not in ("none", "zscore"):
+            raise ValueError("score_norm must be 'none' or 'zscore'")
+        self.shards = list(shards)  # [(name, type, collection)]
+        self.search_fn = search_fn
+        self.quotas = dict(quotas or {})
+        self.timeout = timeout
+        self.score_norm = score_norm
+        self.metrics = {name: {"searches": 0, "timeouts": 0, "errors": 0, "latency_ms": None,
+                               "score_mean": None, "score_var": None, "scores_seen": 0}
+                        for name, _, _ in self.shards}
+
+    async def _search_shard(self, name, collection, query_embedding, k, filters):
+        metrics = self.metrics[name]
+        started = time.perf_counter()
+        try:
+            docs = await asyncio.wait_for(self.search_fn(query_embedding, collection, k, filters), self.timeout)
+        except asyncio.TimeoutError:
+            metrics["timeouts"] += 1
+            print(f"⚠️ Shard {name} timed out after {self.timeout}s")
+            return None
+        except Exception as e:
+            metrics["errors"] += 1
+            print(f"⚠️ Shard {name} failed: {e}")
+            return None
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        metrics["searches"] += 1
+        metrics["latency_ms"] = elapsed_ms if metrics["latency_ms"] is None else \
+            0.8 * metrics["latency_ms"] + 0.2 * elapsed_ms
+        self._observe_scores(metrics, docs)
+        return docs
+
+    def _observe_scores(self, metrics, docs):
+        for doc in docs:
+            score = doc.get("score")
+            if score is None:
+                continue
+            if metrics["score_mean"] is None:
+                metrics["score_mean"], metrics["score_var"] = score, 0.0
+            else:
+                delta = score - metrics["score_mean"]
+                metrics["score_mean"] += SCORE_STATS_ALPHA * delta
+                metrics["score_var"] = (1 - SCORE_STATS_ALPHA) * (metrics["score_var"] + SCORE_STATS_ALPHA * delta * delta)
+            metrics["scores_seen"] += 1
+
+    def _normalizer(self, names):
+        """Score -> merge key for each shard; raw scores until every shard has enough statistics."""
+        if self.score_norm == "zscore" and all(self.metrics[n]["scores_seen"] >= SCORE_STATS_WARMUP for n in names):
+            def zscore(name):
+                mean, var = self.metrics[name]["score_mean"], self.metrics[name]["score_var"]
+                std = max(var, 1e-12) ** 0.5
+                return lambda score: (score - mean) / std
+            return {name: zscore(name) for name in names}
+        return {name: (lambda score: score) for name in names}
+
+    async def search(self, query_embedding, k=5, filters=None):
+        filters = parse_filters(filters)
+        wanted_types = set(filters.get("type", ())) or None
+        targets = [(name, doc_type, collection) for name, doc_type, collection in self.shards
+                   if (wanted_types is None or doc_type in wanted_types) and self.quotas.get(doc_type, k) > 0]
+        results = await asyncio.gather(*(
+            self._search_shard(name, collection, query_embedding, min(k, self.quotas.get(doc_type, k)), filters)
+            for name, doc_type, collection in targets
+        ))
+        # A slow or failing shard only drops its own hits; if every shard failed the search fails
+        if targets and all(docs is None for docs in results):
+            raise RuntimeError(f"All {len(targets)} shards failed or timed out")
+        return self.merge(targets, [docs or [] for docs in results], k)
+
+    def merge(self, targets, results, k):
+        """k-way merge of the per-shard lists (each best first), applying the per-type quotas."""
+        normalize = self._normalizer([name for name, _, _ in targets])
+        streams = [
+            [(-normalize[name](doc.get("score") or 0.0), i, j, doc) for j, doc in enumerate(docs)]
+            for i, ((name, _, _), docs) in enumerate(zip(targets, results))
+        ]
+        merged, taken, seen = [], {}, set()
+        for _, i, _, doc in heapq.merge(*streams):
+            doc_type = targets[i][1]
+            crawl_id = doc.get("crawl_id")
+            if taken.get(doc_type, 0) >= self.quotas.get(doc_type, k) or (crawl_id and crawl_id in seen):
+                continue
+            taken[doc_type] = taken.get(doc_type, 0) + 1
+            seen.add(crawl_id)
+            merged.append(dict(doc, shard=targets[i][0]))
+            if len(merged) == k:
+                break
+        return merged
+
+    def stats(self):
+        return {"quotas": self.quotas, "timeout_s": self.timeout, "score_norm": self.score_norm,
+                "shards": self.metrics}
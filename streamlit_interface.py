@@ -6,7 +6,13 @@ os.environ['DISABLE_GCE_METADATA_SERVICE'] = 'true'
 import streamlit as st
 from dotenv import load_dotenv
 load_dotenv()
-from chatbot import get_chatbot_response
+import chatbot
+from chatbot import stream_chatbot_response
+from code_chunker import chunk_upload, select_upload_context
+from model_router import MODELS
+import asyncio
+import hashlib
+import threading
 import json
 import re
 import tiktoken
@@ -19,6 +25,46 @@ st.set_page_config(
 )
 
 
+# --- Cached resources: survive Streamlit reruns ---
+@st.cache_resource
+def get_event_loop():
+    """Persistent event loop in a background thread; motor/Cerebras clients stay bound to it."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="chatbot-loop", daemon=True).start()
+    return loop
+
+def run_async(coro):
+    """Run a coroutine on the background loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+def iter_async(agen):
+    """Bridge an async generator on the background loop to a sync generator (for st.write_stream)."""
+    loop = get_event_loop()
+    while True:
+        try:
+            yield asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+        except StopAsyncIteration:
+            break
+
+@st.cache_resource
+def init_backend():
+    """Connect MongoDB, load the prompt and warm the embedding client once per process."""
+    run_async(chatbot.warm_up())
+    return chatbot.readiness
+
+@st.cache_resource
+def get_tokenizer(model_name: str = "gpt-3.5-turbo"):
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except Exception:
+        return tiktoken.get_encoding("cl100k_base")
+
+init_backend()
+
+# Uploads: size limit and prompt budget for the selected chunks
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(512 * 1024)))
+UPLOAD_CONTEXT_CHARS = int(os.getenv("UPLOAD_CONTEXT_CHARS", "6000"))
+
 # Khởi tạo session state
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
@@ -33,7 +79,7 @@ if "context_history" not in st.session_state:
 # Sidebar: model selection and clear history
 with st.sidebar:
     st.header("Options")
-    model = st.selectbox("Choose model", ["gpt-oss-120b", "llama-3.3-70b", "qwen-3-235b-a22b-instruct-2507"],  index=0)
+    model = st.selectbox("Choose model", MODELS,  index=0)
     if st.button("Clear chat history"):
         st.session_state.chat_history = []
         st.session_state.display_messages = []
@@ -62,11 +108,16 @@ def minify_code(code: str, filetype: str) -> str:
     return code
 
 def count_tokens(text: str, model_name: str = "gpt-3.5-turbo") -> int:
-    try:
-        enc = tiktoken.encoding_for_model(model_name)
-    except Exception:
-        enc = tiktoken.get_encoding("cl100k_base")
-    return len(enc.encode(text))
+    return len(get_tokenizer(model_name).encode(text))
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def process_upload(file_hash: str, _raw: bytes):
+    """Decode + chunk + minify an upload once per file content (keyed by hash, not by the bytes)."""
+    file_content = _raw.decode("utf-8")
+    minified_content = minify_code(file_content, "")
+    # Chunked before minifying, so the line ranges match the uploaded file
+    chunks = chunk_upload(file_content, UPLOAD_CONTEXT_CHARS, minify=lambda code: minify_code(code, ""))
+    return chunks, count_tokens(file_content), count_tokens(minified_content)
 
 def local_debug_token_count(answer, model_name="gpt-3.5-turbo"):
     token_count = count_tokens(answer, model_name)
@@ -75,7 +126,7 @@ def local_debug_token_count(answer, model_name="gpt-3.5-turbo"):
 # File upload
 with st.container():
     uploaded_file = st.file_uploader(
-        "Upload FE file (js, ts, tsx, jsx, css, html) - max 5KB:",
+        f"Upload FE file (js, ts, tsx, jsx, css, html) - max {MAX_UPLOAD_BYTES // 1024}KB:",
         type=["js", "ts", "tsx", "jsx", "css", "html"],
         key="file_upload"
     )
@@ -102,15 +153,19 @@ st.markdown(
 )
 
 file_content = None
-minified_content = None
+upload_chunks = None
 file_token_count = 0
 minified_token_count = 0
 if uploaded_file is not None:
-    if uploaded_file.size > 5 * 1024:
-        st.error("File exceeds 5KB.")
+    if uploaded_file.size > MAX_UPLOAD_BYTES:
+        st.error(f"File exceeds {MAX_UPLOAD_BYTES // 1024}KB.")
     else:
+        raw = uploaded_file.getvalue()
         try:
-            file_content = uploaded_file.getvalue().decode("utf-8")
+            upload_chunks, file_token_count, minified_token_count = process_upload(
+                hashlib.sha256(raw).hexdigest(), raw
+            )
+            file_content = raw
         except UnicodeDecodeError:
             st.error("File encoding not supported. Please upload a UTF-8 encoded file.")
             file_content = None
@@ -118,9 +173,6 @@ if uploaded_file is not None:
             st.error(f"Could not read file: {e}")
             file_content = None
         if file_content is not None:
-            minified_content = minify_code(file_content, "")
-            file_token_count = count_tokens(file_content)
-            minified_token_count = count_tokens(minified_content)
             st.info(f"[Local debug] File tokens: {file_token_count}, Minified tokens: {minified_token_count}")
 
 # Chat input fixed at bottom via default st.chat_input
@@ -129,29 +181,28 @@ if user_input:
     if len(user_input.split()) > 100:
         st.error("Limit is 100 words.")
     else:
-        combined_input = user_input
-        if minified_content:
-            combined_input += f"\n\n[Minified file content from {uploaded_file.name}:]\n{minified_content}"
+        # Only the chunks relevant to the question are sent; only the question is embedded
+        attachment = None
+        if upload_chunks:
+            attachment = select_upload_context(uploaded_file.name, upload_chunks, user_input, UPLOAD_CONTEXT_CHARS)
         st.chat_message("user").write(user_input)
         with st.chat_message("assistant"):
-            with st.spinner(" Generating answer..."):
-                try:
-                    answer, context_info, updated_chat_history = get_chatbot_response(
-                        combined_input,
-                        st.session_state.chat_history,
-                        5,
-                        model
-                    )
-                    st.write(answer)
-                    # Local debug: show token count of answer
-                    local_debug_token_count(answer, model_name=model)
-                    # update history
-                    st.session_state.chat_history = updated_chat_history
-                    st.session_state.display_messages.extend([
-                        {"role": "user", "content": user_input},
-                        {"role": "assistant", "content": answer}
-                    ])
-                except Exception as e:
-                    st.error(f"❌ Error: {e}")
+            try:
+                # Tokens render as they arrive; chat_history is updated in place when done.
+                answer = st.write_stream(iter_async(stream_chatbot_response(
+                    user_input,
+                    st.session_state.chat_history,
+                    5,
+                    model,
+                    attachment=attachment
+                )))
+                # Local debug: show token count of answer
+                local_debug_token_count(answer, model_name=model)
+                st.session_state.display_messages.extend([
+                    {"role": "user", "content": user_input},
+                    {"role": "assistant", "content": answer}
+                ])
+            except Exception as e:
+                st.error(f"❌ Error: {e}")
     st.markdown("</div>", unsafe_allow_html=True)
 
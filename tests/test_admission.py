@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, Overloaded, TokenBucket, per_worker
+
+
+def controller(**kwargs):
+    kwargs.setdefault("client_rate", 0)
+    return AdmissionController(**kwargs)
+
+
+def test_waiters_get_slots_in_fifo_order():
+    async def scenario():
+        admission = controller(max_in_flight=1, max_queue=4, queue_timeout=1.0)
+        order = []
+
+        async def request(name):
+            async with admission.slot(name):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(request(name) for name in "abcd"))
+        return admission, order
+
+    admission, order = asyncio.run(scenario())
+    assert order == list("abcd")
+    assert admission.in_flight == 0
+    assert admission.metrics["queued"] == 3 and admission.metrics["admitted"] == 4
+
+
+def test_queue_timeout_raises_overloaded_with_retry_after():
+    async def scenario():
+        admission = controller(max_in_flight=1, max_queue=4, queue_timeout=0.05)
+        await admission.acquire("a")
+        with pytest.raises(Overloaded) as error:
+            await admission.acquire("b")
+        return admission, error.value
+
+    admission, error = asyncio.run(scenario())
+    assert error.reason == "queue_timeout"
+    assert error.retry_after >= 1
+    assert admission.in_flight == 1 and admission.stats()["queue_depth"] == 0
+
+
+def test_full_queue_is_rejected_immediately():
+    async def scenario():
+        admission = controller(max_in_flight=1, max_queue=0)
+        await admission.acquire("a")
+        with pytest.raises(Overloaded) as error:
+            await admission.acquire("b")
+        return error.value
+
+    assert asyncio.run(scenario()).reason == "queue_full"
+
+
+def test_cancelled_waiter_passes_the_slot_on():
+    async def scenario():
+        admission = controller(max_in_flight=1, max_queue=4, queue_timeout=1.0)
+        await admission.acquire("a")
+        waiter = asyncio.create_task(admission.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        admission.release()
+        return admission
+
+    admission = asyncio.run(scenario())
+    assert admission.in_flight == 0
+
+
+def test_client_rate_limit():
+    async def scenario():
+        admission = AdmissionController(client_rate=0.1, client_burst=2)
+        await admission.acquire("a")
+        await admission.acquire("a")
+        await admission.acquire("b")  # other clients have their own bucket
+        with pytest.raises(Overloaded) as error:
+            await admission.acquire("a")
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert error.reason == "rate_limited"
+    assert error.retry_after >= 1
+
+
+def test_token_bucket_reports_wait():
+    bucket = TokenBucket(rate=2.0, burst=1)
+    assert bucket.take() == 0.0
+    assert 0 < bucket.take() <= 0.5
+
+
+def test_per_worker_split():
+    limits = {"max_in_flight": 16, "max_queue": 5, "client_burst": 1, "client_rate": 1.0}
+    shares = per_worker(limits, 4)
+    assert shares == {"max_in_flight": 4, "max_queue": 2, "client_burst": 1, "client_rate": 0.25}
+    assert per_worker(limits, 0) == dict(limits, max_in_flight=16, max_queue=5)
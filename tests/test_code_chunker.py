@@ -0,0 +1,97 @@
+import re
+
+from code_chunker import chunk_upload, select_relevant_chunks, split_code, build_upload_context
+
+SOURCE = """// App entry
+import React, { useState } from 'react';
+import './App.css';
+
+/**
+ * A counter.
+ */
+function useCounter(initial) {
+
+  // current value
+  const [count, setCount] = useState(initial);
+  return [count, () => setCount(count + 1)];
+}
+
+export default function App() {
+  const [count, increment] = useCounter(0);
+
+  return <button onClick={increment}>{count}</button>;
+}
+"""
+
+
+def minify(code):
+    """Same rules as app.minify_code."""
+    code = re.sub(r'//.*', '', code)
+    code = re.sub(r'/\*.*?\*/', '', code, flags=re.DOTALL)
+    return '\n'.join(line for line in code.splitlines() if line.strip())
+
+
+def original(start_line, end_line):
+    return SOURCE.split("\n")[start_line - 1:end_line]
+
+
+def test_chunks_follow_declarations():
+    chunks = split_code(SOURCE)
+    assert [(c["kind"], c["name"]) for c in chunks] == [
+        ("imports", None), ("hook", "useCounter"), ("component", "App")]
+
+
+def test_minified_chunks_keep_original_line_ranges():
+    chunks = chunk_upload(SOURCE, minify=minify)
+    hook = next(c for c in chunks if c["name"] == "useCounter")
+    lines = original(hook["start_line"], hook["end_line"])
+    assert lines[0] == "/**" and lines[-1] == "}"
+    assert hook["text"].split("\n")[0] == "function useCounter(initial) {"
+    assert "//" not in hook["text"] and "\n\n" not in hook["text"]
+    for chunk in chunks:
+        # Every minified line comes from the chunk's range of the original file
+        source = original(chunk["start_line"], chunk["end_line"])
+        assert all(line in [minify(s) for s in source] for line in chunk["text"].split("\n"))
+
+
+def test_comment_only_chunks_are_dropped_after_minifying():
+    chunks = chunk_upload("// just a note\n/* and more */\n", minify=minify)
+    assert chunks == []
+    assert build_upload_context("a.js", "// note\n", "anything", minify=minify) == ""
+
+
+def test_attachment_labels_use_original_lines():
+    attachment = build_upload_context("App.jsx", SOURCE, "useCounter hook", minify=minify)
+    hook = next(c for c in split_code(SOURCE) if c["name"] == "useCounter")
+    assert f"// lines {hook['start_line']}-{hook['end_line']} (hook useCounter)" in attachment
+
+
+def test_oversized_declaration_is_windowed():
+    body = "\n".join(f"  const value{i} = {i};" for i in range(200))
+    code = f"function big() {{\n{body}\n}}\n"
+    chunks = split_code(code, max_chars=500)
+    assert len(chunks) > 1
+    assert all(len(c["text"]) <= 500 for c in chunks)
+    assert chunks[0]["start_line"] == 1 and chunks[-1]["end_line"] == 202
+    assert [c["part"] for c in chunks] == list(range(1, len(chunks) + 1))
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk["start_line"] == previous["end_line"] + 1
+    assert all(c["name"] == "big" for c in chunks)
+
+
+def test_selection_respects_budget_and_file_order():
+    chunks = [{"kind": "function", "name": f"f{i}", "start_line": i, "end_line": i,
+               "text": f"function f{i}() {{ return {'target' if i % 4 == 0 else 'other'}; }}" + " " * 50}
+              for i in range(20)]
+    budget = 400
+    selected = select_relevant_chunks(chunks, "target", budget)
+    assert sum(len(c["text"]) + 1 for c in selected) <= budget
+    assert [c["start_line"] for c in selected] == sorted(c["start_line"] for c in selected)
+    # The matching chunks are preferred over the head of the file
+    assert all("target" in c["text"] for c in selected)
+
+
+def test_selection_without_overlap_uses_head_of_file():
+    chunks = split_code(SOURCE)
+    selected = select_relevant_chunks(chunks, "zzz", max_chars=len(chunks[0]["text"]) + 1)
+    assert [c["start_line"] for c in selected] == [chunks[0]["start_line"]]
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+import local_index
+from local_index import LocalIndex
+
+N, DIM = 500, 16
+
+
+@pytest.fixture(scope="module")
+def index():
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((N, DIM)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    records = [{"crawl_id": str(i),
+                "type": "react_example" if i % 10 else "stackoverflow",
+                "tags": ["hooks"] if i % 3 == 0 else ["state", "forms"]}
+               for i in range(N)]
+    return LocalIndex(embeddings, records, version=1)
+
+
+def expected_top(index, query, rows, k):
+    """Reference result: unfiltered scan, non-candidates masked out."""
+    scores = index.embeddings @ query
+    mask = np.full(N, -np.inf, dtype=np.float32)
+    mask[rows] = 0.0
+    return [str(i) for i in np.argsort(-(scores + mask), kind="stable")[:min(k, len(rows))]]
+
+
+def ids(docs):
+    return [doc["crawl_id"] for doc in docs]
+
+
+def test_bitmap_candidates(index):
+    assert index.candidates({}) is None
+    rows = index.candidates({"type": ["stackoverflow"], "tags": ["hooks"]})
+    assert list(rows) == [i for i in range(N) if i % 30 == 0]
+    rows = index.candidates({"tags": ["hooks", "forms"]})
+    assert len(rows) == N
+    assert len(index.candidates({"type": ["unknown"]})) == 0
+
+
+@pytest.mark.parametrize("filters", [
+    {"type": "stackoverflow"},                      # 10%: candidate rows gathered
+    {"type": "react_example"},                      # 90%: full scan + mask
+    {"type": "stackoverflow", "tags": "hooks"},
+])
+@pytest.mark.parametrize("selectivity", [0.0, 1.1])
+def test_filtered_search_matches_masked_scan(index, monkeypatch, filters, selectivity):
+    monkeypatch.setattr(local_index, "FULL_SCAN_SELECTIVITY", selectivity)
+    rng = np.random.default_rng(1)
+    queries = rng.standard_normal((3, DIM)).astype(np.float32)
+    rows = index.candidates({field: [value] for field, value in filters.items()})
+    batch = index.search_many(queries, k=7, filters=filters)
+    for query, docs in zip(queries, batch):
+        expected = expected_top(index, query, rows, 7)
+        assert ids(index.search(query, k=7, filters=filters)) == expected
+        assert ids(docs) == expected
+
+
+def test_k_larger_than_candidates_never_returns_masked_rows(index, monkeypatch):
+    monkeypatch.setattr(local_index, "FULL_SCAN_SELECTIVITY", 0.0)
+    query = np.ones(DIM, dtype=np.float32) / np.sqrt(DIM)
+    docs = index.search(query, k=N, filters={"type": "stackoverflow"})
+    assert len(docs) == N // 10
+    assert all(doc["type"] == "stackoverflow" for doc in docs)
+    assert all(0.0 <= doc["score"] <= 1.0 for doc in docs)
+
+
+def test_no_match_returns_empty(index):
+    query = np.ones(DIM, dtype=np.float32)
+    assert index.search(query, filters={"type": "unknown"}) == []
+    assert index.search_many([query, query], filters={"type": "unknown"}) == [[], []]
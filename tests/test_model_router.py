@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from model_router import ModelRouter
+
+MODELS = ["primary", "backup", "spare"]
+
+
+def stub(behaviour):
+    """Stub endpoint: behaviour[model] is (delay seconds, error or None); calls are logged."""
+    calls = []
+
+    async def call(model, messages):
+        calls.append(model)
+        delay, error = behaviour[model]
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return f"answer from {model}"
+
+    return call, calls
+
+
+def test_fails_over_to_next_model():
+    call, calls = stub({"primary": (0, RuntimeError("down")), "backup": (0, None), "spare": (0, None)})
+    router = ModelRouter(call, models=MODELS, hedge=False)
+    result, used = asyncio.run(router.complete([], "primary"))
+    assert (result, used) == ("answer from backup", "backup")
+    assert calls == ["primary", "backup"]
+    assert router.stats["primary"].errors == 1
+
+
+def test_raises_last_error_when_every_model_fails():
+    call, _ = stub({m: (0, RuntimeError(m)) for m in MODELS})
+    router = ModelRouter(call, models=MODELS, hedge=False)
+    with pytest.raises(RuntimeError):
+        asyncio.run(router.complete([], "primary"))
+
+
+def test_hedge_wins_and_cancelled_loser_is_not_a_latency_sample():
+    call, calls = stub({"primary": (1.0, None), "backup": (0.01, None), "spare": (0.01, None)})
+    router = ModelRouter(call, models=MODELS, hedge=True, hedge_min_delay=0.05, default_deadline=0.05)
+    result, used = asyncio.run(router.complete([], "primary"))
+    assert used == "backup"
+    assert calls[:2] == ["primary", "backup"]
+    primary = router.stats["primary"]
+    assert primary.hedges == 1
+    assert primary.cancelled == 1
+    assert primary.requests == 0 and primary.latency_ewma is None
+    assert router.stats["backup"].hedge_wins == 1
+
+
+def test_failing_model_is_tried_after_a_healthy_one():
+    call, _ = stub({m: (0, None) for m in MODELS})
+    router = ModelRouter(call, models=MODELS, hedge=False)
+    for _ in range(5):
+        router.record("primary", 0.1, ok=False)
+    assert router.candidates("primary")[0] != "primary"
+    assert "primary" in router.candidates("primary")
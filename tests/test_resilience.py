@@ -0,0 +1,159 @@
+import asyncio
+import time
+
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpen, Deadline, degraded_answer
+
+
+async def ok():
+    return "ok"
+
+
+async def fail():
+    raise RuntimeError("down")
+
+
+async def slow():
+    await asyncio.sleep(1)
+
+
+def run(breaker, fn, timeout=1.0):
+    return asyncio.run(breaker.call(fn, timeout))
+
+
+def trip(breaker):
+    for _ in range(breaker.failures):
+        with pytest.raises(RuntimeError):
+            run(breaker, fail)
+
+
+def expire(breaker):
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout
+
+
+def test_deadline_caps_stage_budgets():
+    deadline = Deadline(total=10, budgets={"search": 3})
+    assert deadline.budget("search") == pytest.approx(3, abs=0.1)
+    assert deadline.budget("generation") == pytest.approx(10, abs=0.1)
+    deadline.started -= 9
+    assert deadline.budget("search") == pytest.approx(1, abs=0.1)
+    deadline.started -= 5
+    assert deadline.remaining() == 0.0 and deadline.budget("search") == 0.0
+
+
+def test_open_half_open_closed():
+    breaker = CircuitBreaker("search", failures=2, reset_timeout=30)
+    trip(breaker)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpen) as error:
+        run(breaker, ok)
+    assert error.value.retry_after > 0
+    expire(breaker)
+    assert run(breaker, ok) == "ok"
+    assert breaker.state == "closed" and breaker.consecutive_failures == 0
+    assert breaker.metrics["opened"] == 1 and breaker.metrics["rejected"] == 1
+
+
+def test_failed_trial_reopens():
+    breaker = CircuitBreaker("search", failures=2, reset_timeout=30)
+    trip(breaker)
+    expire(breaker)
+    with pytest.raises(RuntimeError):
+        run(breaker, fail)
+    assert breaker.state == "open" and breaker.retry_after() > 0
+
+
+def test_half_open_lets_a_single_trial_through():
+    async def scenario(breaker):
+        started = asyncio.Event()
+
+        async def trial():
+            started.set()
+            await asyncio.sleep(0.05)
+            return "trial"
+
+        first = asyncio.create_task(breaker.call(trial, 1.0))
+        await started.wait()
+        with pytest.raises(CircuitOpen):
+            await breaker.call(ok, 1.0)
+        return await first
+
+    breaker = CircuitBreaker("generation", failures=1, reset_timeout=30)
+    trip(breaker)
+    expire(breaker)
+    assert asyncio.run(scenario(breaker)) == "trial"
+    assert breaker.state == "closed"
+
+
+def test_timeouts_count_as_failures():
+    breaker = CircuitBreaker("embedding", failures=1)
+    with pytest.raises(asyncio.TimeoutError):
+        run(breaker, slow, timeout=0.01)
+    assert breaker.state == "open" and breaker.metrics["timeouts"] == 1
+    with pytest.raises(asyncio.TimeoutError):
+        run(CircuitBreaker("embedding"), ok, timeout=0)
+
+
+def collect(breaker, fn, timeout=1.0, stop_after=None):
+    async def consume():
+        items = []
+        async for item in breaker.stream(fn, timeout):
+            items.append(item)
+            if stop_after is not None and len(items) == stop_after:
+                break
+        return items
+    return asyncio.run(consume())
+
+
+def tokens(n, error=None, delay=0.0):
+    async def gen():
+        for i in range(n):
+            await asyncio.sleep(delay)
+            yield str(i)
+        if error:
+            raise error
+    return gen
+
+
+def test_stream_success_closes_breaker():
+    breaker = CircuitBreaker("generation", failures=1, reset_timeout=30)
+    trip(breaker)
+    expire(breaker)
+    assert collect(breaker, tokens(3)) == ["0", "1", "2"]
+    assert breaker.state == "closed" and breaker.metrics["calls"] == 2
+
+
+def test_stream_error_midway_is_a_failure():
+    breaker = CircuitBreaker("generation", failures=1)
+    with pytest.raises(RuntimeError):
+        collect(breaker, tokens(2, RuntimeError("cut")))
+    assert breaker.state == "open" and breaker.metrics["failures"] == 1
+
+
+def test_stream_deadline_covers_the_whole_stream():
+    breaker = CircuitBreaker("generation", failures=1)
+    with pytest.raises(asyncio.TimeoutError):
+        collect(breaker, tokens(10, delay=0.02), timeout=0.05)
+    assert breaker.metrics["timeouts"] == 1 and breaker.state == "open"
+
+
+def test_stream_consumer_stopping_is_not_a_failure():
+    breaker = CircuitBreaker("generation", failures=1, reset_timeout=30)
+    trip(breaker)
+    expire(breaker)
+    assert collect(breaker, tokens(5), stop_after=2) == ["0", "1"]
+    assert breaker.metrics["failures"] == 1  # only the trip
+    assert breaker.allow()  # the trial slot was given back
+
+
+def test_degraded_answer_lists_snippets():
+    docs = [{"explanation": "x" * 400, "code": "useState(0)", "code_language": "javascript/react",
+             "link": "https://react.dev"},
+            {"code_language": "unknown"}]
+    answer = degraded_answer(docs, "timeout")
+    assert "(timeout)" in answer
+    assert "**1. " + "x" * 300 + "…**" in answer
+    assert "```javascript\nuseState(0)\n```" in answer
+    assert "Link: https://react.dev" in answer
+    assert "**2. Snippet**" in answer
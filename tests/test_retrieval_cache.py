@@ -0,0 +1,65 @@
+import numpy as np
+
+from retrieval_cache import RetrievalCache
+
+DIM = 64
+DOCS = [{"crawl_id": "a", "score": 0.9}]
+
+
+def unit(v):
+    return v / np.linalg.norm(v)
+
+
+def perturbed(base, cosine, rng):
+    """A unit vector at exactly `cosine` from `base`."""
+    noise = rng.standard_normal(base.shape)
+    noise = unit(noise - (noise @ base) * base)
+    return unit(cosine * base + np.sqrt(1 - cosine ** 2) * noise)
+
+
+def test_similar_query_hits_and_dissimilar_misses():
+    rng = np.random.default_rng(0)
+    hits = misses = 0
+    for _ in range(200):
+        cache = RetrievalCache(min_similarity=0.98)
+        base = unit(rng.standard_normal(DIM))
+        cache.put(base, 5, None, 1, DOCS)
+        hits += cache.get(perturbed(base, 0.985, rng), 5, version=1) is not None
+        misses += cache.get(perturbed(base, 0.95, rng), 5, version=1) is None
+    # Banding finds near-duplicates almost always; the exact check rejects the rest every time.
+    assert hits >= 195
+    assert misses == 200
+
+
+def test_k_and_filters_are_part_of_the_key():
+    cache = RetrievalCache()
+    vector = unit(np.ones(DIM))
+    cache.put(vector, 5, {"type": "react_example"}, 1, DOCS)
+    assert cache.get(vector, 5, {"type": "react_example"}, version=1) == DOCS
+    assert cache.get(vector, 3, {"type": "react_example"}, version=1) is None
+    assert cache.get(vector, 5, None, version=1) is None
+
+
+def test_version_bump_invalidates():
+    cache = RetrievalCache()
+    vector = unit(np.ones(DIM))
+    cache.put(vector, 5, None, 1, DOCS)
+    assert cache.get(vector, 5, version=1) == DOCS
+    assert cache.get(vector, 5, version=2) is None
+    assert cache.stats()["invalidations"] == 1 and cache.stats()["size"] == 0
+
+
+def test_lru_eviction_and_same_query_replaces():
+    cache = RetrievalCache(max_entries=2)
+    rng = np.random.default_rng(1)
+    first, second, third = (unit(rng.standard_normal(DIM)) for _ in range(3))
+    cache.put(first, 5, None, 1, DOCS)
+    cache.put(first, 5, None, 1, [{"crawl_id": "b"}])
+    assert cache.stats()["size"] == 1
+    assert cache.get(first, 5, version=1) == [{"crawl_id": "b"}]
+    cache.put(second, 5, None, 1, DOCS)
+    cache.get(first, 5, version=1)
+    cache.put(third, 5, None, 1, DOCS)
+    assert cache.get(second, 5, version=1) is None
+    assert cache.get(first, 5, version=1) is not None
+    assert cache.stats()["evictions"] == 1
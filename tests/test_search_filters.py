@@ -0,0 +1,41 @@
+import pytest
+
+from search_filters import parse_filters, filters_key, to_atlas_filter
+
+
+def test_parses_dict_json_and_compact_forms_alike():
+    expected = {"type": ["react_example"], "tags": ["hooks", "state"]}
+    assert parse_filters({"type": "react_example", "tags": ["state", "hooks"]}) == expected
+    assert parse_filters('{"type": "react_example", "tags": ["state", "hooks"]}') == expected
+    assert parse_filters("type=react_example; tags=state,hooks") == expected
+
+
+def test_empty_values_are_dropped():
+    assert parse_filters(None) == {}
+    assert parse_filters("") == {}
+    assert parse_filters({"type": None, "tags": ["", None]}) == {}
+    assert parse_filters("type=;tags=hooks,") == {"tags": ["hooks"]}
+
+
+def test_mixed_value_types_have_one_canonical_order():
+    assert filters_key({"tags": [1, "1", "a"]}) == filters_key({"tags": ["a", "1", 1]})
+
+
+@pytest.mark.parametrize("expr", [
+    {"language": "js"},            # not a filter field
+    {"tags": [{"name": "hooks"}]},  # not a scalar
+    {"tags": {"hooks": True}},     # not a list
+    "type",                        # no '='
+    42,                            # not a dict or a string
+])
+def test_rejects_invalid_filters(expr):
+    with pytest.raises(ValueError):
+        parse_filters(expr)
+
+
+def test_atlas_filter():
+    assert to_atlas_filter({}) is None
+    assert to_atlas_filter({"type": ["a"]}) == {"type": {"$eq": "a"}}
+    assert to_atlas_filter({"type": ["a"], "tags": ["x", "y"]}) == {
+        "$and": [{"type": {"$eq": "a"}}, {"tags": {"$in": ["x", "y"]}}]
+    }
@@ -2,10 +2,18 @@
 import json
 import google.generativeai as genai
 import os
+import time
+import numpy as np
 from pymongo import MongoClient
-from pymongo import UpdateOne, InsertOne
+from pymongo import UpdateOne, InsertOne, DeleteMany
 
 from tqdm import tqdm
+from embedding_transform import EMBEDDING_DIM
+from search_filters import FILTER_FIELDS
+from code_chunker import split_code
+from query import CHUNK_COLLECTION
+from embedding_providers import get_provider
+from sharding import ShardLayout
 
 def read_env_key(key_name, env_file="key.env"):
 	with open(env_file, "r", encoding="utf-8") as f:
@@ -16,45 +24,137 @@ def read_env_key(key_name, env_file="key.env"):
 
 # INDEX_NAME = "chatcodeai"
 
-def get_embedding(text, model="models/embedding-001"):
-	response = genai.embed_content(model=model, content=[text])
-	if isinstance(response, dict) and 'embedding' in response:
-		embedding = response['embedding']
-	elif isinstance(response, list) and len(response) > 0:
-		if isinstance(response[0], dict) and 'embedding' in response[0]:
-			embedding = response[0]['embedding']
+# Atlas Vector Search index: embedding + các trường metadata dùng để pre-filter
+VECTOR_INDEX_NAME = "vector_index"
+VECTOR_INDEX_DEFINITION = {
+	"fields": [
+		{"type": "vector", "path": "embedding", "numDimensions": EMBEDDING_DIM, "similarity": "cosine"},
+	] + [{"type": "filter", "path": field} for field in FILTER_FIELDS]
+}
+
+
+def ensure_vector_index(collection):
+	"""Tạo hoặc cập nhật vector index để các trường filter được index."""
+	from pymongo.operations import SearchIndexModel
+	try:
+		existing = list(collection.list_search_indexes(VECTOR_INDEX_NAME))
+		if existing:
+			collection.update_search_index(VECTOR_INDEX_NAME, VECTOR_INDEX_DEFINITION)
 		else:
-			embedding = response[0]
-	else:
-		raise ValueError(f"Unrecognized response structure from Gemini: {response}")
-	while isinstance(embedding, list) and len(embedding) > 0 and isinstance(embedding[0], list):
-		embedding = embedding[0]
-	flat = [float(x) if isinstance(x, (int, float)) else 0.0 for x in embedding]
-	if len(flat) == 3072:
-		half = len(flat) // 2
-		flat = [(flat[i] + flat[i + half]) / 2 for i in range(half)]
-	# Accept embeddings of various dimensions
-	
-	return flat
+			collection.create_search_index(SearchIndexModel(
+				definition=VECTOR_INDEX_DEFINITION,
+				name=VECTOR_INDEX_NAME,
+				type="vectorSearch",
+			))
+	except Exception as e:
+		print(f"Warning: could not create/update vector index '{VECTOR_INDEX_NAME}': {e}")
 
+def bump_corpus_version(db):
+	"""Tăng version của corpus sau mỗi lần ghi để cache retrieval của chatbot tự bỏ kết quả cũ."""
+	meta = db["meta"].find_one_and_update(
+		{"_id": "corpus"},
+		{"$inc": {"version": 1}, "$set": {"updated_at": time.time()}},
+		upsert=True,
+		return_document=True,
+	)
+	return meta["version"]
 
-def resize_embedding(embedding, target_dim=1024):
+def get_embedding(text, provider=None):
 	"""
-	Điều chỉnh kích thước embedding về đúng kích thước đích.
-	Nếu embedding nhỏ hơn, padding với 0.
-	Nếu embedding lớn hơn, cắt bớt.
+	Embedding đã chiếu về EMBEDDING_DIM và chuẩn hóa L2 bằng provider
+	(mặc định EMBEDDING_PROVIDER), cùng provider với chatbot khi truy vấn.
 	"""
-	current_dim = len(embedding)
-	
-	if current_dim == target_dim:
-		return embedding
-	
-	if current_dim < target_dim:
-		# Padding with zeros
-		return embedding + [0.0] * (target_dim - current_dim)
+	provider = provider or get_provider()
+	return provider.embed([text])[0].tolist()
+
+
+def get_embeddings(texts, provider=None):
+	"""Bản batch của get_embedding: một lần gọi provider cho cả danh sách."""
+	provider = provider or get_provider()
+	return provider.embed(list(texts)).tolist()
+
+
+def embed_records(items, provider):
+	"""
+	(item, embedding) cho các record embedding được, bằng một lần gọi provider.
+	Nếu cả batch lỗi thì thử lại từng record; record rỗng hoặc lỗi bị bỏ qua.
+	Trả về (kết quả, số record bị bỏ qua).
+	"""
+	pending, skipped = [], 0
+	for item in items:
+		embed_text = build_embed_text(item)
+		if not embed_text:
+			print(f"Warning: Empty embed_text for item with crawl_id {item.get('crawl_id')}, skipped")
+			skipped += 1
+			continue
+		pending.append((item, embed_text))
+	if not pending:
+		return [], skipped
+	try:
+		embeddings = get_embeddings([text for _, text in pending], provider)
+		return [(item, embedding) for (item, _), embedding in zip(pending, embeddings)], skipped
+	except Exception as e:
+		print(f"Error generating embeddings for a batch of {len(pending)} items ({e}), retrying one by one")
+	results = []
+	for item, embed_text in pending:
+		try:
+			results.append((item, get_embedding(embed_text, provider)))
+		except Exception as e:
+			print(f"Error generating embedding for item: {item.get('crawl_id')}, skipped. Error: {e}")
+			skipped += 1
+	return results, skipped
+
+
+def build_embed_text(item):
+	"""Ghép code + explanation thành văn bản để embedding."""
+	explanation = item.get("explanation", "") or ""
+	code = item.get("code", "")
+	# Đảm bảo code không phải None và chuyển thành chuỗi nếu cần
+	code = "" if code is None else str(code)
+	if code and explanation:
+		return code + "\n" + explanation
+	return code or explanation
+
+
+# Chunk mode: code dài được cắt theo cú pháp (import / component / hook / function)
+# thành các đoạn chồng lấn, mỗi đoạn trỏ về record gốc qua parent_id.
+CHUNK_MAX_CHARS = 1500
+CHUNK_OVERLAP_LINES = 3
+CHUNK_EXPLANATION_CHARS = 500
+
+
+def build_chunk_records(item, max_chars=CHUNK_MAX_CHARS, overlap_lines=CHUNK_OVERLAP_LINES):
+	"""
+	Tách một record thành các chunk record (code ngắn giữ nguyên một chunk).
+	Mỗi chunk giữ metadata dùng để filter và một đoạn explanation ngắn.
+	"""
+	parent_id = item.get("crawl_id")
+	code = item.get("code", "")
+	code = "" if code is None else str(code)
+	explanation = (item.get("explanation", "") or "")[:CHUNK_EXPLANATION_CHARS]
+	if len(code) > max_chars:
+		pieces = split_code(code, max_chars=max_chars, overlap_lines=overlap_lines)
 	else:
-		# Truncate
-		return embedding[:target_dim]
+		pieces = [{"text": code, "start_line": 1, "end_line": code.count("\n") + 1, "kind": None, "name": None}]
+	chunks = []
+	for i, piece in enumerate(pieces):
+		chunks.append({
+			"crawl_id": f"{parent_id}:{i}",
+			"parent_id": parent_id,
+			"chunk_index": i,
+			"chunk_count": len(pieces),
+			"start_line": piece["start_line"],
+			"end_line": piece["end_line"],
+			"kind": piece["kind"],
+			"name": piece["name"],
+			"type": item.get("type"),
+			"explanation": explanation,
+			"code": piece["text"],
+			"tags": item.get("tags", []),
+			"link": item.get("link", ""),
+			"code_language": item.get("code_language"),
+		})
+	return chunks
 
 
 def normalize_records(raw_records, source="normalized"):
@@ -105,12 +205,28 @@ def normalize_records(raw_records, source="normalized"):
 
 
 # --- Define the missing upsert_file function ---
-def upsert_file(json_path, source="normalized", target_collection=None):
-	import time
-	
+def upsert_file(json_path, source="normalized", target_collection=None, chunk=False, provider=None, layout=None):
+	"""
+	Embedding và upsert các record. Với chunk=True, mỗi record được tách
+	thành các chunk (build_chunk_records) và ghi vào collection chunk.
+	Mỗi document lưu tag của provider đã embedding nó (embedding_provider).
+	Với layout (ShardLayout), mỗi record được ghi vào shard của nó
+	(<collection>_<type>[_<partition>]) thay vì một collection chung.
+	Tombstone ({"crawl_id", "deleted": true}) xóa record đó (hoặc các chunk
+	của nó) khỏi mọi collection/shard đích.
+	"""
+	provider = provider or get_provider()
 	with open(json_path, "r", encoding="utf-8") as f:
 		data = json.load(f)
+	deleted_ids = sorted({r["crawl_id"] for r in data if r.get("deleted") and r.get("crawl_id")})
+	data = [r for r in data if not r.get("deleted")]
 	records = normalize_records(data, source=source)
+	if chunk:
+		parents = [r for r in records if r.get("crawl_id")]
+		records = [c for r in parents for c in build_chunk_records(r)]
+		print(f"Chunked {len(parents)} records into {len(records)} chunks")
+		if not target_collection:
+			target_collection = CHUNK_COLLECTION + provider.collection_suffix
 
 	# Kết nối MongoDB Atlas
 	MONGODB_URI = read_env_key("MONGODB_URI")
@@ -118,78 +234,103 @@ def upsert_file(json_path, source="normalized", target_collection=None):
 	db = client.get_default_database()
 	# Sử dụng target_collection nếu được cung cấp, nếu không sử dụng source làm tên collection
 	collection_name = target_collection if target_collection else source
-	collection = db[collection_name]
+	layout = layout if layout is not None and layout.enabled else None
+	collection_names = [name for name, _ in layout.shards(collection_name)] if layout else [collection_name]
+	if layout:
+		unknown = {r.get("type") for r in records} - set(layout.partitions)
+		if unknown:
+			raise ValueError(f"Không có shard cho type: {', '.join(map(str, unknown))}")
 
+	for name in collection_names:
+		collection = db[name]
+		# Tạo unique index cho crawl_id
+		collection.create_index("crawl_id", unique=True)
+		if chunk:
+			collection.create_index("parent_id")
+		ensure_vector_index(collection)
 	
-	# Tạo unique index cho crawl_id
-	collection.create_index("crawl_id", unique=True)
-	
-	# Xử lý tất cả records với bulk operations để tăng hiệu suất
-	operations = []
-	batch_size = 50  # Giảm batch size vì phải gọi embedding API
+	if deleted_ids:
+		# Record đã biến mất khỏi nguồn: không biết shard nào giữ nó nên xóa ở tất cả
+		query = {"parent_id": {"$in": deleted_ids}} if chunk else {"crawl_id": {"$in": deleted_ids}}
+		removed = sum(db[name].delete_many(query).deleted_count for name in collection_names)
+		print(f"Deleted {removed} documents of {len(deleted_ids)} removed records")
+
+	# Xử lý tất cả records với bulk operations để tăng hiệu suất (một danh sách cho mỗi collection/shard)
+	operations = {name: [] for name in collection_names}
+	batch_size = 50  # Số record mỗi lần gọi embedding API và mỗi bulk write
+	skipped = 0
 	
-	for item in tqdm(records, desc="Generating embeddings and preparing upsert", unit="item"):
-		explanation = item.get("explanation", "")
-		code = item.get("code", "")
+	progress = tqdm(total=len(records), desc="Generating embeddings and preparing upsert", unit="item")
+	for start in range(0, len(records), batch_size):
+		# Một lần gọi embedding cho mỗi batch_size record.
+		# Không bao giờ ghi vector 0: record lỗi bị bỏ qua (lần upsert sau sẽ thử lại)
+		embedded, failed = embed_records(records[start:start + batch_size], provider)
+		skipped += failed
+		progress.update(min(batch_size, len(records) - start))
 
-		# Đảm bảo code không phải None và chuyển thành chuỗi nếu cần
-		if code is None:
-			code = ""
-		else:
-			code = str(code)
+		for item, embedding in embedded:
+			doc = dict(item)
+			doc["embedding"] = embedding
+			doc["embedding_provider"] = provider.tag
+			crawl_id = doc.get("crawl_id")
+			target = layout.route(collection_name, doc) if layout else collection_name
 
-		embed_text = code
-		if explanation:
-			if embed_text:
-				embed_text += "\n" + explanation
-			else:
-				embed_text = explanation
+			if crawl_id:
+				# Sử dụng UpdateOne với upsert để tránh trùng lặp
+				operations[target].append(
+					UpdateOne(
+						{"crawl_id": crawl_id},
+						{"$set": doc},
+						upsert=True
+					)
+				)
+				# Record gốc ngắn lại sau khi crawl lại: xóa các chunk cũ thừa ra
+				if chunk and doc["chunk_index"] == doc["chunk_count"] - 1:
+					operations[target].append(DeleteMany({"parent_id": doc["parent_id"], "chunk_index": {"$gte": doc["chunk_count"]}}))
 
-		try:
-			if not embed_text:
-				print(f"Warning: Empty embed_text for item with crawl_id {item.get('crawl_id')}")
-				embedding = [0.0] * 1024
-			else:
-				raw_embedding = get_embedding(embed_text)
-				embedding = resize_embedding(raw_embedding, target_dim=1024)
-		except Exception as e:
-			print(f"Error generating embedding for item: {item.get('crawl_id')}. Error: {e}")
-			embedding = [0.0] * 1024  # Default embedding in case of error
+			# Thực hiện bulk write khi đạt batch_size
+			if len(operations[target]) >= batch_size:
+				result = db[target].bulk_write(operations[target])
+				operations[target] = []
+		time.sleep(0.1)  # Tránh rate limit của Gemini API
+	progress.close()
 
-		doc = dict(item)
-		doc["embedding"] = embedding
-		crawl_id = doc.get("crawl_id")
-		
-		if crawl_id:
-			# Sử dụng UpdateOne với upsert để tránh trùng lặp
-			operations.append(
-				UpdateOne(
-					{"crawl_id": crawl_id},
-					{"$set": doc},
-					upsert=True
-				)
-			)
-		
-		# Thực hiện bulk write khi đạt batch_size
-		if len(operations) >= batch_size:
-			result = collection.bulk_write(operations)
-			operations = []
-			time.sleep(0.1)  # Tránh rate limit của Gemini API
-	
-	# Xử lý batch cuối cùng
-	if operations:
-		result = collection.bulk_write(operations)
-		print(f"Final batch: {result.upserted_count} inserted, {result.modified_count} updated")
+	# Xử lý batch cuối cùng của từng collection
+	for name, pending in operations.items():
+		if pending:
+			result = db[name].bulk_write(pending)
+			print(f"Final batch ({name}): {result.upserted_count} inserted, {result.modified_count} updated")
+
+	if skipped:
+		print(f"⚠️ {skipped} records skipped (no embedding)")
+	if records or deleted_ids:
+		print(f"Corpus version: {bump_corpus_version(db)}")
 		
 	client.close()
 
 
 def main():
-	# Cấu hình Gemini (embedding ngoài, không phát sinh phí Pinecone embedding)
-	GEMINI_API_KEY = read_env_key("GEMINI_API_KEY")
-	genai.configure(api_key=GEMINI_API_KEY)
+	import argparse
+	parser = argparse.ArgumentParser(description="Embed và upsert normalized.json lên MongoDB Atlas")
+	parser.add_argument("--chunk", action="store_true", help=f"Tách code thành chunk và ghi vào '{CHUNK_COLLECTION}'")
+	parser.add_argument("--provider", choices=["gemini", "local"], default=None,
+		help="Embedding provider (mặc định EMBEDDING_PROVIDER); 'local' ghi vào các collection *_local")
+	parser.add_argument("--shards", default=None,
+		help='Ghi theo shard, vd "react_example,stackoverflow:4" (mặc định biến môi trường SHARDS)')
+	args = parser.parse_args()
+	layout = ShardLayout.from_spec(args.shards) if args.shards is not None else ShardLayout.from_spec()
 
-	upsert_file("normalized.json", source="normalized", target_collection="normalized")
+	provider = get_provider(args.provider)
+	if provider.name == "gemini":
+		# Cấu hình Gemini (embedding ngoài, không phát sinh phí Pinecone embedding)
+		GEMINI_API_KEY = read_env_key("GEMINI_API_KEY")
+		genai.configure(api_key=GEMINI_API_KEY)
+	print(f"Embedding provider: {provider.tag}")
+
+	if args.chunk:
+		upsert_file("normalized.json", source="normalized", chunk=True, provider=provider, layout=layout)
+	else:
+		upsert_file("normalized.json", source="normalized", target_collection="normalized" + provider.collection_suffix, provider=provider, layout=layout)
 
 
 if __name__ == "__main__":
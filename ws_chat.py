@@ -0,0 +1,280 @@
+import os
+import json
+import asyncio
+from collections import deque
+
+from fastapi import WebSocket, WebSocketDisconnect
+from admission import Overloaded
+from search_filters import parse_filters
+from code_chunker import chunk_upload, select_upload_context
+from chatbot import stream_chatbot_response
+
+# WebSocket chat channel (/ws/chat). One connection keeps the model, filters,
+# history and processed upload, so a follow-up turn is a single small JSON
+# frame instead of a multipart POST that re-sends everything.
+#
+# Client -> server (JSON text frames):
+#   {"type": "config", "model": ..., "filters": ..., "topk": ..., "conversation_id": ...}
+#       (conversation_id: one issued to this client, or "new" to start one)
+#   {"type": "upload", "filename": ..., "content": ...}   | {"type": "clear_upload"}
+#   {"type": "ask", "id": ..., "question": ...}           (may be sent while a turn runs: pipelined)
+#   {"type": "cancel", "id": ...}                          (no id: the running turn)
+#   {"type": "ping"}
+# Server -> client:
+#   ready, config_ok, upload_ok, queued, start, delta {text}, done {answer, history_version, degraded?},
+#   cancelled, error {detail, id?, retry_after?}, pong
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "200"))
+WS_IDLE_TIMEOUT_S = float(os.getenv("WS_IDLE_TIMEOUT_S", "300"))
+WS_MAX_PENDING = int(os.getenv("WS_MAX_PENDING", "8"))
+WS_MAX_HISTORY = int(os.getenv("WS_MAX_HISTORY", "40"))
+WS_MAX_FRAME_BYTES = int(os.getenv("WS_MAX_FRAME_BYTES", str(1024 * 1024)))
+
+# Close codes (RFC 6455): going away, policy violation, try again later
+CLOSE_IDLE = 1001
+CLOSE_POLICY = 1008
+CLOSE_TRY_AGAIN = 1013
+
+
+class ChatSession:
+    """State and turn queue of one WebSocket connection; turns run one at a time, in order."""
+
+    def __init__(self, websocket, client_id, admission, conversations, minify,
+                 max_upload_bytes, upload_context_chars):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.admission = admission
+        self.conversations = conversations
+        self.minify = minify
+        self.max_upload_bytes = max_upload_bytes
+        self.upload_context_chars = upload_context_chars
+        self.model = "gpt-oss-120b"
+        self.filters = {}
+        self.topk = 5
+        self.conversation_id = None
+        self.history = []
+        self.upload = None  # (filename, minified chunks)
+        self.pending = deque()
+        self.current = None  # (turn id, task)
+        self.turns = 0
+        self.cancelled = 0
+        self._wakeup = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, payload):
+        async with self._send_lock:
+            await self.websocket.send_text(json.dumps(payload, ensure_ascii=False))
+
+    @property
+    def busy(self):
+        return self.current is not None or bool(self.pending)
+
+    # Client messages
+    async def handle(self, message):
+        kind = message.get("type")
+        if kind == "ask":
+            await self._ask(message)
+        elif kind == "cancel":
+            await self._cancel(message.get("id"))
+        elif kind == "config":
+            await self._config(message)
+            await self.send({"type": "config_ok", "model": self.model, "filters": self.filters,
+                             "topk": self.topk, "conversation_id": self.conversation_id,
+                             "history_version": await self._version()})
+        elif kind == "upload":
+            self._store_upload(message)
+            await self.send({"type": "upload_ok", "filename": self.upload[0],
+                             "chars": sum(len(chunk["text"]) for chunk in self.upload[1])})
+        elif kind == "clear_upload":
+            self.upload = None
+            await self.send({"type": "upload_ok", "filename": None, "chars": 0})
+        elif kind == "ping":
+            await self.send({"type": "pong"})
+        else:
+            raise ValueError(f"Unknown message type '{kind}'")
+
+    async def _config(self, message):
+        if "filters" in message:
+            self.filters = parse_filters(message["filters"])
+        if message.get("model"):
+            self.model = str(message["model"])
+        if message.get("topk"):
+            self.topk = max(1, min(int(message["topk"]), 20))
+        if "conversation_id" in message:
+            conversation_id = message["conversation_id"] or None
+            history = []
+            if conversation_id == "new":
+                conversation_id = await self.conversations.create(self.client_id)
+            elif conversation_id:
+                history = await self.conversations.history(conversation_id, self.client_id)
+                if history is None:
+                    raise ValueError("Unknown conversation.")
+            self.conversation_id, self.history = conversation_id, history
+
+    def _store_upload(self, message):
+        content = message.get("content") or ""
+        if len(content.encode("utf-8")) > self.max_upload_bytes:
+            raise ValueError(f"File exceeds {self.max_upload_bytes // 1024}KB.")
+        # Chunked (on the original lines) and minified once per upload, not once per question
+        self.upload = (message.get("filename") or "upload",
+                       chunk_upload(content, self.upload_context_chars, self.minify))
+
+    async def _version(self):
+        if self.conversation_id:
+            return await self.conversations.version(self.conversation_id, self.client_id)
+        return len(self.history)
+
+    async def _ask(self, message):
+        question = (message.get("question") or "").strip()
+        self.turns += 1
+        turn_id = message.get("id") or f"t{self.turns}"
+        if not question:
+            await self.send({"type": "error", "id": turn_id, "detail": "Empty question."})
+            return
+        if len(self.pending) >= WS_MAX_PENDING:
+            await self.send({"type": "error", "id": turn_id, "detail": f"At most {WS_MAX_PENDING} queued questions."})
+            return
+        self.pending.append((turn_id, question))
+        self._wakeup.set()
+        await self.send({"type": "queued", "id": turn_id, "position": len(self.pending)})
+
+    async def _cancel(self, turn_id):
+        if self.current is not None and turn_id in (None, self.current[0]):
+            self.current[1].cancel()  # the worker reports "cancelled"
+            return
+        for item in list(self.pending):
+            if item[0] == turn_id:
+                self.pending.remove(item)
+                await self.send({"type": "cancelled", "id": turn_id})
+                return
+        await self.send({"type": "error", "id": turn_id, "detail": "No such question in progress."})
+
+    # Turn worker
+    async def run_turns(self):
+        while True:
+            if not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            turn_id, question = self.pending.popleft()
+            task = asyncio.create_task(self._turn(turn_id, question))
+            self.current = (turn_id, task)
+            try:
+                await asyncio.wait({task})
+            finally:
+                self.current = None
+            if task.cancelled():
+                self.cancelled += 1
+                await self.send({"type": "cancelled", "id": turn_id})
+            elif task.exception() is not None:
+                return  # the socket is gone; the receive loop ends the session
+
+    async def _turn(self, turn_id, question):
+        attachment = None
+        if self.upload:
+            attachment = select_upload_context(self.upload[0], self.upload[1], question, self.upload_context_chars)
+        parts, trace = [], {}
+        try:
+            async with self.admission.slot(self.client_id):
+                await self.send({"type": "start", "id": turn_id})
+                history = list(self.history)
+                async for delta in stream_chatbot_response(question, history, self.topk, self.model,
+                                                           self.filters, attachment, trace):
+                    parts.append(delta)
+                    await self.send({"type": "delta", "id": turn_id, "text": delta})
+        except Overloaded as e:
+            await self.send({"type": "error", "id": turn_id, "detail": f"Server busy ({e.reason}), retry later.",
+                             "retry_after": e.retry_after})
+            return
+        except (asyncio.CancelledError, WebSocketDisconnect):
+            raise
+        except Exception as e:
+            print(f"[DEBUG] WebSocket turn error: {e}")
+            await self.send({"type": "error", "id": turn_id, "detail": f"Internal Server Error: {e}"})
+            return
+
+        if "degraded" in trace:
+            # Shown to the user but, like a cancelled turn, kept out of the history
+            await self.send({"type": "done", "id": turn_id, "answer": "".join(parts),
+                             "degraded": trace["degraded"], "history_version": await self._version()})
+            return
+
+        # Only completed turns enter the history (a cancelled one leaves no trace)
+        turn = history[len(self.history):]
+        self.history = history[-WS_MAX_HISTORY:]
+        if self.conversation_id:
+            await self.conversations.append(self.conversation_id, self.client_id, turn)
+        await self.send({"type": "done", "id": turn_id, "answer": turn[-1]["content"] if turn else "",
+                         "history_version": await self._version()})
+
+
+class ChatSocketServer:
+    """Accepts /ws/chat connections within the connection limit and drives their sessions."""
+
+    def __init__(self, admission, conversations, minify, max_upload_bytes, upload_context_chars,
+                 max_connections=WS_MAX_CONNECTIONS, idle_timeout=WS_IDLE_TIMEOUT_S):
+        self.admission = admission
+        self.conversations = conversations
+        self.minify = minify
+        self.max_upload_bytes = max_upload_bytes
+        self.upload_context_chars = upload_context_chars
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.connections = 0
+        self.metrics = {"accepted": 0, "rejected": 0, "idle_closed": 0, "turns": 0, "turns_cancelled": 0}
+
+    async def serve(self, websocket: WebSocket, client_id):
+        await websocket.accept()
+        if self.connections >= self.max_connections:
+            self.metrics["rejected"] += 1
+            await websocket.send_text(json.dumps({"type": "error", "detail": "Too many connections, retry later."}))
+            await websocket.close(code=CLOSE_TRY_AGAIN)
+            return
+        self.connections += 1
+        self.metrics["accepted"] += 1
+        session = ChatSession(websocket, client_id, self.admission, self.conversations, self.minify,
+                              self.max_upload_bytes, self.upload_context_chars)
+        worker = asyncio.create_task(session.run_turns())
+        try:
+            await session.send({"type": "ready", "model": session.model})
+            await self._receive_loop(websocket, session)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.connections -= 1
+            worker.cancel()
+            if session.current is not None:
+                session.current[1].cancel()
+                session.cancelled += 1
+            self.metrics["turns"] += session.turns
+            self.metrics["turns_cancelled"] += session.cancelled
+
+    async def _receive_loop(self, websocket, session):
+        while True:
+            try:
+                frame = await asyncio.wait_for(websocket.receive(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                if session.busy:
+                    continue  # a long generation is not idleness
+                self.metrics["idle_closed"] += 1
+                await websocket.close(code=CLOSE_IDLE)
+                return
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            raw = frame.get("text")
+            if raw is None:
+                await session.send({"type": "error", "id": None, "detail": "Only JSON text frames are accepted."})
+                continue
+            if len(raw) > WS_MAX_FRAME_BYTES:
+                await websocket.close(code=CLOSE_POLICY)
+                return
+            try:
+                message = json.loads(raw)
+                if not isinstance(message, dict):
+                    raise ValueError("Expected a JSON object")
+                await session.handle(message)
+            except (ValueError, TypeError) as e:
+                await session.send({"type": "error", "id": None, "detail": str(e)})
+
+    def stats(self):
+        return dict(self.metrics, connections=self.connections, max_connections=self.max_connections,
+                    idle_timeout_s=self.idle_timeout)